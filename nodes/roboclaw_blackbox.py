@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""Dump the serial black box a roboclaw_node left behind
+
+Reads the ring while the node runs or after it died. A respawned node keeps the previous ring as
+<path>.prev.
+"""
+from __future__ import print_function
+
+import argparse
+import binascii
+import datetime
+import json
+
+from roboclaw_driver.blackbox import read_ring
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", nargs="?", default="/dev/shm/roboclaw_blackbox")
+    parser.add_argument("--last", type=int, default=50, help="number of most recent frames to show, 0 for all")
+    parser.add_argument("--failed", action="store_true", help="only show failed transactions")
+    parser.add_argument("--json", action="store_true", help="one JSON object per frame")
+    args = parser.parse_args()
+
+    header, records = read_ring(args.path)
+    if args.failed:
+        records = [record for record in records if not record["ok"]]
+    if args.last:
+        records = records[-args.last:]
+
+    if not args.json:
+        print("pid %d, created %s, %d slots, %d frames shown" % (
+            header["pid"], datetime.datetime.fromtimestamp(header["created"]), header["slots"], len(records)))
+    for record in records:
+        tx = binascii.hexlify(bytes(record["tx"])).decode()
+        rx = binascii.hexlify(bytes(record["rx"])).decode()
+        if args.json:
+            print(json.dumps(dict(record, tx=tx, rx=rx)))
+            continue
+        print("%s %8d 0x%02x %-24s %-6s %7.3f ms try %d crc %d timeout %d  tx %s  rx %s" % (
+            datetime.datetime.fromtimestamp(record["stamp"]).strftime("%H:%M:%S.%f"), record["seq"],
+            record["address"], record["command"], "ok" if record["ok"] else "FAILED", 1e3 * record["latency"],
+            record["attempts"], record["crc_errors"], record["timeouts"], tx, rx))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,28 +2,74 @@
 from __future__ import division
 from math import pi, cos, sin
 
+import functools
+import os
+import socket
+import threading
+import time
+
+import actionlib
 import diagnostic_msgs
+import numpy as np
 import diagnostic_updater
+from roboclaw_driver import kinematics, realtime, settings
+from roboclaw_driver.blackbox import BlackBox
+from roboclaw_driver.encoders import EncoderAccumulator
+from roboclaw_driver.errors import ErrorDecoder
+from roboclaw_driver.hooks import TraceHook
+from roboclaw_driver.ioprocess import IOProcess, RemoteRoboclaw
+from roboclaw_driver.metrics import DriverMetrics, MetricsServer
+from roboclaw_driver.ramp import AccelLimiter
+from roboclaw_driver.rawserial import RawSerial
 from roboclaw_driver.roboclaw_driver import Roboclaw
+from roboclaw_driver.simulator import Motor, SimClock, SimulatedRoboclaw, SimulatedSerial
+from roboclaw_driver.velocity import SpeedFilter
+from roboclaw_driver.trajectory import BUFFER_IDLE, TrajectoryStreamer, move_duration, wheel_segments
+from roboclaw_driver.telemetry import RawTelemetrySampler, TelemetryCache, TelemetryPoller
+from roboclaw_driver.watchdog import Watchdog
+from roboclaw_driver.worker import ODOMETRY, SAFETY, SETPOINT, TELEMETRY, PortWorker, Rendezvous
 import rospy
 import tf
 from geometry_msgs.msg import Quaternion, Twist
 from nav_msgs.msg import Odometry
+from rosgraph_msgs.msg import Clock
+from dynamic_reconfigure.server import Server
+from roboclaw_ros.cfg import RoboclawConfig
+from roboclaw_ros.msg import MoveToPositionAction, MoveToPositionFeedback, MoveToPositionResult
+from std_msgs.msg import Float64, Int32MultiArray, MultiArrayDimension
+from trajectory_msgs.msg import JointTrajectory
 
 __author__ = "bwbazemore@uga.edu (Brad Bazemore)"
 
 class EncoderOdom:
-    def __init__(self, ticks_per_meter, base_width):
+    def __init__(self, ticks_per_meter, base_width, loop_rate=10.0, odom_rate=10.0, tf_rate=10.0):
+        """Integrate every update, publish odom and tf at their own decimated rates (<= 0 disables)"""
         self.TICKS_PER_METER = ticks_per_meter
         self.BASE_WIDTH = base_width
         self.odom_pub = rospy.Publisher('/odom', Odometry, queue_size=10)
+        self.tf_broadcaster = None
+        self.set_rates(loop_rate, odom_rate, tf_rate)
+        self.update_count = 0
         self.cur_x = 0
         self.cur_y = 0
         self.cur_theta = 0.0
-        self.last_enc_left = 0
-        self.last_enc_right = 0
+        self.last_enc_left = None
+        self.last_enc_right = None
         self.last_enc_time = rospy.Time.now()
 
+    def set_rates(self, loop_rate, odom_rate, tf_rate):
+        self.odom_decimation = self.decimation(loop_rate, odom_rate)
+        self.tf_decimation = self.decimation(loop_rate, tf_rate)
+        if self.tf_decimation and self.tf_broadcaster is None:
+            self.tf_broadcaster = tf.TransformBroadcaster()
+
+    @staticmethod
+    def decimation(loop_rate, rate):
+        """Number of loop iterations between publishes, 0 when disabled"""
+        if rate <= 0:
+            return 0
+        return max(1, int(round(loop_rate / rate)))
+
     @staticmethod
     def normalize_angle(angle):
         while angle > pi:
@@ -32,7 +78,15 @@ class EncoderOdom:
             angle += 2.0 * pi
         return angle
 
-    def update(self, enc_left, enc_right):
+    def update(self, enc_left, enc_right, speeds=None):
+        """Integrate the encoder counts, returns the twist from speeds (ticks/s left, right) when given"""
+        if self.last_enc_left is None:
+            # the first counts are only a reference, whatever they are
+            self.last_enc_left = enc_left
+            self.last_enc_right = enc_right
+            self.last_enc_time = rospy.Time.now()
+            return 0.0, 0.0
+
         left_ticks = enc_left - self.last_enc_left
         right_ticks = enc_right - self.last_enc_right
         self.last_enc_left = enc_left
@@ -58,7 +112,12 @@ class EncoderOdom:
             self.cur_y -= r * (cos(d_theta + self.cur_theta) - cos(self.cur_theta))
             self.cur_theta = self.normalize_angle(self.cur_theta + d_theta)
 
-        if abs(d_time) < 0.000001:
+        if speeds is not None:
+            vel_left = speeds[0] / self.TICKS_PER_METER
+            vel_right = speeds[1] / self.TICKS_PER_METER
+            vel_x = (vel_right + vel_left) / 2.0
+            vel_theta = (vel_right - vel_left) / self.BASE_WIDTH
+        elif abs(d_time) < 0.000001:
             vel_x = 0.0
             vel_theta = 0.0
         else:
@@ -67,20 +126,31 @@ class EncoderOdom:
 
         return vel_x, vel_theta
 
-    def update_publish(self, enc_left, enc_right):
-        vel_x, vel_theta = self.update(enc_left, enc_right)
-        self.publish_odom(self.cur_x, self.cur_y, self.cur_theta, vel_x, vel_theta)
+    def update_publish(self, enc_left, enc_right, speeds=None):
+        vel_x, vel_theta = self.update(enc_left, enc_right, speeds)
+        self.update_count += 1
+        publish_odom = self.odom_decimation and self.update_count % self.odom_decimation == 0
+        publish_tf = self.tf_decimation and self.update_count % self.tf_decimation == 0
+        if not (publish_odom or publish_tf):
+            return
 
-    def publish_odom(self, cur_x, cur_y, cur_theta, vx, vth):
-        quat = tf.transformations.quaternion_from_euler(0, 0, cur_theta)
         current_time = rospy.Time.now()
+        if publish_tf:
+            self.publish_tf(self.cur_x, self.cur_y, self.cur_theta, current_time)
+        if publish_odom:
+            self.publish_odom(self.cur_x, self.cur_y, self.cur_theta, vel_x, vel_theta, current_time)
+
+    def publish_tf(self, cur_x, cur_y, cur_theta, current_time):
+        self.tf_broadcaster.sendTransform((cur_x, cur_y, 0),
+                                          tf.transformations.quaternion_from_euler(0, 0, -cur_theta),
+                                          current_time,
+                                          "base_link",
+                                          "odom")
 
-        br = tf.TransformBroadcaster()
-        br.sendTransform((cur_x, cur_y, 0),
-                         tf.transformations.quaternion_from_euler(0, 0, -cur_theta),
-                         current_time,
-                         "base_link",
-                         "odom")
+    def publish_odom(self, cur_x, cur_y, cur_theta, vx, vth, current_time=None):
+        quat = tf.transformations.quaternion_from_euler(0, 0, cur_theta)
+        if current_time is None:
+            current_time = rospy.Time.now()
 
         odom = Odometry()
         odom.header.stamp = current_time
@@ -107,203 +177,1044 @@ class EncoderOdom:
         self.odom_pub.publish(odom)
 
 
+class Controller:
+    """One roboclaw (device, address) and the motor role of each of its two channels"""
+    def __init__(self, name, roboclaw, worker, roles, channels, error_decoder, telemetry_decimation, raw_decimation,
+                 velocity_source="speed"):
+        self.name = name
+        self.roboclaw = roboclaw
+        self.worker = worker
+        self.roles = roles
+        self.channels = channels  # index of m1 and m2 in the node wide list of wheel commands
+        self.error_decoder = error_decoder
+        self.last_error_status = None
+        self.encoders = (None, None)
+        # the counts unwrapped, what odometry integrates
+        self.accumulators = (EncoderAccumulator(), EncoderAccumulator())
+        self.totals = (None, None)
+        # qpps reported by the roboclaw, what the odom twist comes from unless velocity_source is encoders
+        self.velocity_source = velocity_source
+        self.speeds = (None, None)
+        # set when the roboclaw is a RemoteRoboclaw, the I/O process then reads the encoders on its own
+        self.io = getattr(roboclaw, "io", None)
+        self.last_sample = None
+        self.tick_job = None
+        self.telemetry_job = None
+        self.streamer = TrajectoryStreamer(roboclaw)
+
+        # vitals are polled into a cache one read at a time, diagnostics never touch the serial port
+        self.telemetry = TelemetryCache()
+        self.telemetry_poller = TelemetryPoller(roboclaw, self.telemetry, decimation=telemetry_decimation)
+        self.raw_sampler = RawTelemetrySampler(roboclaw, self.telemetry, decimation=raw_decimation)
+        if self.raw_sampler.decimation > 0:
+            self.raw_pub = rospy.Publisher("~%s/telemetry_raw" % name, Int32MultiArray, queue_size=10)
+            self.raw_msg = Int32MultiArray()
+            self.raw_msg.layout.dim = [MultiArrayDimension(",".join(RawTelemetrySampler.FIELDS),
+                                                           len(RawTelemetrySampler.FIELDS),
+                                                           len(RawTelemetrySampler.FIELDS))]
+
+        # only published when the error bitmask changes
+        self.metrics = DriverMetrics(name)
+        roboclaw.add_hook(self.metrics)
+        self.last_link = {}, rospy.get_time()
+
+        self.error_pub = rospy.Publisher("~%s/errors" % name, diagnostic_msgs.msg.DiagnosticStatus,
+                                         queue_size=10, latch=True)
+
+    def tick(self):
+        """Read the encoders (and speeds) and keep any trajectory streaming, runs on the port worker"""
+        enc1, enc2 = None, None
+        total1, total2 = None, None
+        speed1, speed2 = None, None
+        resets = sum(accumulator.resets for accumulator in self.accumulators)
+
+        if self.io is not None:
+            # only a sample the I/O process took since the last tick is integrated
+            latest = self.io.sample(self.roboclaw.key)
+            if latest is not None and latest[0] != self.last_sample and latest[2] is not None:
+                self.last_sample = latest[0]
+                _, enc1, status1, enc2, status2, speed1, speed2 = latest[2]
+                # stamped when the I/O process read them, a dropped sample only widens the gap
+                total1 = self.accumulators[0].update(enc1, status1, latest[1])
+                total2 = self.accumulators[1].update(enc2, status2, latest[1])
+            else:
+                enc1, enc2 = self.encoders
+        elif self.velocity_source == "encoders":
+            # TODO need find solution to the OSError11 looks like sync problem with serial
+            try:
+                _, enc1, status1 = self.roboclaw.ReadEncM1()
+                total1 = self.accumulators[0].update(enc1, status1)
+            except ValueError:
+                pass
+            except OSError as e:
+                rospy.logwarn("%s ReadEncM1 OSError: %d", self.name, e.errno)
+                rospy.logdebug(e)
+
+            try:
+                _, enc2, status2 = self.roboclaw.ReadEncM2()
+                total2 = self.accumulators[1].update(enc2, status2)
+            except ValueError:
+                pass
+            except OSError as e:
+                rospy.logwarn("%s ReadEncM2 OSError: %d", self.name, e.errno)
+                rospy.logdebug(e)
+        else:
+            # counts and speeds in one round trip, so they describe the same instant
+            try:
+                ok, enc1, status1, enc2, status2, speed1, speed2 = \
+                    self.roboclaw.ReadEncodersSpeeds(self.velocity_source == "ispeed")
+                if ok:
+                    total1 = self.accumulators[0].update(enc1, status1)
+                    total2 = self.accumulators[1].update(enc2, status2)
+                else:
+                    enc1, enc2, speed1, speed2 = None, None, None, None
+            except OSError as e:
+                enc1, enc2, speed1, speed2 = None, None, None, None
+                rospy.logwarn("%s ReadEncodersSpeeds OSError: %d", self.name, e.errno)
+                rospy.logdebug(e)
+
+        try:
+            self.streamer.service()
+        except OSError as e:
+            rospy.logwarn("%s Trajectory OSError: %d", self.name, e.errno)
+            rospy.logdebug(e)
+
+        self.encoders = (enc1, enc2)
+        self.totals = (total1, total2)
+        self.speeds = (speed1, speed2)
+        if sum(accumulator.resets for accumulator in self.accumulators) != resets:
+            rospy.logwarn("%s encoder count jumped, taken as a counter reset", self.name)
+
+    def poll_telemetry(self):
+        """Read the telemetry that is due, runs on the port worker"""
+        polled, sample = None, None
+        try:
+            polled = self.telemetry_poller.poll()
+        except OSError as e:
+            rospy.logwarn("%s Telemetry OSError: %d", self.name, e.errno)
+            rospy.logdebug(e)
+
+        try:
+            sample = self.raw_sampler.poll()
+            if sample is not None:
+                sample = list(sample)
+        except OSError as e:
+            rospy.logwarn("%s Raw telemetry OSError: %d", self.name, e.errno)
+            rospy.logdebug(e)
+        return polled, sample
+
+    def command(self, motor1_command, motor2_command):
+        """Send pwm commands to both channels, runs on the port worker"""
+        with self.roboclaw.deferred():
+            if motor1_command >= 0:
+                self.roboclaw.ForwardM1(motor1_command)
+            else:
+                self.roboclaw.BackwardM1(-motor1_command)
+
+            if motor2_command >= 0:
+                self.roboclaw.ForwardM2(motor2_command)
+            else:
+                self.roboclaw.BackwardM2(-motor2_command)
+
+    def speed(self, motor1_speed, motor2_speed, motor1_accel=None, motor2_accel=None, replied=False):
+        """Send closed loop speeds in qpps, ramped by the controller if accelerations are given, False if not sent
+
+        Through the I/O process only a replied call waits for the roboclaw, otherwise it always returns True.
+        """
+        if replied:
+            return self.send_speed(motor1_speed, motor2_speed, motor1_accel, motor2_accel)
+        with self.roboclaw.deferred():
+            return self.send_speed(motor1_speed, motor2_speed, motor1_accel, motor2_accel)
+
+    def send_speed(self, motor1_speed, motor2_speed, motor1_accel, motor2_accel):
+        if motor1_accel is None:
+            return self.roboclaw.SpeedM1M2(motor1_speed, motor2_speed)
+        return self.roboclaw.SpeedAccelM1M2_2(motor1_accel, motor1_speed, motor2_accel, motor2_speed)
+
+    def position(self, accel, speed, deccel, position1, position2):
+        """Start a move of both channels to absolute encoder counts, replacing any buffered motion"""
+        return self.roboclaw.SpeedAccelDeccelPositionM1M2(accel, speed, deccel, position1,
+                                                          accel, speed, deccel, position2, 1)
+
+    def stop(self):
+        """Hard stop, zero duty on both channels"""
+        with self.roboclaw.deferred():
+            self.roboclaw.ForwardM1(0)
+            self.roboclaw.ForwardM2(0)
+
+    def publish(self, polled, sample):
+        """Publish what the last tick read, runs on the main thread"""
+        if polled == "error":
+            self.publish_error_change()
+        if sample is not None:
+            self.raw_msg.data = sample
+            self.raw_pub.publish(self.raw_msg)
+
+    def publish_error_change(self):
+        """Publish the decoded error status if the bitmask changed since the last read"""
+        status, _ = self.telemetry.get("error")
+        if status is None or status == self.last_error_status:
+            return
+        raised, cleared = self.error_decoder.changes(self.last_error_status, status)
+        self.last_error_status = status
+        level, message, _ = self.error_decoder.decode(status)
+
+        msg = diagnostic_msgs.msg.DiagnosticStatus()
+        msg.level = level
+        msg.name = "%s %s" % (rospy.get_name(), self.name)
+        msg.hardware_id = "Roboclaw %s" % self.name
+        msg.message = message
+        msg.values = [diagnostic_msgs.msg.KeyValue("status", "0x%04x" % status),
+                      diagnostic_msgs.msg.KeyValue("raised", ", ".join(raised)),
+                      diagnostic_msgs.msg.KeyValue("cleared", ", ".join(cleared))]
+        self.error_pub.publish(msg)
+        if raised:
+            rospy.logwarn("Roboclaw %s error raised: %s", self.name, ", ".join(raised))
+
+    def check_vitals(self, stat):
+        """Report battery voltage and temperatures from the telemetry cache"""
+        status, age = self.telemetry.get("error")
+        if status is None:
+            stat.summary(diagnostic_msgs.msg.DiagnosticStatus.STALE, "No telemetry yet")
+            return stat
+        state, message, _ = self.error_decoder.decode(status)
+        stat.summary(state, message)
+        for key, label in (("main_battery", "Main Batt V:"), ("logic_battery", "Logic Batt V:"),
+                           ("temp1", "Temp1 C:"), ("temp2", "Temp2 C:")):
+            value, _ = self.telemetry.get(key)
+            if value is not None:
+                stat.add(label, float(value / 10))
+        stat.add("Telemetry age s:", self.telemetry.oldest_age(self.telemetry_poller.keys))
+        return stat
+
+    def check_link(self, stat):
+        """Report the driver metrics since the last diagnostics update, warn on a degrading link"""
+        counters, latency = self.metrics.totals()
+        now = rospy.get_time()
+        last, last_stamp = self.last_link
+        self.last_link = counters, now
+        delta = dict((name, counters[name] - last.get(name, 0)) for name in counters)
+        elapsed = max(now - last_stamp, 1e-3)
+        failed = delta["failures"] / max(delta["transactions"], 1)
+        if not delta["transactions"]:
+            # the encoders are read every tick, a link without transactions is not being serviced
+            stat.summary(diagnostic_msgs.msg.DiagnosticStatus.WARN, "No transactions")
+        elif failed > 0.1:
+            stat.summary(diagnostic_msgs.msg.DiagnosticStatus.ERROR, "%.0f%% of transactions failed" % (100 * failed))
+        elif failed > 0.01 or delta["crc_errors"] or delta["timeouts"]:
+            stat.summary(diagnostic_msgs.msg.DiagnosticStatus.WARN, "Link errors")
+        else:
+            stat.summary(diagnostic_msgs.msg.DiagnosticStatus.OK, "Link OK")
+        stat.add("Transactions/s", "%.1f" % (delta["transactions"] / elapsed))
+        for name in ("failures", "retries", "crc_errors", "timeouts", "resyncs"):
+            stat.add(name, delta[name])
+        stat.add("Bytes out/s", "%.0f" % (delta["bytes_out"] / elapsed))
+        stat.add("Bytes in/s", "%.0f" % (delta["bytes_in"] / elapsed))
+        stat.add("Latency p50 ms", "%.3f" % (1e3 * latency.quantile(0.5)))
+        stat.add("Latency p99 ms", "%.3f" % (1e3 * latency.quantile(0.99)))
+        stat.add("Latency max ms", "%.3f" % (1e3 * latency.max))
+        return stat
+
+
 class Node:
-    """ Class for running roboclaw ros node for 2 motors in a diff drive setup"""
+    """ Class for running roboclaw ros node for any number of roboclaws in a diff drive setup"""
     def __init__(self):
         self.ERRORS = {0x0000: (diagnostic_msgs.msg.DiagnosticStatus.OK, "Normal"),
                        0x0001: (diagnostic_msgs.msg.DiagnosticStatus.WARN, "M1 over current"),
                        0x0002: (diagnostic_msgs.msg.DiagnosticStatus.WARN, "M2 over current"),
                        0x0004: (diagnostic_msgs.msg.DiagnosticStatus.ERROR, "Emergency Stop"),
-                       0x0008: (diagnostic_msgs.msg.DiagnosticStatus.ERROR, "Temperature1"),
-                       0x0010: (diagnostic_msgs.msg.DiagnosticStatus.ERROR, "Temperature2"),
-                       0x0020: (diagnostic_msgs.msg.DiagnosticStatus.ERROR, "Main batt voltage high"),
+                       0x0008: (diagnostic_msgs.msg.DiagnosticStatus.ERROR, "Temperature1 error"),
+                       0x0010: (diagnostic_msgs.msg.DiagnosticStatus.ERROR, "Temperature2 error"),
+                       0x0020: (diagnostic_msgs.msg.DiagnosticStatus.ERROR, "Main batt voltage high error"),
                        0x0040: (diagnostic_msgs.msg.DiagnosticStatus.ERROR, "Logic batt voltage high"),
                        0x0080: (diagnostic_msgs.msg.DiagnosticStatus.ERROR, "Logic batt voltage low"),
                        0x0100: (diagnostic_msgs.msg.DiagnosticStatus.WARN, "M1 driver fault"),
                        0x0200: (diagnostic_msgs.msg.DiagnosticStatus.WARN, "M2 driver fault"),
-                       0x0400: (diagnostic_msgs.msg.DiagnosticStatus.WARN, "Main batt voltage high"),
+                       0x0400: (diagnostic_msgs.msg.DiagnosticStatus.WARN, "Main batt voltage high warning"),
                        0x0800: (diagnostic_msgs.msg.DiagnosticStatus.WARN, "Main batt voltage low"),
-                       0x1000: (diagnostic_msgs.msg.DiagnosticStatus.WARN, "Temperature1"),
-                       0x2000: (diagnostic_msgs.msg.DiagnosticStatus.WARN, "Temperature2"),
+                       0x1000: (diagnostic_msgs.msg.DiagnosticStatus.WARN, "Temperature1 warning"),
+                       0x2000: (diagnostic_msgs.msg.DiagnosticStatus.WARN, "Temperature2 warning"),
                        0x4000: (diagnostic_msgs.msg.DiagnosticStatus.OK, "M1 home"),
                        0x8000: (diagnostic_msgs.msg.DiagnosticStatus.OK, "M2 home")}
 
+        self.error_decoder = ErrorDecoder(self.ERRORS)
+
         rospy.init_node("roboclaw_node", log_level=rospy.DEBUG) #TODO: remove 2nd param when done debugging
         rospy.on_shutdown(self.shutdown)
         rospy.loginfo("Connecting to roboclaw")
-        self.dev_name = rospy.get_param("~dev")
         self.baud_rate = int(rospy.get_param("~baud", "115200"))
-        self._has_showed_message = False
+        # raw drives the tty fd directly with the low latency flag set, see rawserial.py
+        self.SERIAL_BACKEND = rospy.get_param("~serial_backend", "pyserial")
+        if self.SERIAL_BACKEND not in ("pyserial", "raw"):
+            rospy.logwarn("Unknown serial_backend %s, using pyserial", self.SERIAL_BACKEND)
+            self.SERIAL_BACKEND = "pyserial"
 
-        self.address = int(rospy.get_param("~address", "128"))
-        if self.address > 0x87 or self.address < 0x80:
-            rospy.logfatal("Address out of range")
-            rospy.signal_shutdown("Address out of range")
+        # one entry per roboclaw, without a list fall back to a single ~dev/~address controller
+        controller_params = rospy.get_param("~controllers", None)
+        if not controller_params:
+            controller_params = [{"name": "roboclaw",
+                                  "dev": rospy.get_param("~dev"),
+                                  "address": rospy.get_param("~address", "128")}]
 
-        self.roboclaw = Roboclaw(self.dev_name, self.baud_rate)
+        telemetry_decimation = int(rospy.get_param("~telemetry_decimation", "2"))
+        raw_decimation = int(rospy.get_param("~raw_telemetry_decimation", "0"))
+        self.VELOCITY_SOURCE = rospy.get_param("~velocity_source", "speed")
+        if self.VELOCITY_SOURCE not in ("speed", "ispeed", "encoders"):
+            rospy.logwarn("Unknown velocity_source %s, using speed", self.VELOCITY_SOURCE)
+            self.VELOCITY_SOURCE = "speed"
 
         self.updater = diagnostic_updater.Updater()
         self.updater.setHardwareID("Roboclaw")
-        self.updater.add(diagnostic_updater.
-                        FunctionDiagnosticTask("Vitals", self.check_vitals))
 
-        try:
-            version = self.roboclaw.ReadVersion(self.address)
-        except Exception as e:
-            rospy.logwarn("Problem getting roboclaw version")
-            rospy.logdebug(e)
+        # last frames of every port in shared memory for post-mortems, see roboclaw_blackbox.py
+        self.BLACKBOX = rospy.get_param("~blackbox", "/dev/shm/roboclaw_blackbox")
+        self.blackbox = None
+        if self.BLACKBOX:
+            try:
+                self.blackbox = BlackBox(self.BLACKBOX, int(rospy.get_param("~blackbox_slots", "4096")))
+            except (IOError, OSError) as e:
+                rospy.logwarn("Could not create black box %s: %s", self.BLACKBOX, e)
 
-        if version is None:
-            rospy.logwarn("Could not get version from roboclaw")
-        else:
-            rospy.logdebug(repr(version[1]))
+        # simulated roboclaws and drivetrain in place of the serial ports, for work without a robot
+        self.SIMULATE = bool(rospy.get_param("~simulate", False))
+        self.IO_PROCESS = bool(rospy.get_param("~io_process", False))
+        self.sim_ports = {}
+        simulate = None
+        if self.SIMULATE:
+            start = time.time()
+            sim_ticks = float(rospy.get_param("~ticks_per_meter", rospy.get_param("ticks_per_meter", "4342.2")))
+            # the I/O process simulates on a clock of its own that reads the same as this one
+            simulate = {"start": start, "wall": start, "speed": float(rospy.get_param("~sim_speed", "1.0")),
+                        "ticks_per_meter": sim_ticks}
+            self.sim_clock = SimClock(start, simulate["speed"], start)
+            for params in controller_params:
+                if self.IO_PROCESS:
+                    continue  # the I/O process builds the simulated ports
+                port = self.sim_ports.get(params["dev"])
+                if port is None:
+                    port = self.sim_ports[params["dev"]] = SimulatedSerial([], self.sim_clock, self.baud_rate)
+                sim = SimulatedRoboclaw(int(params.get("address", 128)), (Motor(sim_ticks), Motor(sim_ticks)))
+                port.roboclaws[sim.address] = sim
+            rospy.logwarn("Simulating %d roboclaws at %gx real time", len(controller_params), self.sim_clock.speed)
+            if rospy.get_param("/use_sim_time", False):
+                clock_thread = threading.Thread(target=self.publish_clock, name="roboclaw sim clock")
+                clock_thread.daemon = True
+                clock_thread.start()
+
+        # real-time scheduling of the serial I/O threads (or process), all off by default
+        cpus = rospy.get_param("~realtime_cpus", [])
+        if isinstance(cpus, str):
+            cpus = [int(cpu) for cpu in cpus.split(",") if cpu.strip()]
+        self.REALTIME = {"priority": int(rospy.get_param("~realtime_priority", "0")), "cpus": list(cpus),
+                         "lock": bool(rospy.get_param("~lock_memory", False)),
+                         "gc": rospy.get_param("~gc", "default")}
+        self.process_realtime = []
+        if self.REALTIME["gc"] not in realtime.GC_MODES:
+            rospy.logwarn("Unknown gc mode %s, using default", self.REALTIME["gc"])
+            self.REALTIME["gc"] = "default"
+        elif self.REALTIME["gc"] == "idle" and not self.IO_PROCESS:
+            # rospy would only be collected when the serial workers are idle
+            rospy.logwarn("gc idle needs io_process, using default")
+            self.REALTIME["gc"] = "default"
+
+        # all serial I/O in a process of its own that does not share the GIL with ROS
+        self.io = None
+        if self.IO_PROCESS:
+            self.io = IOProcess([(params["dev"], int(params.get("address", 128))) for params in controller_params],
+                                self.baud_rate, velocity_source=self.VELOCITY_SOURCE, simulate=simulate,
+                                realtime=self.REALTIME, serial_backend=self.SERIAL_BACKEND)
+            self.updater.add(diagnostic_updater.FunctionDiagnosticTask("I/O process", self.check_io))
+
+        # one worker thread per serial port, controllers sharing a port share its serial connection
+        self.workers = {}
+        self.controllers = []
+        profiles = []
+        for i, params in enumerate(controller_params):
+            name = str(params.get("name", "roboclaw_%d" % i))
+            dev = params["dev"]
+            address = int(params.get("address", 128))
+            roles = (params.get("m1", "right"), params.get("m2", "left"))
+            profiles.append(params.get("profile", rospy.get_param("~settings_profile", "")))
+            if address > 0x87 or address < 0x80:
+                rospy.logfatal("Address out of range")
+                rospy.signal_shutdown("Address out of range")
+                raise rospy.ROSInterruptException("Address out of range")
+
+            if dev not in self.workers:
+                self.workers[dev] = PortWorker(dev, self.baud_rate, priority=self.REALTIME["priority"],
+                                               cpus=self.REALTIME["cpus"])
+                self.workers[dev].start()
+                self.updater.add(diagnostic_updater.FunctionDiagnosticTask(
+                    "Serial %s" % dev, functools.partial(self.check_port, self.workers[dev])))
+            if self.io is not None:
+                roboclaw = RemoteRoboclaw(self.io, dev, address)
+            else:
+                shared = [c.roboclaw.ser for c in self.controllers if c.worker.dev == dev]
+                ser = shared[0] if shared else self.sim_ports.get(dev)
+                if ser is None and self.SERIAL_BACKEND == "raw":
+                    ser = RawSerial(dev, self.baud_rate)
+                    rospy.loginfo("Raw serial %s: %s", dev, ", ".join(ser.low_latency) or "no latency tuning")
+                roboclaw = Roboclaw(dev, address, self.baud_rate, ser=ser)
+                roboclaw.ser = self.workers[dev].meter(roboclaw.ser)
+                if self.blackbox is not None:
+                    roboclaw.ser = self.blackbox.tap(roboclaw.ser)
+                    roboclaw.add_hook(self.blackbox)
+            controller = Controller(name, roboclaw, self.workers[dev], roles, (2 * i, 2 * i + 1), self.error_decoder,
+                                    telemetry_decimation, raw_decimation, self.VELOCITY_SOURCE)
+            self.controllers.append(controller)
+            self.updater.add(diagnostic_updater.
+                             FunctionDiagnosticTask("Vitals %s" % name, controller.check_vitals))
+            self.updater.add(diagnostic_updater.FunctionDiagnosticTask("Link %s" % name, controller.check_link))
+            rospy.logdebug("%s dev %s address %d m1 %s m2 %s", name, dev, address, roles[0], roles[1])
+
+        # driver counters and latency histograms in prometheus format on localhost, 0 disables it
+        self.METRICS_PORT = int(rospy.get_param("~metrics_port", "0"))
+        self.metrics_server = None
+        if self.METRICS_PORT:
+            try:
+                self.metrics_server = MetricsServer([c.metrics for c in self.controllers], self.METRICS_PORT)
+                self.metrics_server.start()
+            except socket.error as e:
+                rospy.logerr("Could not serve metrics on port %d, running without them: %s", self.METRICS_PORT, e)
 
-        self.roboclaw.SpeedM1M2(self.address, 0, 0)
-        #self.roboclaw.ResetEncoders(self.address)
+        # every transaction as a chrome trace event, for finding where the time goes
+        self.TRACE_FILE = rospy.get_param("~trace_file", "")
+        self.trace = None
+        if self.TRACE_FILE:
+            self.trace = TraceHook(os.path.expanduser(self.TRACE_FILE))
+            for controller in self.controllers:
+                controller.roboclaw.add_hook(self.trace)
+
+        versions = []
+        for controller in self.controllers:
+            version = None
+            try:
+                version = controller.worker.call(controller.roboclaw.ReadVersion)
+            except Exception as e:
+                rospy.logwarn("Problem getting roboclaw version")
+                rospy.logdebug(e)
+
+            if version is None:
+                rospy.logwarn("Could not get version from roboclaw %s", controller.name)
+            else:
+                rospy.logdebug(repr(version[1]))
+            versions.append(version)
+
+            controller.worker.call(controller.roboclaw.SpeedM1M2, 0, 0)
+
+        # bring every controller in line with its settings profile, skipped when the cache says it already is
+        cache_path = os.path.expanduser(rospy.get_param("~settings_cache", "~/.ros/roboclaw_settings.yaml"))
+        cache = settings.SnapshotCache(cache_path) if cache_path and any(profiles) else None
+        for controller, profile_path, version in zip(self.controllers, profiles, versions):
+            if not profile_path:
+                continue
+            key = "%s %s" % (controller.name, version[1].strip()) if version and version[0] else None
+            try:
+                profile = settings.load_profile(profile_path)
+                changes = controller.worker.call(settings.reconcile, controller.roboclaw, profile,
+                                                 cache if key else None, key, timeout=10.0)
+            except (IOError, OSError, ValueError) as e:
+                rospy.logerr("Could not reconcile %s settings with %s: %s", controller.name, profile_path, e)
+                continue
+            if changes is None:
+                rospy.loginfo("%s settings match %s (cached)", controller.name, profile_path)
+            for name, old, new in changes or ():
+                rospy.loginfo("%s %s changed from %s to %s", controller.name, name, old, new)
 
         self.LINEAR_MAX_SPEED = float(rospy.get_param("linear/x/max_velocity", "2.0"))
         self.ANGULAR_MAX_SPEED = float(rospy.get_param("angular/z/max_velocity", "2.0"))
-        self.TICKS_PER_METER = float(rospy.get_param("tick_per_meter", "10"))
-        self.BASE_WIDTH = float(rospy.get_param("base_width", "0.315"))
+        self.TICKS_PER_METER = float(rospy.get_param("~ticks_per_meter", rospy.get_param("ticks_per_meter", "4342.2")))
+        self.BASE_WIDTH = float(rospy.get_param("~base_width", rospy.get_param("base_width", "0.315")))
+        self.LATERAL_MAX_SPEED = float(rospy.get_param("linear/y/max_velocity", self.LINEAR_MAX_SPEED))
+        self.WHEEL_BASE = float(rospy.get_param("~wheel_base", rospy.get_param("wheel_base", "0.0")))
+        self.SEPARATION_MULTIPLIER = float(rospy.get_param("wheel_separation_multiplier", "1.0"))
+        self.RADIUS_MULTIPLIER = float(rospy.get_param("wheel_radius_multiplier", "1.0"))
+
+        # one mixing matrix row per motor channel, m1 and m2 of every controller in order
+        self.KINEMATICS = rospy.get_param("~kinematics", "differential")
+        try:
+            self.kinematics = self.make_kinematics()
+        except ValueError as e:
+            rospy.logfatal(str(e))
+            rospy.signal_shutdown(str(e))
+            raise rospy.ROSInterruptException(str(e))
 
-        #self.encodm = EncoderOdom(self.TICKS_PER_METER, self.BASE_WIDTH)
-        self.last_set_speed_time = rospy.get_rostime()
+        # pwm drives the motors open loop, speed uses the roboclaw velocity PID (qpps)
+        self.COMMAND_MODE = rospy.get_param("~command_mode", "pwm")
+        if self.COMMAND_MODE not in ("pwm", "speed"):
+            rospy.logfatal("Unknown command_mode %s", self.COMMAND_MODE)
+            rospy.signal_shutdown("Unknown command_mode")
+            raise rospy.ROSInterruptException("Unknown command_mode")
+
+        # in speed mode the roboclaw ramps to each setpoint itself, otherwise ramps are stepped every tick
+        self.ACCEL_ON_CONTROLLER = bool(rospy.get_param("~accel_on_controller", True))
+        self.LINEAR_MAX_ACCEL, self.ANGULAR_MAX_ACCEL = float("inf"), float("inf")
+        if rospy.get_param("linear/x/has_acceleration_limits", False):
+            self.LINEAR_MAX_ACCEL = float(rospy.get_param("linear/x/max_acceleration"))
+        if rospy.get_param("angular/z/has_acceleration_limits", False):
+            self.ANGULAR_MAX_ACCEL = float(rospy.get_param("angular/z/max_acceleration"))
+        self.limiter = AccelLimiter.from_kinematics(self.kinematics, self.LINEAR_MAX_ACCEL, self.ANGULAR_MAX_ACCEL)
+
+        # integration runs at the loop rate, odom and tf are decimated from it
+        self.LOOP_RATE = float(rospy.get_param("~loop_rate", rospy.get_param("loop_rate", "10")))
+        self.ODOM_RATE = float(rospy.get_param("~odom_rate", rospy.get_param("odom_rate", "10")))
+        self.TF_RATE = float(rospy.get_param("~tf_rate", rospy.get_param("tf_rate", "10")))
+        if self.io is not None:
+            self.io.set_period(1.0 / self.LOOP_RATE)
+        if not rospy.get_param("~enable_odom_tf", rospy.get_param("enable_odom_tf", True)):
+            self.TF_RATE = 0.0
+
+        self.set_encoder_limits()
+
+        # reported wheel speeds are smoothed over this many loop iterations before they become the odom twist
+        self.speed_filter = SpeedFilter(int(rospy.get_param("~velocity_filter_taps", "1")), 2)
+
+        self.encodm = EncoderOdom(self.TICKS_PER_METER / self.RADIUS_MULTIPLIER,
+                                  self.BASE_WIDTH * self.SEPARATION_MULTIPLIER,
+                                  self.LOOP_RATE, self.ODOM_RATE, self.TF_RATE)
+
+        # cmd_vel only latches the target wheel speeds (m/s), they are sent to every port together
+        # at the next tick. setpoints are the wheel speeds last sent.
+        self.commands_lock = threading.Lock()
+        self.dispatch_lock = threading.Lock()
+        self.targets = np.zeros(len(self.kinematics.roles))
+        self.targets_dirty = False
+        self.setpoints = np.zeros(len(self.kinematics.roles))
+        self.skew_pub = rospy.Publisher("~dispatch_skew", Float64, queue_size=10)
 
         self.sub = rospy.Subscriber("cmd_vel", Twist, self.cmd_vel_callback, queue_size=5)
-        self.TIMEOUT = 2
+        self.trajectory_sub = rospy.Subscriber("~trajectory", JointTrajectory, self.trajectory_callback, queue_size=1)
+
+        # position moves run on the roboclaws, the action only polls for completion at a low rate
+        self.POSITION_POLL_RATE = float(rospy.get_param("~position_poll_rate", "5"))
+        self.POSITION_TIMEOUT = float(rospy.get_param("~position_timeout", "2"))
+        self.position_active = False
+        self.position_cancel = threading.Event()
+        self.position_server = actionlib.SimpleActionServer("~move_to_position", MoveToPositionAction,
+                                                            execute_cb=self.execute_position_goal, auto_start=False)
+        self.position_server.start()
+        self.TIMEOUT = float(rospy.get_param("~timeout", rospy.get_param("cmd_vel_timeout", "2")))
+
+        # stops the motors once when commands stop arriving, optionally repeating the stop slowly
+        self.KEEPALIVE = float(rospy.get_param("~keepalive", "0"))
+        self.watchdog = Watchdog(self.TIMEOUT, self.stop_all, self.KEEPALIVE, self.keepalive)
+        self.watchdog.start()
+
+        # reconfigure requests are only stored here and applied by the control loop between ticks,
+        # seed the server with the values in use so its first callback changes nothing
+        self.config_lock = threading.Lock()
+        self.pending_config = None
+        self.velocity_pid = None
+        for name, value in (("linear_max_speed", self.LINEAR_MAX_SPEED), ("angular_max_speed", self.ANGULAR_MAX_SPEED),
+                            ("linear_max_accel", self.LINEAR_MAX_ACCEL if np.isfinite(self.LINEAR_MAX_ACCEL) else 0.0),
+                            ("angular_max_accel", self.ANGULAR_MAX_ACCEL if np.isfinite(self.ANGULAR_MAX_ACCEL) else 0.0),
+                            ("timeout", self.TIMEOUT), ("ticks_per_meter", self.TICKS_PER_METER),
+                            ("base_width", self.BASE_WIDTH), ("loop_rate", self.LOOP_RATE),
+                            ("odom_rate", self.ODOM_RATE), ("tf_rate", self.TF_RATE)):
+            rospy.set_param("~" + name, value)
+        self.reconfigure_server = Server(RoboclawConfig, self.reconfigure_callback)
 
         rospy.sleep(1)
 
-        rospy.logdebug("dev %s", self.dev_name)
         rospy.logdebug("baud %d", self.baud_rate)
-        rospy.logdebug("address %d", self.address)
         rospy.logdebug("max_speed %f", self.LINEAR_MAX_SPEED)
         rospy.logdebug("ticks_per_meter %f", self.TICKS_PER_METER)
         rospy.logdebug("base_width %f", self.BASE_WIDTH)
+        rospy.logdebug("loop_rate %f odom_rate %f tf_rate %f", self.LOOP_RATE, self.ODOM_RATE, self.TF_RATE)
 
     def run(self):
         """Run the main ros loop"""
         rospy.loginfo("Starting motor drive")
-        r_time = rospy.Rate(10)
+        # process wide, and after startup so a frozen gc leaves out everything allocated so far.
+        # the I/O process applies its own.
+        if self.io is None:
+            self.process_realtime = realtime.apply_process(self.REALTIME["lock"], self.REALTIME["gc"])
+        for note in self.process_realtime:
+            rospy.loginfo("Realtime: %s", note)
+        self.rate = rospy.Rate(self.LOOP_RATE)
         while not rospy.is_shutdown():
+            self.apply_pending_config()
+            self.dispatch_commands()
 
-            if (rospy.get_rostime() - self.last_set_speed_time).to_sec() > self.TIMEOUT:
+            # every port is read in parallel, wait for all of them before integrating
+            for controller in self.controllers:
+                if controller.tick_job is None or controller.tick_job.done():
+                    controller.tick_job = controller.worker.submit(controller.tick, priority=ODOMETRY)
+                # telemetry is published a tick late rather than holding up the encoders
+                if controller.telemetry_job is None or controller.telemetry_job.done():
+                    if controller.telemetry_job is not None and controller.telemetry_job.result is not None:
+                        controller.publish(*controller.telemetry_job.result)
+                    controller.telemetry_job = controller.worker.submit(controller.poll_telemetry, priority=TELEMETRY)
+            complete = True
+            for controller in self.controllers:
                 try:
-                    self.roboclaw.ForwardM1(self.address, 0)
-                    self.roboclaw.ForwardM2(self.address, 0)
+                    controller.tick_job.wait(1.0 / self.LOOP_RATE)
+                except OSError as e:
+                    rospy.logwarn("%s tick OSError: %s", controller.name, e)
+                    complete = False
+
+            encoders = self.wheel_encoders() if complete else None
+            if encoders is not None:
+                rospy.logdebug(" Encoders %d %d" % encoders)
+                speeds = self.wheel_speeds()
+                if speeds is not None:
+                    speeds = self.speed_filter.update(speeds)
+                self.encodm.update_publish(encoders[0], encoders[1], speeds)
+
+            self.updater.update()
+            self.rate.sleep()
+
+    def set_encoder_limits(self):
+        """A count jump faster than twice max speed over the time between reads is a counter reset, not motion"""
+        rate = self.TICKS_PER_METER * max(self.LINEAR_MAX_SPEED, 1.0) * 2
+        for controller in self.controllers:
+            for accumulator in controller.accumulators:
+                accumulator.max_rate = rate
+                # slack for jitter between the read and its stamp
+                accumulator.max_delta = int(rate / self.LOOP_RATE)
+
+    def make_kinematics(self):
+        return kinematics.create(self.KINEMATICS,
+                                 [role for controller in self.controllers for role in controller.roles],
+                                 self.BASE_WIDTH, self.WHEEL_BASE,
+                                 self.SEPARATION_MULTIPLIER, self.RADIUS_MULTIPLIER)
+
+    def reconfigure_callback(self, config, level):
+        with self.config_lock:
+            self.pending_config = config
+        return config
+
+    def apply_pending_config(self):
+        """Apply the latest reconfigure request in one go, runs between control ticks"""
+        with self.config_lock:
+            config, self.pending_config = self.pending_config, None
+        if config is None:
+            return
+
+        with self.commands_lock:
+            self.LINEAR_MAX_SPEED = config.linear_max_speed
+            self.ANGULAR_MAX_SPEED = config.angular_max_speed
+            self.LINEAR_MAX_ACCEL = config.linear_max_accel or float("inf")
+            self.ANGULAR_MAX_ACCEL = config.angular_max_accel or float("inf")
+            self.TIMEOUT = config.timeout
+            self.watchdog.set_timeout(self.TIMEOUT)
+            self.TICKS_PER_METER = config.ticks_per_meter
+            self.BASE_WIDTH = config.base_width
+            self.kinematics = self.make_kinematics()
+            self.limiter = AccelLimiter.from_kinematics(self.kinematics, self.LINEAR_MAX_ACCEL, self.ANGULAR_MAX_ACCEL)
+
+        self.encodm.TICKS_PER_METER = self.TICKS_PER_METER / self.RADIUS_MULTIPLIER
+        self.encodm.BASE_WIDTH = self.BASE_WIDTH * self.SEPARATION_MULTIPLIER
+        if config.loop_rate != self.LOOP_RATE:
+            self.LOOP_RATE = config.loop_rate
+            self.rate = rospy.Rate(self.LOOP_RATE)
+            if self.io is not None:
+                self.io.set_period(1.0 / self.LOOP_RATE)
+        self.ODOM_RATE = config.odom_rate
+        self.TF_RATE = config.tf_rate
+        self.encodm.set_rates(self.LOOP_RATE, self.ODOM_RATE, self.TF_RATE)
+        self.set_encoder_limits()
+
+        pid = (config.velocity_p, config.velocity_i, config.velocity_d, config.qpps)
+        if config.set_velocity_pid and pid != self.velocity_pid:
+            self.velocity_pid = pid
+            for controller in self.controllers:
+                controller.worker.submit(controller.roboclaw.SetM1VelocityPID, *pid)
+                controller.worker.submit(controller.roboclaw.SetM2VelocityPID, *pid)
+            rospy.loginfo("Set velocity PID p %f i %f d %f qpps %d", *pid)
+        rospy.logdebug("Applied reconfigure max_speed %f ticks_per_meter %f base_width %f loop_rate %f",
+                       self.LINEAR_MAX_SPEED, self.TICKS_PER_METER, self.BASE_WIDTH, self.LOOP_RATE)
+
+    def dispatch_commands(self):
+        """Send the next wheel setpoints to all ports at the same moment and publish the skew"""
+        if self.position_active or any(controller.streamer.active for controller in self.controllers):
+            return
+        with self.dispatch_lock:
+            self.send_setpoints()
+
+    def send_setpoints(self):
+        with self.commands_lock:
+            targets, dirty = self.targets, self.targets_dirty
+            self.targets_dirty = False
+
+        accels = None
+        if self.COMMAND_MODE == "speed" and self.ACCEL_ON_CONTROLLER and self.limiter.limited:
+            if not dirty:
+                return
+            accels = self.limiter.ramp_accels(self.setpoints, targets)
+            setpoints = targets
+        else:
+            if not dirty and (self.setpoints == targets).all():
+                return
+            setpoints = self.limiter.step(self.setpoints, targets, 1.0 / self.LOOP_RATE)
+        self.setpoints = setpoints
+
+        if self.COMMAND_MODE == "speed":
+            commands = [int(round(speed * self.TICKS_PER_METER)) for speed in setpoints]
+            if accels is not None:
+                accels = [max(1, int(round(accel * self.TICKS_PER_METER))) for accel in accels]
+        else:
+            # past +-127 the driver's byte write would wrap the duty around to the other direction
+            commands = [int(duty) for duty in np.clip(setpoints / self.LINEAR_MAX_SPEED * 127, -127, 127)]
+        rospy.logdebug("wheel commands = %s", commands)
+
+        ports = {}
+        for controller in self.controllers:
+            ports.setdefault(controller.worker, []).append(controller)
+        rendezvous = Rendezvous([(worker, self.command_port, (controllers, commands, accels))
+                                 for worker, controllers in ports.items()])
+        for job in rendezvous.dispatch(1.0 / self.LOOP_RATE):
+            try:
+                job.wait(1.0 / self.LOOP_RATE)
+            except OSError as e:
+                rospy.logwarn("Roboclaw OSError: %s", e)
+                rospy.logdebug(e)
+
+        skew = rendezvous.skew()
+        if skew is not None:
+            self.skew_pub.publish(skew)
+
+    def stop_all(self):
+        """Watchdog expiry: end any trajectory or position move and bring every wheel to rest, once"""
+        rospy.loginfo("Did not get command for %.1f seconds, stopping", self.TIMEOUT)
+        # buffered segments and position moves run closed loop on the roboclaws, whatever the command mode
+        closed_loop = self.COMMAND_MODE == "speed" or self.position_active or \
+            any(controller.streamer.active for controller in self.controllers)
+        for controller in self.controllers:
+            controller.streamer.cancel()
+        if self.position_active:
+            self.position_cancel.set()
+        with self.dispatch_lock:
+            with self.commands_lock:
+                self.targets = np.zeros(len(self.kinematics.roles))
+                if not closed_loop and self.limiter.limited:
+                    # pwm setpoints ramp down to 0 through the control loop like any other target
+                    self.targets_dirty = True
+                    return
+                self.targets_dirty = False
+                self.setpoints = np.zeros(len(self.kinematics.roles))
+            self.stop_ports(closed_loop)
+
+    def keepalive(self):
+        """Repeat the stop while idle, in case a roboclaw was reset or missed it"""
+        with self.dispatch_lock:
+            if self.COMMAND_MODE == "pwm" and self.setpoints.any():
+                return  # still ramping down
+            self.stop_ports(self.COMMAND_MODE == "speed")
+
+    def stop_ports(self, closed_loop=True):
+        """Stop every port together, closed loop within the accel limits unless pwm drives the motors"""
+        accels = None
+        if closed_loop and self.limiter.limited:
+            accels = [max(1, int(round(accel * self.TICKS_PER_METER))) for accel in self.limiter.accel_limits]
+        ports = {}
+        for controller in self.controllers:
+            ports.setdefault(controller.worker, []).append(controller)
+        rendezvous = Rendezvous([(worker, self.stop_port, (controllers, closed_loop, accels))
+                                 for worker, controllers in ports.items()], SAFETY)
+        for job in rendezvous.dispatch(1.0):
+            try:
+                job.wait(1.0)
+            except OSError as e:
+                rospy.logwarn("Roboclaw stop OSError: %s", e)
+
+    def stop_port(self, controllers, closed_loop, accels):
+        """Stop the controllers of one port, a hard pwm stop only when pwm drives them or the closed loop stop failed"""
+        for controller in controllers:
+            if closed_loop:
+                m1, m2 = controller.channels
+                # replied, so a stop the roboclaw did not take falls back to the hard stop
+                try:
+                    if accels is None:
+                        sent = controller.speed(0, 0, replied=True)
+                    else:
+                        sent = controller.speed(0, 0, accels[m1], accels[m2], replied=True)
                 except OSError as e:
-                    rospy.logerr("Could not stop")
                     rospy.logdebug(e)
-                if (not self._has_showed_message):
-                    rospy.loginfo("Did not get command for 1 second, stopping")
-                    self._has_showed_message = True
+                    sent = False
+                if sent:
+                    continue
+                rospy.logwarn("%s ramped stop failed, stopping hard", controller.name)
+            controller.stop()
+
+    def command_port(self, controllers, commands, accels):
+        """Send the wheel commands to every controller on one port, runs on the port worker"""
+        for controller in controllers:
+            m1, m2 = controller.channels
+            if self.COMMAND_MODE == "speed":
+                if accels is None:
+                    controller.speed(commands[m1], commands[m2])
+                else:
+                    controller.speed(commands[m1], commands[m2], accels[m1], accels[m2])
             else:
-                self._has_showed_message = False
-
-            # TODO need find solution to the OSError11 looks like sync problem with serial status1, enc1, crc1 = None, None, None
-            status2, enc2, crc2 = None, None, None
-
-            #try:
-            #    status1, enc1, crc1 = roboclaw.ReadEncM1(self.address)
-            #except ValueError:
-            #    pass
-            #except OSError as e:
-            #    rospy.logwarn("ReadEncM1 OSError: %d", e.errno)
-            #    rospy.logdebug(e)
-
-            #try:
-            #    status2, enc2, crc2 = roboclaw.ReadEncM2(self.address)
-            #except ValueError:
-            #    pass
-            #except OSError as e:
-            #    rospy.logwarn("ReadEncM2 OSError: %d", e.errno)
-            #    rospy.logdebug(e)
-
-            #if ((enc1 is not None) and (enc2 is not None)):
-            #    rospy.logdebug(" Encoders %d %d" % (enc1, enc2))
-            #    self.encodm.update_publish(enc1, enc2)
-            self.updater.update()
-            r_time.sleep()
+                controller.command(commands[m1], commands[m2])
+
+    def wheel_encoders(self):
+        """Average unwrapped encoder count of the left and right wheels, None unless every encoder was read"""
+        return self.side_average(lambda controller: controller.totals)
+
+    def wheel_speeds(self):
+        """Average reported speed in qpps of the left and right wheels, None unless every speed was read"""
+        return self.side_average(lambda controller: controller.speeds)
+
+    def side_average(self, values):
+        """Average of values(controller) per channel over the left and right wheels, None if any is missing"""
+        left, right = [], []
+        for controller in self.controllers:
+            for role, value in zip(controller.roles, values(controller)):
+                side = kinematics.Kinematics.side(role)
+                if side is None:
+                    continue
+                if value is None:
+                    return None
+                (left if side == "left" else right).append(value)
+        if not left or not right:
+            return None
+        return sum(left) / len(left), sum(right) / len(right)
 
     def cmd_vel_callback(self, twist):
         """Command the motors based on the incoming twist message"""
-        self.last_set_speed_time = rospy.get_rostime()
-
-        rospy.logdebug("Twist: -Linear X: %d    -Angular Z: %d", twist.linear.x, twist.angular.z)
-        linear_x = twist.linear.x
-        angular_z = twist.angular.z
-
-        if linear_x > self.LINEAR_MAX_SPEED:
-            linear_x = self.LINEAR_MAX_SPEED
-        elif linear_x < -self.LINEAR_MAX_SPEED:
-            linear_x = -self.LINEAR_MAX_SPEED
-
-    	# Take linear x and angular z values and compute command
-        motor1_command = linear_x/self.LINEAR_MAX_SPEED + angular_z/self.ANGULAR_MAX_SPEED
-        motor2_command = linear_x/self.LINEAR_MAX_SPEED - angular_z/self.ANGULAR_MAX_SPEED
-    	# Scale to motor pwm
-        motor1_command = int(motor1_command * 127)
-        motor2_command = int(motor2_command * 127)
-    	# Clip commands to within bounds (-127,127)
-        motor1_command =  max(-127, min(127, motor1_command))
-        motor2_command =  max(-127, min(127, motor2_command))
-
-        rospy.logdebug("motor1 command = %d",int(motor1_command))
-        rospy.logdebug("motor2 command = %d",int(motor2_command))
+        self.watchdog.feed()
 
-        try:
-            if motor1_command >= 0:
-                self.roboclaw.ForwardM1(self.address, motor1_command)
-            else:
-                self.roboclaw.BackwardM1(self.address, -motor1_command)
+        rospy.logdebug("Twist: -Linear X: %d    -Linear Y: %d    -Angular Z: %d",
+                       twist.linear.x, twist.linear.y, twist.angular.z)
+        with self.commands_lock:
+            linear_x = max(-self.LINEAR_MAX_SPEED, min(self.LINEAR_MAX_SPEED, twist.linear.x))
+            linear_y = max(-self.LATERAL_MAX_SPEED, min(self.LATERAL_MAX_SPEED, twist.linear.y))
+            angular_z = max(-self.ANGULAR_MAX_SPEED, min(self.ANGULAR_MAX_SPEED, twist.angular.z))
+            if self.COMMAND_MODE == "pwm":
+                # open loop the wheel speeds only set the duty, so as before the kinematics an angular
+                # command at its limit gives full duty on the wheel turning fastest, not track / 2 of it
+                turn = abs(self.kinematics.matrix[:, 2]).max()
+                if turn > 0 and self.ANGULAR_MAX_SPEED > 0:
+                    angular_z *= self.LINEAR_MAX_SPEED / (self.ANGULAR_MAX_SPEED * turn)
 
-            if motor2_command >= 0:
-                self.roboclaw.ForwardM2(self.address, motor2_command)
-            else:
-                self.roboclaw.BackwardM2(self.address, -motor2_command)
+            # Mix into wheel speeds, if a wheel would saturate slow every wheel down by the same factor
+            # so the commanded curvature is kept
+            speeds = self.kinematics.wheel_speeds(linear_x, linear_y, angular_z)
+            peak = abs(speeds).max() / self.LINEAR_MAX_SPEED if len(speeds) else 0.0
+            if peak > 1.0:
+                speeds /= peak
 
-        except OSError as e:
-            rospy.logwarn("Roboclaw OSError: %d", e.errno)
-            rospy.logdebug(e)
+            self.targets = speeds
+            self.targets_dirty = True
+        # a new cmd_vel overrides any trajectory still streaming or position move in progress
+        for controller in self.controllers:
+            controller.streamer.cancel()
+        if self.position_active:
+            self.position_cancel.set()
 
+    def trajectory_callback(self, trajectory):
+        """Stream a short wheel trajectory through the roboclaw command buffers
+
+        joint_names are wheel roles, each point gives their velocities in m/s at time_from_start.
+        Channels whose role is not named stay at 0. The trajectory should end at rest.
+        """
+        points = trajectory.points
+        if len(points) < 2 or any(len(point.velocities) != len(trajectory.joint_names) for point in points):
+            rospy.logwarn("Trajectory needs at least 2 points with a velocity for every joint")
+            return
+        times = [point.time_from_start.to_sec() for point in points]
+        if times[0] > 0:
+            # start from rest at t=0
+            times.insert(0, 0.0)
+            points = [None] + list(points)
+
+        def channel_speeds(role):
+            if role not in trajectory.joint_names:
+                return [0] * len(times)
+            index = trajectory.joint_names.index(role)
+            return [point.velocities[index] * self.TICKS_PER_METER / self.RADIUS_MULTIPLIER if point else 0.0
+                    for point in points]
 
-    def check_vitals(self, stat):
-        """Check battery voltage and temperatures from roboclaw"""
         try:
-            status = self.roboclaw.ReadError(self.address)[1]
-        except OSError as e:
-            rospy.logwarn("Diagnostics OSError: %d", e.errno)
-            rospy.logdebug(e)
+            segments = [wheel_segments(times, channel_speeds(controller.roles[0]), channel_speeds(controller.roles[1]))
+                        for controller in self.controllers]
+        except ValueError as e:
+            rospy.logwarn("Rejected trajectory: %s", e)
             return
-        state, message = self.ERRORS[status]
-        stat.summary(state, message)
+
+        # loading the streamers first stops the control loop from sending cmd_vel setpoints
+        for controller, controller_segments in zip(self.controllers, segments):
+            controller.streamer.load(controller_segments)
+        with self.commands_lock:
+            self.watchdog.feed(times[-1])
+            self.targets = np.zeros(len(self.kinematics.roles))
+            self.targets_dirty = False
+            self.setpoints = np.zeros(len(self.kinematics.roles))
+        rospy.logdebug("Streaming %d trajectory segments over %f s", len(times) - 1, times[-1])
+
+    def execute_position_goal(self, goal):
+        """Move every channel to its target encoder count with the roboclaw position controller"""
+        channels = len(self.kinematics.roles)
+        result = MoveToPositionResult()
+        if len(goal.positions) != channels:
+            rospy.logwarn("Position goal needs %d positions, got %d", channels, len(goal.positions))
+            self.position_server.set_aborted(result, "Wrong number of positions")
+            return
+        if not (goal.speed and goal.accel and goal.deccel):
+            self.position_server.set_aborted(result, "Speed, accel and deccel must be positive")
+            return
+
+        current = self.channel_encoders()
+        if current is None:
+            self.position_server.set_aborted(result, "Encoders not read yet")
+            return
+        targets = [int(position) + (current[i] if goal.relative else 0) for i, position in enumerate(goal.positions)]
+        # every channel moves at once, the longest one sets how long the goal may take
+        duration = max(move_duration(target - position, goal.speed, goal.accel, goal.deccel)
+                       for target, position in zip(targets, current))
+        deadline = rospy.get_time() + duration + self.POSITION_TIMEOUT
+
+        self.position_cancel.clear()
+        self.position_active = True
         try:
-            stat.add("Main Batt V:", float(self.roboclaw.ReadMainBatteryVoltage(self.address)[1] / 10))
-            stat.add("Logic Batt V:", float(self.roboclaw.ReadLogicBatteryVoltage(self.address)[1] / 10))
-            stat.add("Temp1 C:", float(self.roboclaw.ReadTemp(self.address)[1] / 10))
-            stat.add("Temp2 C:", float(self.roboclaw.ReadTemp2(self.address)[1] / 10))
+            self.watchdog.feed()
+            for controller in self.controllers:
+                m1, m2 = controller.channels
+                if not controller.worker.call(controller.position, goal.accel, goal.speed, goal.deccel,
+                                              targets[m1], targets[m2], priority=SETPOINT, timeout=1.0):
+                    self.abort_position_goal(result, "Could not send the move to %s" % controller.name)
+                    return
+
+            rate = rospy.Rate(self.POSITION_POLL_RATE)
+            feedback = MoveToPositionFeedback()
+            closest = None
+            settled = False
+            while not rospy.is_shutdown():
+                if self.position_cancel.is_set() and self.watchdog.expired:
+                    self.abort_position_goal(result, "No progress for %.1f seconds" % self.TIMEOUT)
+                    return
+                if self.position_server.is_preempt_requested() or self.position_cancel.is_set():
+                    with self.dispatch_lock:
+                        self.stop_ports()
+                    result.positions = self.channel_encoders() or []
+                    self.position_server.set_preempted(result)
+                    return
+                if rospy.get_time() > deadline:
+                    self.abort_position_goal(result, "Move did not finish within %.1f seconds"
+                                             % (duration + self.POSITION_TIMEOUT))
+                    return
+
+                # encoders come from the control loop, only the buffers cost a read here. A failed
+                # read counts as busy, the deadline ends the goal if the port stays down.
+                idle = True
+                for controller in self.controllers:
+                    buffers = controller.worker.call(controller.roboclaw.ReadBuffers, priority=ODOMETRY, timeout=1.0)
+                    idle = idle and bool(buffers[0]) and tuple(buffers[1:3]) == (BUFFER_IDLE, BUFFER_IDLE)
+                current = self.channel_encoders()
+                feedback.positions = current
+                feedback.remaining = [target - position for target, position in zip(targets, current)]
+                self.position_server.publish_feedback(feedback)
+                if idle and all(abs(remaining) <= goal.tolerance for remaining in feedback.remaining):
+                    result.success = True
+                    result.positions = current
+                    self.position_server.set_succeeded(result)
+                    return
+                # idle on two polls in a row, so the encoders read by the control loop have caught up
+                if idle and settled:
+                    self.abort_position_goal(result, "Move ended outside the tolerance")
+                    return
+                settled = idle
+
+                # the move stands in for cmd_vel, but only keeps the watchdog fed while it gets closer
+                distance = sum(abs(remaining) for remaining in feedback.remaining)
+                if closest is None or distance < closest:
+                    closest = distance
+                    self.watchdog.feed()
+                rate.sleep()
         except OSError as e:
-            rospy.logwarn("Diagnostics OSError: %d", e.errno)
-            rospy.logdebug(e)
+            rospy.logwarn("Position move OSError: %s", e)
+            self.abort_position_goal(result, str(e))
+        finally:
+            self.position_active = False
+
+    def abort_position_goal(self, result, reason):
+        """Stop every port and abort the position goal with the positions it reached"""
+        rospy.logwarn("Position move aborted: %s", reason)
+        with self.dispatch_lock:
+            self.stop_ports()
+        result.positions = self.channel_encoders() or []
+        self.position_server.set_aborted(result, reason)
+
+    def check_port(self, worker, stat):
+        """Queue depth and share of the link used by each priority class of one port"""
+        stats = worker.stats()
+        total = sum(utilization for name, depth, utilization in stats)
+        level = diagnostic_msgs.msg.DiagnosticStatus.WARN if total > 0.9 else diagnostic_msgs.msg.DiagnosticStatus.OK
+        stat.summary(level, "Link %.0f%% used" % (100 * total))
+        for name, depth, utilization in stats:
+            stat.add("%s queue" % name, depth)
+            stat.add("%s utilization" % name, "%.3f" % utilization)
+        self.add_scheduling(stat, worker.realtime + self.process_realtime, worker.take_wakeups(), "Wakeup")
         return stat
 
+    def check_io(self, stat):
+        """How late the I/O process loop woke for its samples and its real-time settings"""
+        if self.io.process.poll() is not None:
+            stat.summary(diagnostic_msgs.msg.DiagnosticStatus.ERROR,
+                         "I/O process exited with %d" % self.io.process.returncode)
+            return stat
+        stat.summary(diagnostic_msgs.msg.DiagnosticStatus.OK, "Running")
+        self.add_scheduling(stat, self.io.realtime_notes, self.io.take_lateness(), "Lateness")
+        return stat
+
+    @staticmethod
+    def add_scheduling(stat, notes, latency, label):
+        """Scheduling latency quantiles and the real-time notes, warns when a setting did not take"""
+        stat.add("Realtime", ", ".join(notes) or "off")
+        if any("failed" in note for note in notes):
+            stat.mergeSummary(diagnostic_msgs.msg.DiagnosticStatus.WARN, "Real-time settings failed")
+        stat.add("%s p50 ms" % label, "%.3f" % (1e3 * latency.quantile(0.5)))
+        stat.add("%s p99 ms" % label, "%.3f" % (1e3 * latency.quantile(0.99)))
+        stat.add("%s max ms" % label, "%.3f" % (1e3 * latency.max))
+
+    def channel_encoders(self):
+        """Last encoder count of every channel in order, None unless all have been read"""
+        encoders = [enc for controller in self.controllers for enc in controller.encoders]
+        if None in encoders:
+            return None
+        return encoders
+
+    def publish_clock(self):
+        """Publish the simulated time on /clock so nodes using /use_sim_time run at the simulation speed"""
+        pub = rospy.Publisher("/clock", Clock, queue_size=1)
+        while not rospy.is_shutdown():
+            pub.publish(Clock(rospy.Time.from_sec(self.sim_clock.now())))
+            time.sleep(0.001)
+
     def shutdown(self):
-	"""Handle shutting down the node"""
+        """Handle shutting down the node"""
         rospy.loginfo("Shutting down")
         if hasattr(self, "sub"):
             self.sub.unregister() # so it doesn't get called after we're dead
-        try:
-            self.roboclaw.ForwardM1(self.address, 0)
-            self.roboclaw.ForwardM2(self.address, 0)
-            rospy.loginfo("Closed Roboclaw serial connection")
-        except OSError:
-            rospy.logerr("Shutdown did not work trying again")
+        if hasattr(self, "watchdog"):
+            self.watchdog.stop()
+        if getattr(self, "metrics_server", None) is not None:
+            self.metrics_server.stop()
+        for controller in getattr(self, "controllers", []):
             try:
-                self.roboclaw.ForwardM1(self.address, 0)
-                self.roboclaw.ForwardM2(self.address, 0)
-            except OSError as e:
-                rospy.logerr("Could not shutdown motors!!!!")
-                rospy.logdebug(e)
+                controller.worker.call(controller.stop, priority=SAFETY, timeout=1.0)
+                rospy.loginfo("Stopped roboclaw %s", controller.name)
+            except OSError:
+                rospy.logerr("Shutdown did not work trying again")
+                try:
+                    controller.worker.call(controller.stop, priority=SAFETY, timeout=1.0)
+                except OSError as e:
+                    rospy.logerr("Could not shutdown motors!!!!")
+                    if getattr(self, "blackbox", None) is not None:
+                        rospy.logerr("Last frames are in %s, dump them with roboclaw_blackbox.py", self.BLACKBOX)
+                    rospy.logdebug(e)
+        for worker in getattr(self, "workers", {}).values():
+            worker.stop()
+        if getattr(self, "io", None) is not None:
+            for worker in self.workers.values():
+                worker.join(1.0)
+            self.io.close()
+        if getattr(self, "trace", None) is not None:
+            for worker in self.workers.values():
+                worker.join(1.0)
+            self.trace.close()
         #quit()
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""Compare the latency of the serial backends on a pty, or on a real roboclaw
+
+Without --dev a simulated roboclaw answers on the master side of a pseudo terminal, so the
+numbers are the host side cost of each backend: syscalls, wakeups and buffering.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import select
+import threading
+import time
+
+from roboclaw_driver.metrics import LatencyHistogram
+from roboclaw_driver.rawserial import RawSerial
+from roboclaw_driver.roboclaw_driver import Roboclaw
+from roboclaw_driver.simulator import SimulatedRoboclaw, SimulatedSerial
+from roboclaw_driver.telemetry import monotonic
+
+
+def respond(master, device, running):
+    """Answer whatever arrives on the pty master like a roboclaw would"""
+    while running.is_set():
+        if not select.select([master], [], [], 0.05)[0]:
+            continue
+        device.write(os.read(master, 256))
+        waiting = device.inWaiting()
+        if waiting:
+            os.write(master, device.read(waiting))
+
+
+def open_backend(backend, dev, baud):
+    if backend == "raw":
+        return RawSerial(dev, baud)
+    import serial
+    return serial.Serial(dev, baudrate=baud, timeout=0.1)
+
+
+def bench(roboclaw, count):
+    latency = LatencyHistogram()
+    failures = 0
+    for _ in range(count):
+        start = monotonic()
+        ok = roboclaw.ReadEncM1()[0]
+        latency.record(monotonic() - start)
+        if not ok:
+            failures += 1
+    return latency, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dev", help="a real roboclaw port instead of the simulated one")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--address", type=int, default=128)
+    parser.add_argument("--count", type=int, default=2000, help="ReadEncM1 transactions per backend")
+    parser.add_argument("--backends", default="pyserial,raw")
+    args = parser.parse_args()
+
+    running = threading.Event()
+    dev = args.dev
+    if dev is None:
+        master, slave = os.openpty()
+        dev = os.ttyname(slave)
+        running.set()
+        device = SimulatedSerial([SimulatedRoboclaw(args.address)], baud=args.baud)
+        responder = threading.Thread(target=respond, args=(master, device, running))
+        responder.daemon = True
+        responder.start()
+
+    try:
+        for backend in args.backends.split(","):
+            ser = open_backend(backend, dev, args.baud)
+            roboclaw = Roboclaw(dev, args.address, args.baud, ser=ser)
+            try:
+                bench(roboclaw, min(args.count, 100))  # warm up
+                start = time.time()
+                latency, failures = bench(roboclaw, args.count)
+                elapsed = time.time() - start
+            finally:
+                roboclaw.StopMotors()
+                ser.close()
+            print("%-8s %7.0f transactions/s  p50 %.3f ms  p99 %.3f ms  max %.3f ms  failed %d  %s" % (
+                backend, args.count / elapsed, 1e3 * latency.quantile(0.5), 1e3 * latency.quantile(0.99),
+                1e3 * latency.max, failures, ", ".join(getattr(ser, "low_latency", []))))
+    finally:
+        running.clear()
+
+
+if __name__ == "__main__":
+    main()
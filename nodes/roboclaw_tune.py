@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Measure a motor and fit the roboclaw velocity PID and QPPS
+
+Stop roboclaw_node first, this talks to the roboclaw directly. Both tests drive the chosen motor
+from rest so the wheels must be free to turn.
+"""
+from __future__ import print_function
+
+import argparse
+
+import numpy as np
+from roboclaw_driver import tuning
+from roboclaw_driver.roboclaw_driver import Roboclaw
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dev", default="/dev/ttyACM0")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--address", type=int, default=128)
+    parser.add_argument("--motor", type=int, choices=(1, 2), default=1)
+    parser.add_argument("--step-duty", type=int, default=16384, help="duty of the open loop step, of 32767")
+    parser.add_argument("--samples", type=int, default=2000, help="speed samples per test")
+    parser.add_argument("--relay", action="store_true",
+                        help="fit the gains from a relay test instead of the step response model")
+    parser.add_argument("--relay-amplitude", type=int, default=4000, help="relay duty swing, of 32767")
+    parser.add_argument("--rule", choices=("pi", "pid"), default="pi", help="Ziegler-Nichols rule for the relay fit")
+    parser.add_argument("--pid-period", type=float, default=1.0 / 300,
+                        help="period in s of the roboclaw velocity loop, used to discretise I and D")
+    parser.add_argument("--write", action="store_true", help="write the fitted PID and QPPS to the roboclaw")
+    parser.add_argument("--write-nvm", action="store_true", help="also save them to non volatile memory")
+    parser.add_argument("--save", help="save the captured samples to this .npz file")
+    args = parser.parse_args()
+
+    roboclaw = Roboclaw(args.dev, args.address, args.baud)
+
+    print("Step test: motor %d at duty %d" % (args.motor, args.step_duty))
+    step = tuning.step_test(roboclaw, args.motor, args.step_duty, args.samples)
+    t, duty, speed = step.trim()
+    print("  %d samples at %.0f Hz" % (len(t), len(t) / t[-1]))
+    gain, tau, dead = tuning.fit_step(t, duty, speed)
+    qpps = tuning.max_qpps(gain)
+    print("  gain %.4f qpps/duty  tau %.4f s  dead time %.4f s  max qpps %d" % (gain, tau, dead, qpps))
+    captures = {"step_t": t, "step_duty": duty, "step_speed": speed}
+
+    if args.relay:
+        setpoint = speed[-len(speed) // 5:].mean()
+        print("Relay test: around %.0f qpps, amplitude %d" % (setpoint, args.relay_amplitude))
+        relay = tuning.relay_test(roboclaw, args.motor, setpoint, args.step_duty, args.relay_amplitude,
+                                  args.samples)
+        t, duty, speed = relay.trim()
+        ku, pu = tuning.fit_relay(t, duty, speed, setpoint, args.relay_amplitude)
+        print("  ultimate gain %.5f duty/qpps  period %.4f s" % (ku, pu))
+        kp, ti, td = tuning.ziegler_nichols(ku, pu, args.rule)
+        captures.update(relay_t=t, relay_duty=duty, relay_speed=speed)
+    else:
+        kp, ti, td = tuning.simc(gain, tau, dead)
+
+    p, i, d = tuning.discrete_gains(kp, ti, td, args.pid_period)
+    print("Velocity PID: P %.4f  I %.4f  D %.4f  QPPS %d" % (p, i, d, qpps))
+
+    if args.save:
+        np.savez(args.save, **captures)
+
+    if args.write or args.write_nvm:
+        set_pid = roboclaw.SetM1VelocityPID if args.motor == 1 else roboclaw.SetM2VelocityPID
+        if not set_pid(p, i, d, qpps):
+            raise SystemExit("Failed to write the velocity PID")
+        print("Wrote velocity PID")
+        if args.write_nvm:
+            if not roboclaw.WriteNVM():
+                raise SystemExit("Failed to write NVM")
+            print("Saved to NVM")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import itertools
+import mmap
+import os
+import struct
+import time
+
+from .hooks import COMMAND_NAMES, TransactionHook
+
+MAGIC = b"RCBBOX1\0"
+# magic, slots, slot size, pid, created (wall time)
+HEADER = struct.Struct("<8sIIId")
+HEADER_SIZE = 64
+# seq, wall stamp, latency, cmd, address, ok, attempts, crc errors, timeouts, resyncs, bytes out, bytes in,
+# captured tx length, captured rx length
+RECORD = struct.Struct("<QdfHBBBBBBHHBB6x")
+TX_BYTES = 40
+RX_BYTES = 48
+SLOT_SIZE = RECORD.size + TX_BYTES + RX_BYTES
+PIPELINED = 0xFFFF
+
+
+class FrameTap(object):
+    """Wrap a serial port and keep the bytes of the current transaction for the black box"""
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.tx = bytearray()
+        self.rx = bytearray()
+
+    def reset(self):
+        self.tx = bytearray()
+        self.rx = bytearray()
+
+    def write(self, data):
+        self.tx += bytearray(data)
+        return self.ser.write(data)
+
+    def read(self, size=1):
+        data = self.ser.read(size)
+        self.rx += bytearray(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+
+class BlackBox(TransactionHook):
+    """Ring of the last frames and their results in a memory mapped file, read back with read_ring()
+
+    The file lives in /dev/shm by default so it outlives the process without costing a disk write.
+    Writers claim slots from an atomic counter and mark a slot torn (seq 0) while filling it, so
+    several port workers can record without a lock. An existing ring is kept as <path>.prev.
+    """
+
+    def __init__(self, path, slots=4096):
+        self.path = path
+        self.slots = slots
+        if os.path.exists(path):
+            os.rename(path, path + ".prev")
+        size = HEADER_SIZE + slots * SLOT_SIZE
+        fd = os.open(path, os.O_CREAT | os.O_RDWR | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self.map, 0, MAGIC, slots, SLOT_SIZE, os.getpid(), time.time())
+        self._seq = itertools.count(1)
+        self._taps = {}
+
+    def tap(self, ser):
+        """The FrameTap of ser, the same one for every controller on a port"""
+        if isinstance(ser, FrameTap):
+            return ser
+        tap = self._taps.get(id(ser))
+        if tap is None:
+            tap = self._taps[id(ser)] = FrameTap(ser)
+        return tap
+
+    def start(self, roboclaw, cmd, stamp):
+        if isinstance(roboclaw.ser, FrameTap):
+            roboclaw.ser.reset()
+
+    def complete(self, roboclaw, cmd, start, end, stats):
+        self.record(roboclaw, cmd, True, end - start, stats)
+
+    def failed(self, roboclaw, cmd, start, end, stats):
+        self.record(roboclaw, cmd, False, end - start, stats)
+
+    def record(self, roboclaw, cmd, ok, latency, stats):
+        seq = next(self._seq)
+        offset = HEADER_SIZE + (seq % self.slots) * SLOT_SIZE
+        tx, rx = bytearray(), bytearray()
+        if isinstance(roboclaw.ser, FrameTap):
+            tx, rx = roboclaw.ser.tx[:TX_BYTES], roboclaw.ser.rx[:RX_BYTES]
+        struct.pack_into("<Q", self.map, offset, 0)
+        self.map[offset + RECORD.size:offset + RECORD.size + len(tx)] = bytes(tx)
+        self.map[offset + RECORD.size + TX_BYTES:offset + RECORD.size + TX_BYTES + len(rx)] = bytes(rx)
+        RECORD.pack_into(self.map, offset, 0, time.time(), latency, cmd if isinstance(cmd, int) else PIPELINED,
+                         roboclaw.address, ok, min(stats.attempts, 255), min(stats.crc_errors, 255),
+                         min(stats.timeouts, 255), min(stats.resyncs, 255), min(stats.bytes_out, 0xFFFF),
+                         min(stats.bytes_in, 0xFFFF), len(tx), len(rx))
+        # the seq goes in last, a reader that sees it sees the whole record
+        struct.pack_into("<Q", self.map, offset, seq)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+
+
+def read_ring(path):
+    """Header dict and the complete records of a ring file, oldest first"""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, slots, slot_size, pid, created = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("%s is not a roboclaw black box" % path)
+    records = []
+    for i in range(slots):
+        offset = HEADER_SIZE + i * slot_size
+        fields = RECORD.unpack_from(data, offset)
+        if not fields[0]:
+            continue
+        (seq, stamp, latency, cmd, address, ok, attempts, crc_errors, timeouts, resyncs, bytes_out, bytes_in,
+         tx_len, rx_len) = fields
+        body = offset + RECORD.size
+        records.append({"seq": seq, "stamp": stamp, "latency": latency,
+                        "command": "pipelined" if cmd == PIPELINED else COMMAND_NAMES.get(cmd, cmd),
+                        "address": address, "ok": bool(ok), "attempts": attempts, "crc_errors": crc_errors,
+                        "timeouts": timeouts, "resyncs": resyncs, "bytes_out": bytes_out, "bytes_in": bytes_in,
+                        "tx": bytearray(data[body:body + tx_len]),
+                        "rx": bytearray(data[body + TX_BYTES:body + TX_BYTES + rx_len])})
+    records.sort(key=lambda record: record["seq"])
+    return {"slots": slots, "pid": pid, "created": created}, records
@@ -0,0 +1,63 @@
+from .telemetry import monotonic
+
+WRAP = 1 << 32
+# ReadEncM1/M2 status bits, the wrap flags are cleared by the read that returns them
+UNDERFLOW = 0x01
+BACKWARD = 0x02
+OVERFLOW = 0x04
+
+
+class EncoderAccumulator(object):
+    """Running total of one 32 bit roboclaw encoder counter, unaffected by wraparound
+
+    The delta since the last read comes from the underflow or overflow flag when one is set, and
+    otherwise goes the shortest way round the counter. That covers a flag lost with a failed read,
+    and a counter that crossed both ways between reads. When both ways are equally long, the
+    direction bit picks one. A delta over max_delta counts, plus max_rate counts per second
+    since the last read, can only be a reset or SetEnc. The total then carries on from the new
+    count and resets is incremented.
+    """
+
+    def __init__(self, max_delta=WRAP // 4, max_rate=0.0):
+        self.max_delta = max_delta
+        self.max_rate = max_rate
+        self.total = None
+        self.last = None
+        self.last_stamp = None
+        self.resets = 0
+
+    def update(self, count, status, stamp=None):
+        """Fold in a ReadEnc count and status read at stamp (monotonic now by default), returns the total"""
+        count &= WRAP - 1
+        if stamp is None:
+            stamp = monotonic()
+        if self.last is None:
+            # start from the count as the driver reads it, signed
+            self.total = count - WRAP if count >= WRAP // 2 else count
+            self.last = count
+            self.last_stamp = stamp
+            return self.total
+
+        delta = count - self.last
+        wrapped = status & (UNDERFLOW | OVERFLOW)
+        if wrapped == OVERFLOW and delta < 0:
+            delta += WRAP
+        elif wrapped == UNDERFLOW and delta > 0:
+            delta -= WRAP
+        else:
+            delta = (delta + WRAP // 2) % WRAP - WRAP // 2
+            if delta == -WRAP // 2 and not status & BACKWARD:
+                delta += WRAP
+        if abs(delta) > self.max_delta + self.max_rate * max(stamp - self.last_stamp, 0.0):
+            self.resets += 1
+            delta = 0
+        self.total += delta
+        self.last = count
+        self.last_stamp = stamp
+        return self.total
+
+    def reset(self):
+        """Start over from the next count, e.g. after ResetEncoders"""
+        self.total = None
+        self.last = None
+        self.last_stamp = None
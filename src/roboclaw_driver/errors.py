@@ -0,0 +1,41 @@
+# diagnostic_msgs/DiagnosticStatus levels, kept here so the decoder does not need ROS
+OK = 0
+
+
+class ErrorDecoder(object):
+    """Decode a ReadError bitmask into every active flag and the worst severity among them"""
+    def __init__(self, errors):
+        self.normal = errors[0x0000]
+        bits = [(mask, level, message) for mask, (level, message) in sorted(errors.items()) if mask]
+        self.bits = bits
+        # one 256 entry table per byte of the 16 bit status, each entry is (worst level, messages)
+        self.tables = []
+        for shift in (0, 8):
+            table = []
+            for byte in range(256):
+                active = [(level, message) for mask, level, message in bits if (byte << shift) & mask]
+                worst = max([level for level, _ in active] or [OK])
+                table.append((worst, tuple(message for _, message in active)))
+            self.tables.append(table)
+        self._last = None
+
+    def decode(self, status):
+        """Return (level, summary message, active messages) for the status bitmask"""
+        if self._last is not None and self._last[0] == status:
+            return self._last[1]
+        low_level, low_messages = self.tables[0][status & 0xFF]
+        high_level, high_messages = self.tables[1][(status >> 8) & 0xFF]
+        messages = low_messages + high_messages
+        if messages:
+            result = (max(low_level, high_level), ", ".join(messages), messages)
+        else:
+            result = (self.normal[0], self.normal[1], ())
+        self._last = (status, result)
+        return result
+
+    def changes(self, previous, status):
+        """Return (raised, cleared) messages of the bits that changed between two bitmasks"""
+        previous = previous or 0
+        raised = [message for mask, _, message in self.bits if status & mask and not previous & mask]
+        cleared = [message for mask, _, message in self.bits if previous & mask and not status & mask]
+        return raised, cleared
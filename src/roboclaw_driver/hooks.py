@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+
+from .roboclaw_driver import Cmd
+
+COMMAND_NAMES = dict((value, name) for name, value in vars(Cmd).items() if not name.startswith("_"))
+
+
+class TransactionHook(object):
+    """Called by Roboclaw around every transaction once added with Roboclaw.add_hook()
+
+    Stamps are monotonic seconds. Callbacks run on the thread doing the transaction, in the
+    middle of it, so they should only record. stats is a TransactionStats.
+    """
+
+    def start(self, roboclaw, cmd, stamp):
+        pass
+
+    def first_byte(self, roboclaw, cmd, stamp):
+        pass
+
+    def complete(self, roboclaw, cmd, start, end, stats):
+        pass
+
+    def failed(self, roboclaw, cmd, start, end, stats):
+        pass
+
+
+class TraceHook(TransactionHook):
+    """Write every transaction to a Chrome trace event file (chrome://tracing, Perfetto, speedscope)
+
+    Each transaction is a complete event on a track per address, with a nested "wait" event from
+    the request until the first reply byte and the stats as arguments. Events are buffered and
+    written flush_every at a time, the JSON array is left open so a killed process still leaves
+    a readable trace.
+    """
+
+    def __init__(self, path, flush_every=256):
+        self.file = open(path, "w")
+        self.file.write("[\n")
+        self.flush_every = flush_every
+        self.pid = os.getpid()
+        self._events = []
+        self._first = {}
+        self._lock = threading.Lock()
+
+    def first_byte(self, roboclaw, cmd, stamp):
+        self._first[roboclaw.address] = stamp
+
+    def complete(self, roboclaw, cmd, start, end, stats):
+        self._event(roboclaw, cmd, start, end, stats, "ok")
+
+    def failed(self, roboclaw, cmd, start, end, stats):
+        self._event(roboclaw, cmd, start, end, stats, "failed")
+
+    def _event(self, roboclaw, cmd, start, end, stats, result):
+        name = COMMAND_NAMES.get(cmd, cmd)
+        first = self._first.pop(roboclaw.address, None)
+        args = dict(stats._asdict(), result=result)
+        events = [{"name": name, "cat": result, "ph": "X", "pid": self.pid, "tid": roboclaw.address,
+                   "ts": start * 1e6, "dur": (end - start) * 1e6, "args": args}]
+        if first is not None:
+            events.append({"name": "wait", "cat": "wait", "ph": "X", "pid": self.pid, "tid": roboclaw.address,
+                           "ts": start * 1e6, "dur": (first - start) * 1e6})
+        with self._lock:
+            self._events.extend(events)
+            if len(self._events) >= self.flush_every:
+                self._flush()
+
+    def _flush(self):
+        for event in self._events:
+            self.file.write(json.dumps(event))
+            self.file.write(",\n")
+        self._events = []
+        self.file.flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self.file.close()
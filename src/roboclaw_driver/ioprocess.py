@@ -0,0 +1,304 @@
+"""Serial I/O for roboclaw_node in a process of its own, python -m roboclaw_driver.ioprocess <config>
+
+The process imports nothing from ROS, so the node's callbacks, tf and diagnostics cannot hold it
+up on the GIL. It owns every port. Every period it reads the encoders (and speeds) of each
+controller on its own clock and streams them to the node. It also runs the driver calls the node
+sends it, setpoints without a reply. Both directions are shm.Rings. The driver metrics of every
+controller are kept here and sent to the node every METRICS_PERIOD.
+"""
+import contextlib
+import errno
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from .metrics import DriverMetrics, LatencyHistogram
+from .rawserial import RawSerial
+from .realtime import apply_process, apply_thread, collect_idle
+from .roboclaw_driver import Roboclaw
+from .shm import Ring
+from .telemetry import monotonic
+
+# how often either side looks at its ring when there is nothing to do
+POLL = 0.0005
+# a command's metrics take up to 2 KB when its latencies spread over every bucket
+SLOT_SIZE = 4096
+METRICS_PERIOD = 1.0
+
+
+class IOServer(object):
+    """The loop of the I/O process"""
+
+    def __init__(self, config):
+        self.commands = Ring(config["commands"])
+        self.events = Ring(config["events"])
+        self.period = config["period"]
+        self.velocity_source = config["velocity_source"]
+        self.realtime = config.get("realtime") or {}
+        self.roboclaws = {}
+        self.metrics = {}
+        ports = {}
+        simulate = config.get("simulate")
+        raw = config.get("serial_backend") == "raw"
+        if simulate is not None:
+            from .simulator import Motor, SimClock, SimulatedRoboclaw, SimulatedSerial
+            clock = SimClock(simulate["start"], simulate["speed"], simulate["wall"])
+        for dev, address in config["controllers"]:
+            if simulate is not None:
+                if dev not in ports:
+                    ports[dev] = SimulatedSerial([], clock, config["baud"])
+                motors = (Motor(simulate["ticks_per_meter"]), Motor(simulate["ticks_per_meter"]))
+                ports[dev].roboclaws[address] = SimulatedRoboclaw(address, motors)
+            elif raw and dev not in ports:
+                ports[dev] = RawSerial(dev, config["baud"])
+            roboclaw = Roboclaw(dev, address, config["baud"], ser=ports.get(dev))
+            ports[dev] = roboclaw.ser
+            self.roboclaws[(dev, address)] = roboclaw
+            self.metrics[(dev, address)] = DriverMetrics("%s %d" % (dev, address))
+            roboclaw.add_hook(self.metrics[(dev, address)])
+
+    def serve(self):
+        realtime = self.realtime
+        notes = apply_process(realtime.get("lock", False), realtime.get("gc", "default"))
+        notes += apply_thread(realtime.get("priority", 0), realtime.get("cpus"))
+        self.events.put(("realtime", notes))
+        parent = os.getppid()
+        seq = 0
+        next_sample = next_metrics = monotonic()
+        # an orphaned process would keep the ports open, go when the node does
+        while os.getppid() == parent:
+            message = self.commands.get()
+            while message is not None:
+                if message[0] == "quit":
+                    return
+                self.handle(message)
+                message = self.commands.get()
+
+            now = monotonic()
+            if now >= next_sample:
+                # how late the loop woke for the sample, its scheduling latency
+                late = now - next_sample
+                next_sample += self.period
+                if next_sample < now:
+                    next_sample = now + self.period
+                seq += 1
+                for key, roboclaw in self.roboclaws.items():
+                    try:
+                        sample = self.sample(roboclaw)
+                    except OSError:
+                        sample = None
+                    # a node too busy to keep up only loses samples, they are never queued up
+                    self.events.put(("sample", key, seq, time.time(), sample, late))
+            elif now >= next_metrics:
+                next_metrics = now + METRICS_PERIOD
+                self.send_metrics()
+            else:
+                collect_idle()
+            time.sleep(POLL)
+
+    def send_metrics(self):
+        """The running totals of every command, the node replaces its copy so a lost one does not matter"""
+        for key, metrics in self.metrics.items():
+            for cmd, command in list(metrics.commands.items()):
+                self.events.put(("metrics", key, cmd, command.state()))
+
+    def sample(self, roboclaw):
+        """1, enc1, status1, enc2, status2, speed1, speed2, speeds None with velocity_source encoders"""
+        if self.velocity_source == "encoders":
+            enc1, enc2 = roboclaw.ReadEncM1(), roboclaw.ReadEncM2()
+            if not (enc1[0] and enc2[0]):
+                return None
+            return 1, enc1[1], enc1[2], enc2[1], enc2[2], None, None
+        sample = roboclaw.ReadEncodersSpeeds(self.velocity_source == "ispeed")
+        return sample if sample[0] else None
+
+    def handle(self, message):
+        kind = message[0]
+        if kind == "call":
+            _, call_id, key, method, args = message
+            try:
+                reply = ("result", call_id, getattr(self.roboclaws[key], method)(*args))
+            except Exception as e:
+                reply = ("error", call_id, "%s: %s" % (type(e).__name__, e))
+            try:
+                while not self.events.put(reply):
+                    time.sleep(POLL)
+            except ValueError as e:
+                self.events.put(("error", call_id, str(e)))
+        elif kind == "send":
+            _, key, calls = message
+            for method, args in calls:
+                try:
+                    getattr(self.roboclaws[key], method)(*args)
+                except Exception as e:
+                    sys.stderr.write("roboclaw io: %s %s failed: %s\n" % (key, method, e))
+        elif kind == "period":
+            self.period = message[1]
+
+
+class IOProcess(object):
+    """Node side of the I/O process: starts it and talks to it through two rings
+
+    The ring files are prefix_<pid>_commands and _events. controllers is a list of
+    (dev, address). simulate is None or a dict of start, speed, wall and ticks_per_meter,
+    so both processes keep the same simulated clock. realtime is a dict of the realtime
+    options of the process (priority, cpus, lock, gc), realtime_notes what took effect and
+    lateness a LatencyHistogram of how late its loop woke for each sample. serial_backend
+    raw opens the ports with rawserial.RawSerial instead of pyserial. metrics maps (dev, address)
+    to the DriverMetrics the process' metrics are loaded into, see RemoteRoboclaw.add_hook.
+    """
+
+    def __init__(self, controllers, baud, period=0.1, velocity_source="speed", simulate=None, realtime=None,
+                 serial_backend="pyserial", prefix="/dev/shm/roboclaw_io"):
+        prefix = "%s_%d" % (prefix, os.getpid())
+        self.commands = Ring(prefix + "_commands", slot_size=SLOT_SIZE, create=True)
+        self.events = Ring(prefix + "_events", slot_size=SLOT_SIZE, create=True)
+        config = {"commands": self.commands.path, "events": self.events.path, "baud": baud, "period": period,
+                  "velocity_source": velocity_source, "simulate": simulate, "realtime": realtime,
+                  "serial_backend": serial_backend,
+                  "controllers": [[dev, address] for dev, address in controllers]}
+        self.process = subprocess.Popen([sys.executable, "-m", "roboclaw_driver.ioprocess", json.dumps(config)])
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._samples = {}
+        self._seq = None
+        self.realtime_notes = []
+        self.lateness = LatencyHistogram()
+        self.metrics = {}
+        # the command ring has one producer, the node's threads take turns
+        self._lock = threading.Lock()
+        self._running = True
+        self._reader = threading.Thread(target=self._read, name="roboclaw io events")
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _send(self, message):
+        with self._lock:
+            while not self.commands.put(message):
+                if self.process.poll() is not None:
+                    raise OSError(errno.EPIPE, "The I/O process exited")
+                time.sleep(POLL)
+
+    def _read(self):
+        while self._running:
+            message = self.events.get()
+            if message is None:
+                time.sleep(POLL)
+            elif message[0] == "sample":
+                self._samples[tuple(message[1])] = message[2:5]
+                if message[2] != self._seq:
+                    self._seq = message[2]
+                    self.lateness.record(message[5])
+            elif message[0] == "realtime":
+                self.realtime_notes = message[1]
+            elif message[0] == "metrics":
+                metrics = self.metrics.get(tuple(message[1]))
+                if metrics is not None:
+                    metrics.load(message[2], message[3])
+            else:
+                pending = self._pending.pop(message[1], None)
+                if pending is not None:
+                    pending[1] = message
+                    pending[0].set()
+
+    def call(self, key, method, *args, **kwargs):
+        """Run roboclaw method of key in the I/O process and wait for its result"""
+        timeout = kwargs.get("timeout", 5.0)
+        call_id = next(self._ids)
+        pending = self._pending[call_id] = [threading.Event(), None]
+        self._send(("call", call_id, key, method, args))
+        if not pending[0].wait(timeout):
+            self._pending.pop(call_id, None)
+            raise OSError(errno.ETIMEDOUT, "%s timed out in the I/O process" % method)
+        kind, _, value = pending[1]
+        if kind == "error":
+            raise OSError(errno.EIO, value)
+        return value
+
+    def send(self, key, calls):
+        """Queue (method, args) calls of key in order without waiting for them"""
+        self._send(("send", key, list(calls)))
+
+    def sample(self, key):
+        """Latest (seq, wall stamp, sample) read for key, None before the first"""
+        return self._samples.get(key)
+
+    def take_lateness(self):
+        """The loop lateness since the last call"""
+        lateness, self.lateness = self.lateness, LatencyHistogram()
+        return lateness
+
+    def set_period(self, period):
+        self._send(("period", period))
+
+    def close(self, timeout=2.0):
+        try:
+            self._send(("quit",))
+        except OSError:
+            pass
+        deadline = monotonic() + timeout
+        while self.process.poll() is None and monotonic() < deadline:
+            time.sleep(0.01)
+        if self.process.poll() is None:
+            self.process.terminate()
+        self._running = False
+        self._reader.join(1.0)
+        self.commands.close(unlink=True)
+        self.events.close(unlink=True)
+
+
+class RemoteRoboclaw(object):
+    """Stands in for the Roboclaw of (dev, address) in the node, its methods run in the I/O process
+
+    The transactions happen in the other process, so hooks added here are not called. The one
+    exception is a DriverMetrics, which gets the metrics the I/O process collects.
+    """
+
+    def __init__(self, io, dev, address):
+        self.io = io
+        self.key = (dev, address)
+        self.address = address
+        self.hooks = []
+        self._local = threading.local()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        if isinstance(hook, DriverMetrics):
+            self.io.metrics[self.key] = hook
+
+    @contextlib.contextmanager
+    def deferred(self):
+        """Calls made inside are sent together when it ends, without waiting, and return True"""
+        self._local.calls = []
+        try:
+            yield
+        finally:
+            calls, self._local.calls = self._local.calls, None
+            self.io.send(self.key, calls)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args):
+            calls = getattr(self._local, "calls", None)
+            if calls is not None:
+                calls.append((name, args))
+                return True
+            return self.io.call(self.key, name, *args)
+        call.__name__ = name
+        return call
+
+
+def main():
+    config = json.loads(sys.argv[1])
+    config["controllers"] = [(dev, address) for dev, address in config["controllers"]]
+    IOServer(config).serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import numpy as np
+
+
+class Kinematics(object):
+    """Map a body twist (vx, vy, wz) to the surface speed of every wheel with one matrix product
+
+    roles gives the wheel each motor channel drives, in channel order. The (channels x 3) mixing
+    matrix is built once from the geometry, a channel with role "none" gets a row of zeros.
+    Speeds are in the same units as the twist (m/s), divided by the wheel radius multiplier so a
+    bigger than nominal wheel is turned proportionally slower.
+    """
+
+    WHEELS = ()
+
+    def __init__(self, roles, track, wheel_base=0.0, separation_multiplier=1.0, radius_multiplier=1.0):
+        self.roles = tuple(roles)
+        self.track = track * separation_multiplier
+        self.wheel_base = wheel_base
+        self.radius_multiplier = radius_multiplier
+        for role in self.roles:
+            if role != "none" and role not in self.WHEELS:
+                raise ValueError("Unknown wheel %s for %s kinematics, expected one of %s"
+                                 % (role, self.__class__.__name__, ", ".join(self.WHEELS)))
+        self.matrix = np.array([self.row(role) if role != "none" else (0.0, 0.0, 0.0) for role in self.roles],
+                               dtype=float).reshape(len(self.roles), 3) / radius_multiplier
+
+    def row(self, wheel):
+        """Contribution of (vx, vy, wz) to the speed of wheel"""
+        raise NotImplementedError
+
+    def wheel_speeds(self, vx, vy, wz):
+        return self.matrix.dot((vx, vy, wz))
+
+    @staticmethod
+    def side(role):
+        """left/right side of a wheel role, None for a channel that drives nothing"""
+        if role.endswith("left"):
+            return "left"
+        if role.endswith("right"):
+            return "right"
+        return None
+
+
+class DifferentialKinematics(Kinematics):
+    """One wheel per side, turning by driving the sides at different speeds"""
+    WHEELS = ("left", "right")
+
+    def row(self, wheel):
+        half_track = self.track / 2.0
+        if self.side(wheel) == "left":
+            return 1.0, 0.0, -half_track
+        return 1.0, 0.0, half_track
+
+
+class SkidSteerKinematics(DifferentialKinematics):
+    """Any number of wheels per side, wheel_separation_multiplier gives the effective track for the skid"""
+    WHEELS = ("left", "right", "front_left", "front_right", "middle_left", "middle_right", "rear_left", "rear_right")
+
+
+class FourWheelKinematics(DifferentialKinematics):
+    """Four independently driven corner wheels on fixed axles"""
+    WHEELS = ("front_left", "front_right", "rear_left", "rear_right")
+
+
+class MecanumKinematics(Kinematics):
+    """Four mecanum wheels with rollers at 45 degrees, holonomic in the plane"""
+    WHEELS = ("front_left", "front_right", "rear_left", "rear_right")
+
+    def row(self, wheel):
+        k = (self.track + self.wheel_base) / 2.0
+        return {"front_left": (1.0, -1.0, -k),
+                "front_right": (1.0, 1.0, k),
+                "rear_left": (1.0, 1.0, -k),
+                "rear_right": (1.0, -1.0, k)}[wheel]
+
+
+KINEMATICS = {"differential": DifferentialKinematics,
+              "skid_steer": SkidSteerKinematics,
+              "4wd": FourWheelKinematics,
+              "mecanum": MecanumKinematics}
+
+
+def create(kind, roles, track, wheel_base=0.0, separation_multiplier=1.0, radius_multiplier=1.0):
+    """Build the kinematics named kind ("differential", "skid_steer", "4wd" or "mecanum")"""
+    try:
+        cls = KINEMATICS[kind]
+    except KeyError:
+        raise ValueError("Unknown kinematics %s, expected one of %s" % (kind, ", ".join(sorted(KINEMATICS))))
+    return cls(roles, track, wheel_base, separation_multiplier, radius_multiplier)
@@ -0,0 +1,205 @@
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # py2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from .hooks import COMMAND_NAMES, TransactionHook
+
+COUNTERS = ("transactions", "failures", "retries", "crc_errors", "timeouts", "resyncs", "bytes_out", "bytes_in")
+
+
+class LatencyHistogram(object):
+    """HDR style log-linear histogram of latencies in whole microseconds
+
+    Values below 2 * SUB_BUCKETS us get a bucket each, above that every power of two is split in
+    SUB_BUCKETS, about 12% resolution up to 2 ** octaves us. Recording is a couple of integer
+    operations into a fixed list, nothing is allocated.
+    """
+
+    SUB_BITS = 3
+    SUB_BUCKETS = 1 << SUB_BITS
+
+    def __init__(self, octaves=24):
+        self.counts = [0] * ((octaves + 2) << self.SUB_BITS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def index(self, micros):
+        if micros < 2 * self.SUB_BUCKETS:
+            return micros
+        shift = micros.bit_length() - self.SUB_BITS - 1
+        return min(((shift + 1) << self.SUB_BITS) + (micros >> shift) - self.SUB_BUCKETS, len(self.counts) - 1)
+
+    def upper(self, index):
+        """Exclusive upper bound in us of a bucket"""
+        if index < 2 * self.SUB_BUCKETS:
+            return index + 1
+        shift = (index >> self.SUB_BITS) - 1
+        return ((index & (self.SUB_BUCKETS - 1)) + self.SUB_BUCKETS + 1) << shift
+
+    def record(self, seconds):
+        self.counts[self.index(int(seconds * 1e6))] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Upper bound in seconds of the bucket holding quantile q, 0 when empty"""
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return self.upper(i) / 1e6
+        return 0.0
+
+    def cumulative(self, bounds):
+        """Counts at or below each bound in seconds, bounds should fall on powers of two us"""
+        result = []
+        seen = 0
+        i = 0
+        for bound in bounds:
+            while i < len(self.counts) and self.upper(i) <= bound * 1e6 + 0.5:
+                seen += self.counts[i]
+                i += 1
+            result.append(seen)
+        return result
+
+
+class CommandMetrics(object):
+    def __init__(self):
+        self.counters = dict((name, 0) for name in COUNTERS)
+        self.latency = LatencyHistogram()
+
+    def state(self):
+        """Counters and the non-empty latency buckets as plain lists, compact enough to send elsewhere"""
+        latency = self.latency
+        return ([self.counters[name] for name in COUNTERS],
+                [(i, count) for i, count in enumerate(latency.counts) if count], latency.sum, latency.max)
+
+    @classmethod
+    def from_state(cls, state):
+        counters, buckets, total, peak = state
+        metrics = cls()
+        metrics.counters = dict(zip(COUNTERS, counters))
+        for i, count in buckets:
+            metrics.latency.counts[i] = count
+            metrics.latency.count += count
+        metrics.latency.sum = total
+        metrics.latency.max = peak
+        return metrics
+
+
+class DriverMetrics(TransactionHook):
+    """Counters and latency histograms per command of one roboclaw, add it as a hook of the driver
+
+    Only the port worker records, readers on other threads may see a transaction half counted.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.commands = {}
+
+    def complete(self, roboclaw, cmd, start, end, stats):
+        self.record(cmd, True, end - start, stats)
+
+    def failed(self, roboclaw, cmd, start, end, stats):
+        self.record(cmd, False, end - start, stats)
+
+    def record(self, cmd, ok, latency, stats):
+        metrics = self.commands.get(cmd)
+        if metrics is None:
+            metrics = self.commands[cmd] = CommandMetrics()
+        counters = metrics.counters
+        counters["transactions"] += 1
+        if not ok:
+            counters["failures"] += 1
+        counters["retries"] += max(stats.attempts - 1, 0)
+        counters["crc_errors"] += stats.crc_errors
+        counters["timeouts"] += stats.timeouts
+        counters["resyncs"] += stats.resyncs
+        counters["bytes_out"] += stats.bytes_out
+        counters["bytes_in"] += stats.bytes_in
+        metrics.latency.record(latency)
+
+    def load(self, cmd, state):
+        """Replace the metrics of cmd with a CommandMetrics.state() recorded in another process"""
+        self.commands[cmd] = CommandMetrics.from_state(state)
+
+    def totals(self):
+        """Counters summed over every command and the merged latency histogram"""
+        counters = dict((name, 0) for name in COUNTERS)
+        latency = LatencyHistogram()
+        for metrics in list(self.commands.values()):
+            for name in COUNTERS:
+                counters[name] += metrics.counters[name]
+            latency.merge(metrics.latency)
+        return counters, latency
+
+
+# prometheus buckets, powers of two from 128 us to 2 s
+BUCKETS = [2 ** i / 1e6 for i in range(7, 22)]
+
+
+def prometheus(registry):
+    """Every DriverMetrics in registry in the Prometheus text exposition format"""
+    lines = []
+    for counter in COUNTERS:
+        lines.append("# TYPE roboclaw_%s_total counter" % counter)
+        for metrics in registry:
+            for cmd, command in sorted(metrics.commands.items(), key=lambda item: str(item[0])):
+                lines.append('roboclaw_%s_total{controller="%s",command="%s"} %d'
+                             % (counter, metrics.name, COMMAND_NAMES.get(cmd, cmd), command.counters[counter]))
+    lines.append("# TYPE roboclaw_latency_seconds histogram")
+    for metrics in registry:
+        for cmd, command in sorted(metrics.commands.items(), key=lambda item: str(item[0])):
+            labels = 'controller="%s",command="%s"' % (metrics.name, COMMAND_NAMES.get(cmd, cmd))
+            histogram = command.latency
+            for bound, count in zip(BUCKETS, histogram.cumulative(BUCKETS)):
+                lines.append('roboclaw_latency_seconds_bucket{%s,le="%g"} %d' % (labels, bound, count))
+            lines.append('roboclaw_latency_seconds_bucket{%s,le="+Inf"} %d' % (labels, histogram.count))
+            lines.append("roboclaw_latency_seconds_sum{%s} %.6f" % (labels, histogram.sum))
+            lines.append("roboclaw_latency_seconds_count{%s} %d" % (labels, histogram.count))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer(threading.Thread):
+    """Serve prometheus(registry) at http://host:port/metrics from a daemon thread"""
+
+    def __init__(self, registry, port, host="127.0.0.1"):
+        threading.Thread.__init__(self, name="roboclaw metrics")
+        self.daemon = True
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = prometheus(registry).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer((host, port), Handler)
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
@@ -0,0 +1,53 @@
+import numpy as np
+
+
+class AccelLimiter(object):
+    """Ramp wheel setpoints toward their targets within per wheel acceleration limits
+
+    Ramps are synchronised: every wheel gets the acceleration that makes it reach its target at the
+    same time as the slowest wheel, so the commanded curvature is kept all through the ramp.
+    accel_limits is one limit per wheel in setpoint units per second, inf for unlimited.
+    """
+
+    def __init__(self, accel_limits):
+        self.accel_limits = np.asarray(accel_limits, dtype=float)
+
+    @classmethod
+    def from_kinematics(cls, kinematics, linear_accel, angular_accel, lateral_accel=None):
+        """Worst case wheel acceleration when the body accelerates at the given limits"""
+        if lateral_accel is None:
+            lateral_accel = linear_accel
+        # an axis a wheel does not respond to must not contribute, even with an infinite limit
+        with np.errstate(invalid="ignore"):
+            accels = np.abs(kinematics.matrix) * (linear_accel, lateral_accel, angular_accel)
+        return cls(np.where(kinematics.matrix != 0, accels, 0.0).sum(axis=1))
+
+    @property
+    def limited(self):
+        return bool(np.isfinite(self.accel_limits).all())
+
+    def ramp_time(self, current, target):
+        """Time for the slowest wheel to go from current to target at its limit"""
+        delta = np.abs(np.asarray(target, dtype=float) - current)
+        with np.errstate(invalid="ignore"):
+            times = np.where(delta > 0, delta / self.accel_limits, 0.0)
+        return float(times.max()) if len(times) else 0.0
+
+    def ramp_accels(self, current, target):
+        """Acceleration per wheel so all wheels arrive at target together"""
+        delta = np.abs(np.asarray(target, dtype=float) - current)
+        duration = self.ramp_time(current, target)
+        if duration <= 0:
+            return self.accel_limits.copy()
+        accels = delta / duration
+        # a wheel that is already at its target still needs an acceleration to hold it there
+        return np.where(delta > 0, accels, self.accel_limits)
+
+    def step(self, current, target, dt):
+        """Setpoints after dt seconds of a synchronised ramp from current toward target"""
+        current = np.asarray(current, dtype=float)
+        target = np.asarray(target, dtype=float)
+        duration = self.ramp_time(current, target)
+        if duration <= dt:
+            return target.copy()
+        return current + (target - current) * (dt / duration)
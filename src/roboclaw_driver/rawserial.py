@@ -0,0 +1,129 @@
+import errno
+import fcntl
+import io
+import os
+import select
+import struct
+import termios
+
+TIOCGSERIAL = 0x541E
+TIOCSSERIAL = 0x541F
+ASYNC_LOW_LATENCY = 1 << 13
+# struct serial_struct is 72 bytes on 64 bit linux, flags is its fifth int
+SERIAL_STRUCT_SIZE = 72
+SERIAL_FLAGS = struct.Struct("@i")
+SERIAL_FLAGS_OFFSET = 16
+# the FTDI driver buffers up to this many ms before passing a short reply up, 16 by default
+LATENCY_TIMER = "/sys/bus/usb-serial/devices/%s/latency_timer"
+
+
+class RawSerial(object):
+    """The pyserial calls the driver makes, straight on the tty file descriptor
+
+    The tty is raw 8N1 with VMIN = VTIME = 0, so the kernel never holds a read back, and read()
+    waits for the reply with poll() and reads into a buffer allocated once. On open the low
+    latency flag of the port is set and the FTDI latency timer is dropped to 1 ms where the
+    driver and permissions allow. low_latency notes what took effect. Pass it as ser= to Roboclaw.
+    """
+
+    def __init__(self, port, baudrate=115200, timeout=0.1, low_latency=True):
+        self.port = port
+        self.timeout = timeout
+        speed = getattr(termios, "B%d" % baudrate, None)
+        if speed is None:
+            raise ValueError("Unsupported baud rate %d" % baudrate)
+        self.fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            # non blocking only so the open does not wait for carrier, writes should block
+            fcntl.fcntl(self.fd, fcntl.F_SETFL, fcntl.fcntl(self.fd, fcntl.F_GETFL) & ~os.O_NONBLOCK)
+            iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(self.fd)
+            cflag = (cflag & ~(termios.CSIZE | termios.PARENB | termios.CSTOPB | getattr(termios, "CRTSCTS", 0))
+                     | termios.CS8 | termios.CREAD | termios.CLOCAL)
+            cc[termios.VMIN] = 0
+            cc[termios.VTIME] = 0
+            termios.tcsetattr(self.fd, termios.TCSANOW, [0, 0, cflag, 0, speed, speed, cc])
+            termios.tcflush(self.fd, termios.TCIOFLUSH)
+        except Exception:
+            os.close(self.fd)
+            raise
+        self._file = io.FileIO(self.fd, "r+", closefd=False)
+        self._buffer = bytearray(256)
+        self._view = memoryview(self._buffer)
+        self._poll = select.poll()
+        self._poll.register(self.fd, select.POLLIN)
+        self.low_latency = set_low_latency(self.fd, port) if low_latency else []
+
+    def _check_open(self):
+        if self.fd is None:
+            raise ValueError("Attempting to use a port that is not open")
+
+    def write(self, data):
+        self._check_open()
+        view = memoryview(data)
+        written = 0
+        while written < len(view):
+            written += os.write(self.fd, view[written:])
+        return written
+
+    def read(self, size=1):
+        """Up to size bytes, fewer when timeout passes first"""
+        self._check_open()
+        if size > len(self._buffer):
+            self._buffer = bytearray(size)
+            self._view = memoryview(self._buffer)
+        got = 0
+        timeout_ms = int(self.timeout * 1000)
+        while got < size:
+            if not self._poll.poll(timeout_ms):
+                break
+            try:
+                n = self._file.readinto(self._view[got:size])
+            except (IOError, OSError) as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                raise
+            if not n:
+                break
+            got += n
+        return bytes(self._buffer[:got])
+
+    def inWaiting(self):
+        self._check_open()
+        return struct.unpack("@i", fcntl.ioctl(self.fd, termios.FIONREAD, b"\0\0\0\0"))[0]
+
+    def flushInput(self):
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+
+    def flushOutput(self):
+        termios.tcflush(self.fd, termios.TCOFLUSH)
+
+    def isOpen(self):
+        return self.fd is not None
+
+    def close(self):
+        if self.fd is not None:
+            self._poll.unregister(self.fd)
+            os.close(self.fd)
+            self.fd = None
+
+
+def set_low_latency(fd, port):
+    """Set ASYNC_LOW_LATENCY on the port and the FTDI latency timer to 1 ms, notes what took effect"""
+    notes = []
+    try:
+        serial_struct = bytearray(fcntl.ioctl(fd, TIOCGSERIAL, b"\0" * SERIAL_STRUCT_SIZE))
+        flags = SERIAL_FLAGS.unpack_from(serial_struct, SERIAL_FLAGS_OFFSET)[0]
+        SERIAL_FLAGS.pack_into(serial_struct, SERIAL_FLAGS_OFFSET, flags | ASYNC_LOW_LATENCY)
+        fcntl.ioctl(fd, TIOCSSERIAL, bytes(serial_struct))
+        notes.append("ASYNC_LOW_LATENCY")
+    except (IOError, OSError) as e:
+        notes.append("ASYNC_LOW_LATENCY unsupported: %s" % e.strerror)
+    timer = LATENCY_TIMER % os.path.basename(os.path.realpath(port))
+    if os.path.exists(timer):
+        try:
+            with open(timer, "w") as f:
+                f.write("1")
+            notes.append("latency timer 1 ms")
+        except (IOError, OSError) as e:
+            notes.append("latency timer not set: %s" % e.strerror)
+    return notes
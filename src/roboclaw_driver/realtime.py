@@ -0,0 +1,136 @@
+import ctypes
+import ctypes.util
+import gc
+import os
+
+# linux values, py2 has no os.sched_* so everything goes through libc
+SCHED_OTHER = 0
+SCHED_FIFO = 1
+POLICIES = {SCHED_OTHER: "SCHED_OTHER", SCHED_FIFO: "SCHED_FIFO", 2: "SCHED_RR", 3: "SCHED_BATCH", 5: "SCHED_IDLE"}
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+GC_MODES = ("default", "freeze", "idle")
+# allocations the youngest generation holds before an idle loop bothers collecting it
+IDLE_COLLECT = 100
+
+_libc = None
+
+
+class _SchedParam(ctypes.Structure):
+    _fields_ = [("sched_priority", ctypes.c_int)]
+
+
+# cpu_set_t, 1024 CPUs
+_CpuSet = ctypes.c_ulong * (1024 // (8 * ctypes.sizeof(ctypes.c_ulong)))
+_CPU_BITS = 8 * ctypes.sizeof(ctypes.c_ulong)
+
+
+def _lib():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    return _libc
+
+
+def _check(result):
+    if result != 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+
+
+def set_fifo(priority):
+    """Run the calling thread under SCHED_FIFO at priority 1-99, needs CAP_SYS_NICE or an rtprio limit"""
+    _check(_lib().sched_setscheduler(0, SCHED_FIFO, ctypes.byref(_SchedParam(priority))))
+
+
+def set_affinity(cpus):
+    """Pin the calling thread to the given CPU numbers"""
+    mask = _CpuSet()
+    for cpu in cpus:
+        mask[cpu // _CPU_BITS] |= 1 << (cpu % _CPU_BITS)
+    _check(_lib().sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)))
+
+
+def lock_memory():
+    """Lock every current and future page of the process in RAM, so no page fault waits on disk"""
+    _check(_lib().mlockall(MCL_CURRENT | MCL_FUTURE))
+
+
+def scheduling():
+    """(policy name, priority, cpus) the calling thread actually runs with"""
+    libc = _lib()
+    policy = libc.sched_getscheduler(0)
+    param = _SchedParam()
+    _check(libc.sched_getparam(0, ctypes.byref(param)))
+    mask = _CpuSet()
+    _check(libc.sched_getaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)))
+    cpus = [cpu for cpu in range(len(mask) * _CPU_BITS) if mask[cpu // _CPU_BITS] >> (cpu % _CPU_BITS) & 1]
+    return POLICIES.get(policy, str(policy)), param.sched_priority, cpus
+
+
+def apply_thread(priority=0, cpus=None):
+    """SCHED_FIFO priority (0 leaves the policy alone) and affinity for the calling thread
+
+    Returns a note per setting, what took effect or why not, failures are not raised.
+    """
+    notes = []
+    if priority:
+        try:
+            set_fifo(priority)
+            notes.append("SCHED_FIFO %d" % priority)
+        except OSError as e:
+            notes.append("SCHED_FIFO %d failed: %s" % (priority, e.strerror))
+    if cpus:
+        try:
+            set_affinity(cpus)
+            notes.append("pinned to CPU %s" % ",".join(str(cpu) for cpu in cpus))
+        except OSError as e:
+            notes.append("affinity %s failed: %s" % (cpus, e.strerror))
+    return notes
+
+
+def apply_process(lock=False, gc_mode="default"):
+    """mlockall and the collector mode for the whole process, returns notes like apply_thread
+
+    freeze moves everything allocated at startup out of the collector's reach (python 3.7+).
+    idle turns automatic collection off, the I/O loops then collect whenever they have nothing
+    to do, see collect_idle(). Only use it in a process that is nothing but I/O loops, e.g. the
+    I/O process, anything else allocating in it would only be collected when they are idle.
+    """
+    notes = []
+    if lock:
+        try:
+            lock_memory()
+            notes.append("memory locked")
+        except OSError as e:
+            notes.append("mlockall failed: %s" % e.strerror)
+    if gc_mode == "freeze":
+        if hasattr(gc, "freeze"):
+            gc.collect()
+            gc.freeze()
+            notes.append("gc frozen")
+        else:
+            notes.append("gc.freeze needs python 3.7")
+    elif gc_mode == "idle":
+        gc.disable()
+        notes.append("gc when idle")
+    return notes
+
+
+def collect_idle():
+    """Collect if automatic collection is off, call it from an idle I/O loop
+
+    One generation per call, escalating like the automatic collector: the middle one after as many
+    young collections as its threshold, and everything after as many middle ones, so cycles that
+    reach the old generations are freed too.
+    """
+    if gc.isenabled():
+        return
+    count = gc.get_count()
+    _, middle, old = gc.get_threshold()
+    if count[2] >= old:
+        gc.collect()
+    elif count[1] >= middle:
+        gc.collect(1)
+    elif count[0] >= IDLE_COLLECT:
+        gc.collect(0)
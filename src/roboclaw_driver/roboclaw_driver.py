@@ -1,7 +1,17 @@
+import contextlib
+import functools
 import serial
+import struct
 import time
+from collections import namedtuple
 #imself.port threading
 
+# time.monotonic is py3 only, fall back to wall time on py2
+_monotonic = getattr(time, "monotonic", time.time)
+
+# what one transaction cost, passed to the hooks when it completes or fails
+TransactionStats = namedtuple("TransactionStats", "attempts crc_errors timeouts resyncs bytes_out bytes_in")
+
 # Command Enums
 
 class Cmd:
@@ -96,16 +106,95 @@ class Cmd:
     GETPWMMODE = 149
     FLAGBOOTLOADER = 255
 
+def _cached(read):
+    """Serve a settings read from the cache once it succeeded, they only change through a setter"""
+    @functools.wraps(read)
+    def wrapper(self):
+        val = self._settings.get(read.__name__)
+        if val is None:
+            val = tuple(read(self))
+            if val[0]:
+                self._settings[read.__name__] = val
+        return val
+    return wrapper
+
+
+def _invalidates(*reads):
+    """Drop the cached result of reads when the setter is sent, all of them when none are given"""
+    def decorator(write):
+        @functools.wraps(write)
+        def wrapper(self, *args):
+            try:
+                return write(self, *args)
+            finally:
+                if reads:
+                    for name in reads:
+                        self._settings.pop(name, None)
+                else:
+                    self._settings.clear()
+        return wrapper
+    return decorator
+
+
+def _transaction(cmd=None):
+    """Call the hooks of self around each call of a command primitive
+
+    The command is the first argument unless given. Without hooks this is one attribute check.
+    """
+    def decorator(fn):
+        reads = fn.__name__.startswith(("_read", "Read"))
+
+        @functools.wraps(fn)
+        def wrapper(self, *args):
+            if not self.hooks:
+                return fn(self, *args)
+            command = args[0] if cmd is None else cmd
+            self._attempts = self._crc_errors = self._timeouts = self._tx = self._rx = 0
+            self._command = command
+            self._awaiting_first_byte = True
+            start = _monotonic()
+            for hook in self.hooks:
+                hook.start(self, command, start)
+            ok = False
+            try:
+                result = fn(self, *args)
+                ok = bool(result if isinstance(result, bool) else result[0])
+                return result
+            finally:
+                end = _monotonic()
+                self._awaiting_first_byte = False
+                # every read retry flushes the input and starts framing over
+                stats = TransactionStats(self._attempts, self._crc_errors, self._timeouts,
+                                         max(self._attempts - 1, 0) if reads else 0, self._tx, self._rx)
+                for hook in self.hooks:
+                    if ok:
+                        hook.complete(self, command, start, end, stats)
+                    else:
+                        hook.failed(self, command, start, end, stats)
+        return wrapper
+    return decorator
+
+
 class Roboclaw(object):
-    def __init__(self, port, address=128, rate=115200, timeout=0.1):
+    def __init__(self, port, address=128, rate=115200, timeout=0.1, ser=None):
+        """Pass the ser of another Roboclaw to talk to a second address on the same port, or a SimulatedSerial"""
         self._crc = 0
+        self._settings = {}
+        self.hooks = []
+        self._attempts = self._crc_errors = self._timeouts = self._tx = self._rx = 0
+        self._command = None
+        self._awaiting_first_byte = False
         self._trystimeout = 3
         self.address = address
-        self.ser = serial.Serial(port, baudrate=rate, timeout=timeout)
+        if ser is None:
+            ser = serial.Serial(port, baudrate=rate, timeout=timeout)
+        self.ser = ser
 
     def __del__(self):
-        self.StopMotors()
-        self.ser.close()
+        # whoever closed the port stopped the motors first
+        if self.ser.isOpen():
+            self.StopMotors()
+            self.ser.close()
 
     def crc_clear(self):
         self._crc = 0
@@ -120,7 +209,33 @@ class Roboclaw(object):
                 self._crc <<= 1
         return
 
+    @contextlib.contextmanager
+    def deferred(self):
+        """Writes go out as they are made on a local port, see ioprocess.RemoteRoboclaw.deferred"""
+        yield
+
+    def add_hook(self, hook):
+        """Have hook called around every transaction, see hooks.TransactionHook"""
+        self.hooks = self.hooks + [hook]
+
+    def remove_hook(self, hook):
+        self.hooks = [h for h in self.hooks if h is not hook]
+
+    def _first_byte(self):
+        self._awaiting_first_byte = False
+        stamp = _monotonic()
+        for hook in self.hooks:
+            hook.first_byte(self, self._command, stamp)
+
+    def _crc_ok(self, crc):
+        if self._crc & 0xFFFF == crc & 0xFFFF:
+            return True
+        self._crc_errors += 1
+        return False
+
     def _sendcommand(self, command):
+        self._attempts += 1
+        self._tx += 2
         if (self.ser.isOpen()):
             self.crc_clear()
             self._crc_update(self.address)
@@ -131,17 +246,25 @@ class Roboclaw(object):
 
     def _readchecksumword(self):
         data = self.ser.read(2)
+        if self._awaiting_first_byte and data:
+            self._first_byte()
+        self._rx += len(data)
         if len(data) == 2:
             crc = (ord(data[0]) << 8) | ord(data[1])
             return 1, crc
+        self._timeouts += 1
         return 0, 0
 
     def _readbyte(self):
         data = self.ser.read(1)
         if len(data):
+            if self._awaiting_first_byte:
+                self._first_byte()
+            self._rx += 1
             val = ord(data)
             self._crc_update(val)
             return 1, val
+        self._timeouts += 1
         return 0, 0
 
     def _readword(self):
@@ -173,6 +296,7 @@ class Roboclaw(object):
         return 0, 0
 
     def _writebyte(self, val):
+        self._tx += 1
         self._crc_update(val & 0xFF)
         self.ser.write(chr(val & 0xFF))
 
@@ -195,6 +319,7 @@ class Roboclaw(object):
     def _writeslong(self, val):
         self._writelong(val)
 
+    @_transaction()
     def _read1(self, cmd):
         trys = self._trystimeout
         while 1:
@@ -204,7 +329,7 @@ class Roboclaw(object):
             if val1[0]:
                 crc = self._readchecksumword()
                 if crc[0]:
-                    if self._crc & 0xFFFF != crc[1] & 0xFFFF:
+                    if not self._crc_ok(crc[1]):
                         return 0, 0
                     return 1, val1[1]
             trys -= 1
@@ -213,6 +338,7 @@ class Roboclaw(object):
         return 0, 0
 
 
+    @_transaction()
     def _read2(self, cmd):
         trys = self._trystimeout
         while 1:
@@ -222,15 +348,16 @@ class Roboclaw(object):
             if val1[0]:
                 crc = self._readchecksumword()
                 if crc[0]:
-                    if self._crc & 0xFFFF != crc[1] & 0xFFFF:
+                    if not self._crc_ok(crc[1]):
                         return 0, 0
-            return 1, val1[1]
+                    return 1, val1[1]
             trys -= 1
             if trys == 0:
                 break
         return 0, 0
 
 
+    @_transaction()
     def _read4(self, cmd):
         trys = self._trystimeout
         while 1:
@@ -240,7 +367,7 @@ class Roboclaw(object):
             if val1[0]:
                 crc = self._readchecksumword()
                 if crc[0]:
-                    if self._crc & 0xFFFF != crc[1] & 0xFFFF:
+                    if not self._crc_ok(crc[1]):
                         return 0, 0
                     return 1, val1[1]
             trys -= 1
@@ -249,6 +376,7 @@ class Roboclaw(object):
         return 0, 0
 
 
+    @_transaction()
     def _read4_1(self, cmd):
         trys = self._trystimeout
         while 1:
@@ -260,7 +388,7 @@ class Roboclaw(object):
                 if val2[0]:
                     crc = self._readchecksumword()
                     if crc[0]:
-                        if self._crc & 0xFFFF != crc[1] & 0xFFFF:
+                        if not self._crc_ok(crc[1]):
                             return 0, 0
                         return 1, val1[1], val2[1]
             trys -= 1
@@ -269,6 +397,7 @@ class Roboclaw(object):
         return 0, 0
 
 
+    @_transaction()
     def _read_n(self, cmd, args):
         trys = self._trystimeout
         while 1:
@@ -289,11 +418,64 @@ class Roboclaw(object):
                 continue
             crc = self._readchecksumword()
             if crc[0]:
-                if self._crc & 0xFFFF == crc[1] & 0xFFFF:
+                if self._crc_ok(crc[1]):
                     return data
         return 0, 0, 0, 0, 0
 
 
+    @_transaction("pipelined")
+    def _read_pipelined(self, requests):
+        """Send every (cmd, reply length) read back to back, then read all the replies in one go
+
+        The roboclaw answers the commands in order from its receive buffer, so the batch costs one
+        round trip. Returns the reply bytes of each command, None where the crc did not match.
+        """
+        self.ser.flushInput()
+        packet = bytearray()
+        for cmd, length in requests:
+            packet.append(self.address)
+            packet.append(cmd)
+        self.ser.write(bytes(packet))
+        expected = sum(length + 2 for cmd, length in requests)
+        data = bytearray(self.ser.read(expected))
+        if self._awaiting_first_byte and data:
+            self._first_byte()
+        self._attempts += 1
+        self._tx += len(packet)
+        self._rx += len(data)
+        if len(data) < expected:
+            self._timeouts += 1
+
+        replies = []
+        pos = 0
+        for cmd, length in requests:
+            reply = data[pos:pos + length + 2]
+            pos += length + 2
+            if len(reply) < length + 2:
+                replies.append(None)
+                continue
+            self.crc_clear()
+            for val in bytearray((self.address, cmd)) + reply[:length]:
+                self._crc_update(val)
+            if not self._crc_ok(reply[length] << 8 | reply[length + 1]):
+                replies.append(None)
+                continue
+            replies.append(reply[:length])
+        return replies
+
+
+    def ReadPipelined(self, requests):
+        """Raw replies of several fixed length reads, failed ones are retried one at a time"""
+        replies = self._read_pipelined(requests)
+        for i, reply in enumerate(replies):
+            trys = self._trystimeout
+            while reply is None and trys:
+                reply = self._read_pipelined(requests[i:i + 1])[0]
+                trys -= 1
+            replies[i] = reply
+        return replies
+
+
     def _writechecksum(self):
         self._writeword(self._crc & 0xFFFF)
         val = self._readbyte()
@@ -302,6 +484,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write0(self, cmd):
         trys = self._trystimeout
         while trys:
@@ -312,6 +495,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write1(self, cmd, val):
         trys = self._trystimeout
         while trys:
@@ -323,6 +507,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write111(self, cmd, val1, val2):
         trys = self._trystimeout
         while trys:
@@ -335,6 +520,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write111(self, cmd, val1, val2, val3):
         trys = self._trystimeout
         while trys:
@@ -348,6 +534,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write2(self, cmd, val):
         trys = self._trystimeout
         while trys:
@@ -359,6 +546,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _writeS2(self, cmd, val):
         trys = self._trystimeout
         while trys:
@@ -370,6 +558,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write22(self, cmd, val1, val2):
         trys = self._trystimeout
         while trys:
@@ -382,6 +571,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _writeS22(self, cmd, val1, val2):
         trys = self._trystimeout
         while trys:
@@ -394,6 +584,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _writeS2S2(self, cmd, val1, val2):
         trys = self._trystimeout
         while trys:
@@ -406,6 +597,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _writeS24(self, cmd, val1, val2):
         trys = self._trystimeout
         while trys:
@@ -418,6 +610,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _writeS24S24(self, cmd, val1, val2, val3, val4):
         trys = self._trystimeout
         while trys:
@@ -432,6 +625,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write4(self, cmd, val):
         trys = self._trystimeout
         while trys:
@@ -443,6 +637,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _writeS4(self, cmd, val):
         trys = self._trystimeout
         while trys:
@@ -454,6 +649,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write44(self, cmd, val1, val2):
         trys = self._trystimeout
         while trys:
@@ -466,6 +662,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write4S4(self, cmd, val1, val2):
         trys = self._trystimeout
         while trys:
@@ -478,6 +675,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _writeS4S4(self, cmd, val1, val2):
         trys = self._trystimeout
         while trys:
@@ -490,6 +688,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write441(self, cmd, val1, val2, val3):
         trys = self._trystimeout
         while trys:
@@ -503,6 +702,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _writeS441(self, cmd, val1, val2, val3):
         trys = self._trystimeout
         while trys:
@@ -516,6 +716,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write4S4S4(self, cmd, val1, val2, val3):
         trys = self._trystimeout
         while trys:
@@ -529,6 +730,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write4S441(self, cmd, val1, val2, val3, val4):
         trys = self._trystimeout
         while trys:
@@ -543,6 +745,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write4444(self, cmd, val1, val2, val3, val4):
         trys = self._trystimeout
         while trys:
@@ -557,6 +760,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write4S44S4(self, cmd, val1, val2, val3, val4):
         trys = self._trystimeout
         while trys:
@@ -571,6 +775,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write44441(self, cmd, val1, val2, val3, val4, val5):
         trys = self._trystimeout
         while trys:
@@ -586,6 +791,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _writeS44S441(self, cmd, val1, val2, val3, val4, val5):
         trys = self._trystimeout
         while trys:
@@ -601,6 +807,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write4S44S441(self, cmd, val1, val2, val3, val4, val5, val6):
         trys = self._trystimeout
         while trys:
@@ -617,6 +824,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write4S444S441(self, cmd, val1, val2, val3, val4, val5, val6, val7):
         trys = self._trystimeout
         while trys:
@@ -634,6 +842,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write4444444(self, cmd, val1, val2, val3, val4, val5, val6, val7):
         trys = self._trystimeout
         while trys:
@@ -651,6 +860,7 @@ class Roboclaw(object):
         return False
 
 
+    @_transaction()
     def _write444444441(self, cmd, val1, val2, val3, val4, val5, val6, val7, val8, val9):
         trys = self._trystimeout
         while trys:
@@ -680,10 +890,12 @@ class Roboclaw(object):
         return self._write1(Cmd.M1BACKWARD, val)
 
 
+    @_invalidates("ReadMinMaxMainVoltages")
     def SetMinVoltageMainBattery(self, val):
         return self._write1(Cmd.SETMINMB, val)
 
 
+    @_invalidates("ReadMinMaxMainVoltages")
     def SetMaxVoltageMainBattery(self, val):
         return self._write1(Cmd.SETMAXMB, val)
 
@@ -748,6 +960,7 @@ class Roboclaw(object):
         return self._write0(Cmd.RESETENC)
 
 
+    @_transaction(Cmd.GETVERSION)
     def ReadVersion(self):
         trys = self._trystimeout
         while 1:
@@ -758,18 +971,22 @@ class Roboclaw(object):
             for i in range(0, 48):
                 data = self.ser.read(1)
                 if len(data):
+                    if self._awaiting_first_byte:
+                        self._first_byte()
+                    self._rx += 1
                     val = ord(data)
                     self._crc_update(val)
                     if val == 0:
                         break
                     str += data[0]
                 else:
+                    self._timeouts += 1
                     passed = False
                     break
             if passed:
                 crc = self._readchecksumword()
                 if crc[0]:
-                    if self._crc & 0xFFFF == crc[1] & 0xFFFF:
+                    if self._crc_ok(crc[1]):
                         return 1, str
                     else:
                         time.sleep(0.01)
@@ -795,18 +1012,22 @@ class Roboclaw(object):
         return self._read2(Cmd.GETLBATT)
 
 
+    @_invalidates("ReadMinMaxLogicVoltages")
     def SetMinVoltageLogicBattery(self, val):
         return self._write1(Cmd.SETMINLB, val)
 
 
+    @_invalidates("ReadMinMaxLogicVoltages")
     def SetMaxVoltageLogicBattery(self, val):
         return self._write1(Cmd.SETMAXLB, val)
 
 
+    @_invalidates("ReadM1VelocityPID")
     def SetM1VelocityPID(self, p, i, d, qpps):
         return self._write4444(Cmd.SETM1PID, long(d * 65536), long(p * 65536), long(i * 65536), qpps)
 
 
+    @_invalidates("ReadM2VelocityPID")
     def SetM2VelocityPID(self, p, i, d, qpps):
         return self._write4444(Cmd.SETM2PID, long(d * 65536), long(p * 65536), long(i * 65536), qpps)
 
@@ -819,6 +1040,25 @@ class Roboclaw(object):
         return self._read4_1(Cmd.GETM2ISPEED)
 
 
+    def ReadEncodersSpeeds(self, raw=False):
+        """Both encoder counts and speeds in one pipelined batch, the 1/300 s ISpeed when raw
+
+        Returns 1, enc1, status1, enc2, status2, speed1, speed2 with signed speeds in qpps.
+        """
+        speeds = (Cmd.GETM1ISPEED, Cmd.GETM2ISPEED) if raw else (Cmd.GETM1SPEED, Cmd.GETM2SPEED)
+        replies = self.ReadPipelined([(Cmd.GETM1ENC, 5), (Cmd.GETM2ENC, 5), (speeds[0], 5), (speeds[1], 5)])
+        if None in replies:
+            return 0, 0, 0, 0, 0, 0, 0
+        (enc1, status1), (enc2, status2), (speed1, dir1), (speed2, dir2) = \
+            [struct.unpack(">iB", bytes(reply)) for reply in replies]
+        # the direction bit is the sign, whichever way the firmware encodes the value
+        if dir1 & 1 and speed1 > 0:
+            speed1 = -speed1
+        if dir2 & 1 and speed2 > 0:
+            speed2 = -speed2
+        return 1, enc1, status1, enc2, status2, speed1, speed2
+
+
     def DutyM1M2(self, m1, m2):
         return self._writeS2S2(Cmd.MIXEDDUTY, m1, m2)
 
@@ -844,7 +1084,7 @@ class Roboclaw(object):
 
 
     def SpeedAccelM1M2(self, accel, speed1, speed2):
-        return self._write4S4S4(Cmd.M1SPEEDACCEL, accel, speed1, speed2)
+        return self._write4S4S4(Cmd.MIXEDSPEEDACCEL, accel, speed1, speed2)
 
 
     def SpeedDistanceM1(self, speed, distance, ser_buffer):
@@ -868,7 +1108,7 @@ class Roboclaw(object):
 
 
     def SpeedAccelDistanceM1M2(self, accel, speed1, distance1, speed2, distance2, ser_buffer):
-        return self._write4S44S441(Cmd.MIXEDSPEED2ACCELDIST, accel, speed1, distance1, speed2, distance2, ser_buffer)
+        return self._write4S44S441(Cmd.MIXEDSPEEDACCELDIST, accel, speed1, distance1, speed2, distance2, ser_buffer)
 
 
     def ReadBuffers(self):
@@ -924,6 +1164,7 @@ class Roboclaw(object):
     #     return self._writeS24S24(Cmd.MIXEDDUTYACCEL, duty1, accel1, duty2, accel2)
 
 
+    @_cached
     def ReadM1VelocityPID(self):
         data = self._read_n(Cmd.READM1PID, 4)
         if data[0]:
@@ -934,6 +1175,7 @@ class Roboclaw(object):
         return 0, 0, 0, 0, 0
 
 
+    @_cached
     def ReadM2VelocityPID(self):
         data = self._read_n(Cmd.READM2PID, 4)
         if data[0]:
@@ -944,14 +1186,17 @@ class Roboclaw(object):
         return 0, 0, 0, 0, 0
 
 
+    @_invalidates("ReadMinMaxMainVoltages")
     def SetMainVoltages(self, min_val, max_val):
         return self._write22(Cmd.SETMAINVOLTAGES, min_val, max_val)
 
 
+    @_invalidates("ReadMinMaxLogicVoltages")
     def SetLogicVoltages(self, min_val, max_val):
         return self._write22(Cmd.SETLOGICVOLTAGES, min_val, max_val)
 
 
+    @_cached
     def ReadMinMaxMainVoltages(self):
         val = self._read4(Cmd.GETMINMAXMAINVOLTAGES)
         if val[0]:
@@ -961,6 +1206,7 @@ class Roboclaw(object):
         return 0, 0, 0
 
 
+    @_cached
     def ReadMinMaxLogicVoltages(self):
         val = self._read4(Cmd.GETMINMAXLOGICVOLTAGES)
         if val[0]:
@@ -970,15 +1216,18 @@ class Roboclaw(object):
         return 0, 0, 0
 
 
+    @_invalidates("ReadM1PositionPID")
     def SetM1PositionPID(self, kp, ki, kd, kimax_val, deadzone, min_val, max_val):
         return self._write4444444(Cmd.SETM1POSPID, long(kd * 1024), long(kp * 1024), long(ki * 1024), kimax_val, deadzone, min_val, max_val)
 
 
+    @_invalidates("ReadM2PositionPID")
     def SetM2PositionPID(self, kp, ki, kd, kimax_val, deadzone, min_val, max_val):
         return self._write4444444(Cmd.SETM2POSPID, long(kd * 1024), long(kp * 1024), long(ki * 1024), kimax_val, deadzone,
                              min_val, max_val)
 
 
+    @_cached
     def ReadM1PositionPID(self):
         data = self._read_n(Cmd.READM1POSPID, 7)
         if data[0]:
@@ -989,6 +1238,7 @@ class Roboclaw(object):
         return 0, 0, 0, 0, 0, 0, 0, 0
 
 
+    @_cached
     def ReadM2PositionPID(self):
         data = self._read_n(Cmd.READM2POSPID, 7)
         if data[0]:
@@ -1021,10 +1271,13 @@ class Roboclaw(object):
         return self._write4(Cmd.SETM2DEFAULTACCEL, accel)
 
 
+    @_invalidates("ReadPinFunctions")
     def SetPinFunctions(self, S3mode, S4mode, S5mode):
         return self._write111(Cmd.SETPINFUNCTIONS, S3mode, S4mode, S5mode)
 
 
+    @_cached
+    @_transaction(Cmd.GETPINFUNCTIONS)
     def ReadPinFunctions(self):
         trys = self._trystimeout
         while 1:
@@ -1037,7 +1290,7 @@ class Roboclaw(object):
                     if val1[0]:
                         crc = self._readchecksumword()
                         if crc[0]:
-                            if self._crc & 0xFFFF != crc[1] & 0xFFFF:
+                            if not self._crc_ok(crc[1]):
                                 return 0, 0
                             return 1, val1[1], val2[1], val3[1]
             trys -= 1
@@ -1050,6 +1303,7 @@ class Roboclaw(object):
     #     return self._write111(Cmd.SETDEADBAND, min_val, max_val)
 
 
+    @_cached
     def GetDeadBand(self):
         val = self._read2(Cmd.GETDEADBAND)
         if val[0]:
@@ -1058,6 +1312,7 @@ class Roboclaw(object):
 
 
     # Warning(TTL Serial): Baudrate will change if not already set to 38400.  Communications will be lost
+    @_invalidates()
     def RestoreDefaults(self):
         return self._write0(Cmd.RESTOREDEFAULTS)
 
@@ -1074,6 +1329,7 @@ class Roboclaw(object):
         return self._read2(Cmd.GETERROR)
 
 
+    @_cached
     def ReadEncoderModes(self):
         val = self._read2(Cmd.GETENCODERMODE)
         if val[0]:
@@ -1081,10 +1337,12 @@ class Roboclaw(object):
         return 0, 0, 0
 
 
+    @_invalidates("ReadEncoderModes")
     def SetM1EncoderMode(self, mode):
         return self._write1(Cmd.SETM1ENCODERMODE, mode)
 
 
+    @_invalidates("ReadEncoderModes")
     def SetM2EncoderMode(self, mode):
         return self._write1(Cmd.SETM2ENCODERMODE, mode)
 
@@ -1100,6 +1358,7 @@ class Roboclaw(object):
 
     # restores settings from NVM
     # Warning(TTL Serial): If baudrate changes or the control mode changes communications will be lost
+    @_invalidates()
     def ReadNVM(self):
         return self._write0(Cmd.READNVM)
 
@@ -1107,22 +1366,27 @@ class Roboclaw(object):
     # Warning(TTL Serial): If control mode is changed from packet serial mode
     # when setting config communications will be lost!
     # Warning(TTL Serial): If baudrate of packet serial mode is changed communications will be lost!
+    @_invalidates("GetConfig")
     def SetConfig(self, config):
         return self._write2(Cmd.SETCONFIG, config)
 
 
+    @_cached
     def GetConfig(self):
         return self._read2(Cmd.GETCONFIG)
 
 
+    @_invalidates("ReadM1MaxCurrent")
     def SetM1MaxCurrent(self, max_val):
         return self._write44(Cmd.SETM1MAXCURRENT, max_val, 0)
 
 
+    @_invalidates("ReadM2MaxCurrent")
     def SetM2MaxCurrent(self, max_val):
         return self._write44(Cmd.SETM2MAXCURRENT, max_val, 0)
 
 
+    @_cached
     def ReadM1MaxCurrent(self):
         data = self._read_n(Cmd.GETM1MAXCURRENT, 2)
         if data[0]:
@@ -1130,6 +1394,7 @@ class Roboclaw(object):
         return 0, 0
 
 
+    @_cached
     def ReadM2MaxCurrent(self):
         data = self._read_n(Cmd.GETM2MAXCURRENT, 2)
         if data[0]:
@@ -1137,13 +1402,19 @@ class Roboclaw(object):
         return 0, 0
 
 
+    @_invalidates("ReadPWMMode")
     def SetPWMMode(self, mode):
         return self._write1(Cmd.SETPWMMODE, mode)
 
 
+    @_cached
     def ReadPWMMode(self):
         return self._read1(Cmd.GETPWMMODE)
 
+    def InvalidateSettings(self):
+        """Forget every cached settings read, e.g. after another program changed the roboclaw"""
+        self._settings.clear()
+
     def IsOpen(self):
         return self.ser.isOpen()
 
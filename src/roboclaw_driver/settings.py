@@ -0,0 +1,160 @@
+import os
+
+import yaml
+
+from .roboclaw_driver import Cmd
+
+
+class Setting(object):
+    """One group of roboclaw settings read by a single command
+
+    fields gives the (bytes, scale, signed) of each value in the reply, length the full reply
+    length when it has trailing values we ignore. write(roboclaw, *values) sets them, None for
+    settings that can only be read. Values are compared as the raw integers the roboclaw stores,
+    so a profile value only counts as changed when it would change what is on the controller.
+    """
+
+    def __init__(self, cmd, fields, write=None, length=None):
+        self.cmd = cmd
+        self.fields = fields
+        self.write = write
+        self.length = length or sum(size for size, scale, signed in fields)
+
+    def decode_raw(self, reply):
+        raw = []
+        pos = 0
+        for size, scale, signed in self.fields:
+            val = 0
+            for byte in reply[pos:pos + size]:
+                val = val << 8 | byte
+            raw.append(val)
+            pos += size
+        return tuple(raw)
+
+    def encode(self, values):
+        """Raw integers of values given in the units of the setter"""
+        if len(values) != len(self.fields):
+            raise ValueError("Expected %d values, got %d" % (len(self.fields), len(values)))
+        return tuple(int(round(val * scale)) & ((1 << 8 * size) - 1)
+                     for val, (size, scale, signed) in zip(values, self.fields))
+
+    def decode(self, raw):
+        """Values in the units of the setter"""
+        values = []
+        for val, (size, scale, signed) in zip(raw, self.fields):
+            if signed and val & (1 << (8 * size - 1)):
+                val -= 1 << 8 * size
+            values.append(val / float(scale) if scale != 1 else val)
+        return tuple(values)
+
+
+PID = (4, 65536, False)
+POSITION_PID = ((4, 1024, False), (4, 1024, False), (4, 1024, False), (4, 1, False), (4, 1, False), (4, 1, True),
+                (4, 1, True))
+
+SETTINGS = {
+    "m1_velocity_pid": Setting(Cmd.READM1PID, (PID, PID, PID, (4, 1, False)),
+                               lambda r, p, i, d, qpps: r.SetM1VelocityPID(p, i, d, qpps)),
+    "m2_velocity_pid": Setting(Cmd.READM2PID, (PID, PID, PID, (4, 1, False)),
+                               lambda r, p, i, d, qpps: r.SetM2VelocityPID(p, i, d, qpps)),
+    "m1_position_pid": Setting(Cmd.READM1POSPID, POSITION_PID, lambda r, *values: r.SetM1PositionPID(*values)),
+    "m2_position_pid": Setting(Cmd.READM2POSPID, POSITION_PID, lambda r, *values: r.SetM2PositionPID(*values)),
+    "main_voltages": Setting(Cmd.GETMINMAXMAINVOLTAGES, ((2, 1, False), (2, 1, False)),
+                             lambda r, low, high: r.SetMainVoltages(low, high)),
+    "logic_voltages": Setting(Cmd.GETMINMAXLOGICVOLTAGES, ((2, 1, False), (2, 1, False)),
+                              lambda r, low, high: r.SetLogicVoltages(low, high)),
+    "encoder_modes": Setting(Cmd.GETENCODERMODE, ((1, 1, False), (1, 1, False)),
+                             lambda r, m1, m2: r.SetM1EncoderMode(m1) and r.SetM2EncoderMode(m2)),
+    "m1_max_current": Setting(Cmd.GETM1MAXCURRENT, ((4, 1, False),), lambda r, val: r.SetM1MaxCurrent(val), 8),
+    "m2_max_current": Setting(Cmd.GETM2MAXCURRENT, ((4, 1, False),), lambda r, val: r.SetM2MaxCurrent(val), 8),
+    "pin_functions": Setting(Cmd.GETPINFUNCTIONS, ((1, 1, False),) * 3, lambda r, s3, s4, s5: r.SetPinFunctions(s3, s4, s5)),
+    "deadband": Setting(Cmd.GETDEADBAND, ((1, 1, False), (1, 1, False))),
+    "pwm_mode": Setting(Cmd.GETPWMMODE, ((1, 1, False),), lambda r, mode: r.SetPWMMode(mode)),
+    "config": Setting(Cmd.GETCONFIG, ((2, 1, False),), lambda r, config: r.SetConfig(config)),
+}
+
+
+def load_profile(path):
+    """Desired settings from a YAML file, a mapping of setting name to its list of values"""
+    with open(path) as f:
+        profile = yaml.safe_load(f) or {}
+    for name, values in profile.items():
+        if name not in SETTINGS:
+            raise ValueError("Unknown setting %s in %s, expected one of %s" % (name, path, ", ".join(sorted(SETTINGS))))
+        if not isinstance(values, (list, tuple)):
+            profile[name] = [values]
+    return profile
+
+
+def read_settings(roboclaw, names):
+    """Raw values of the named settings, all read in one pipelined batch. Raises OSError on failure"""
+    names = list(names)
+    replies = roboclaw.ReadPipelined([(SETTINGS[name].cmd, SETTINGS[name].length) for name in names])
+    snapshot = {}
+    for name, reply in zip(names, replies):
+        if reply is None:
+            raise OSError("Could not read %s" % name)
+        snapshot[name] = SETTINGS[name].decode_raw(reply)
+    return snapshot
+
+
+def diff(snapshot, desired):
+    """(name, current raw, desired raw) of every setting in snapshot that differs from desired"""
+    return [(name, snapshot[name], desired[name]) for name in sorted(snapshot) if snapshot[name] != desired[name]]
+
+
+class SnapshotCache(object):
+    """Settings known to be on each controller, in a YAML file keyed by controller and firmware version
+
+    A controller whose entry matches the profile was reconciled before with the same firmware and
+    is not read again. Entries are replaced whenever a reconciliation finishes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = yaml.safe_load(f) or {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        return dict((name, tuple(raw)) for name, raw in entry.items()) if entry else None
+
+    def set(self, key, snapshot):
+        self.entries[key] = dict((name, list(raw)) for name, raw in snapshot.items())
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            yaml.safe_dump(self.entries, f, default_flow_style=None)
+        os.rename(tmp, self.path)
+
+
+def reconcile(roboclaw, profile, cache=None, key=None):
+    """Bring the roboclaw in line with profile, writing only the settings that differ
+
+    Returns the list of (name, old values, new values) that were written, None when the snapshot
+    cache already matched and nothing was read. Raises OSError when a read or write fails.
+    """
+    desired = dict((name, SETTINGS[name].encode(values)) for name, values in profile.items())
+    if cache is not None and cache.get(key) == desired:
+        return None
+
+    changes = diff(read_settings(roboclaw, desired), desired)
+    for name, current, wanted in changes:
+        setting = SETTINGS[name]
+        if setting.write is None:
+            raise OSError("%s is read only, cannot change it from %s to %s"
+                          % (name, setting.decode(current), setting.decode(wanted)))
+        if not setting.write(roboclaw, *setting.decode(wanted)):
+            raise OSError("Could not write %s" % name)
+
+    if changes:
+        remaining = diff(read_settings(roboclaw, [name for name, current, wanted in changes]), desired)
+        if remaining:
+            raise OSError("%s did not take the new values" % ", ".join(name for name, current, wanted in remaining))
+    if cache is not None:
+        cache.set(key, desired)
+    return [(name, SETTINGS[name].decode(current), SETTINGS[name].decode(wanted)) for name, current, wanted in changes]
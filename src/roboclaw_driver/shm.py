@@ -0,0 +1,76 @@
+import mmap
+import os
+import pickle
+import struct
+
+# head (next slot the producer writes) and tail (next slot the consumer reads) on their own cache
+# lines, then the ring geometry
+HEAD = struct.Struct("<Q")
+TAIL_OFFSET = 64
+GEOMETRY = struct.Struct("<II")
+GEOMETRY_OFFSET = 8
+DATA_OFFSET = 128
+LENGTH = struct.Struct("<I")
+
+
+class Ring(object):
+    """Single producer single consumer ring of pickled messages in a shared memory file
+
+    The producer only writes head and the consumer only writes tail, each after its slot is
+    complete, so neither side takes a lock. One thread per side; callers with several producer
+    threads serialise put() themselves. create makes the file, the other side opens it by path.
+    """
+
+    def __init__(self, path, slots=256, slot_size=512, create=False):
+        self.path = path
+        if create:
+            fd = os.open(path, os.O_CREAT | os.O_RDWR | os.O_TRUNC, 0o600)
+            size = DATA_OFFSET + slots * slot_size
+            try:
+                os.ftruncate(fd, size)
+                self.map = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            GEOMETRY.pack_into(self.map, GEOMETRY_OFFSET, slots, slot_size)
+        else:
+            fd = os.open(path, os.O_RDWR)
+            try:
+                self.map = mmap.mmap(fd, 0)
+            finally:
+                os.close(fd)
+            slots, slot_size = GEOMETRY.unpack_from(self.map, GEOMETRY_OFFSET)
+        self.slots = slots
+        self.slot_size = slot_size
+
+    def put(self, message):
+        """Append a message, False when the ring is full"""
+        data = pickle.dumps(message, 2)
+        if len(data) > self.slot_size - LENGTH.size:
+            raise ValueError("%d byte message does not fit a %d byte slot" % (len(data), self.slot_size))
+        head = HEAD.unpack_from(self.map, 0)[0]
+        if head - HEAD.unpack_from(self.map, TAIL_OFFSET)[0] >= self.slots:
+            return False
+        offset = DATA_OFFSET + (head % self.slots) * self.slot_size
+        LENGTH.pack_into(self.map, offset, len(data))
+        self.map[offset + LENGTH.size:offset + LENGTH.size + len(data)] = data
+        HEAD.pack_into(self.map, 0, head + 1)
+        return True
+
+    def get(self):
+        """Take the oldest message, None when the ring is empty"""
+        tail = HEAD.unpack_from(self.map, TAIL_OFFSET)[0]
+        if tail == HEAD.unpack_from(self.map, 0)[0]:
+            return None
+        offset = DATA_OFFSET + (tail % self.slots) * self.slot_size
+        length = LENGTH.unpack_from(self.map, offset)[0]
+        message = pickle.loads(self.map[offset + LENGTH.size:offset + LENGTH.size + length])
+        HEAD.pack_into(self.map, TAIL_OFFSET, tail + 1)
+        return message
+
+    def close(self, unlink=False):
+        self.map.close()
+        if unlink:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
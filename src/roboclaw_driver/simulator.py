@@ -0,0 +1,512 @@
+"""Simulated roboclaws and drivetrain behind a pyserial compatible port
+
+SimulatedSerial speaks packet serial for every address on it and steps the physics of each
+motor at 1 kHz on a SimClock. Pass it as ser= to Roboclaw. With a manual clock (speed None)
+time only moves with the bytes on the wire and read timeouts, so a control loop runs in
+lockstep as fast as the host allows. With speed set, simulated time follows the wall clock
+scaled by it.
+"""
+import math
+import struct
+import time
+from collections import deque
+
+from .roboclaw_driver import Cmd
+
+STEP = 0.001
+# the roboclaw velocity loop period I and D are scaled to, as in tuning.discrete_gains
+PID_PERIOD = 1.0 / 300
+DUTY_MAX = 32767
+BUFFER_IDLE = 0x80
+# 1/s, speed setpoint per count of position error near the end of a position move
+POSITION_GAIN = 10.0
+
+
+def crc16(data):
+    crc = 0
+    for byte in bytearray(data):
+        crc ^= byte << 8
+        for bit in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+    return crc & 0xFFFF
+
+
+class SimClock(object):
+    """Simulated seconds since start. Manual when speed is None, else the wall clock times speed"""
+
+    def __init__(self, start=0.0, speed=None, wall=None):
+        """wall is when a scaled clock read start, now by default"""
+        self.speed = speed
+        self._now = start
+        self._wall = time.time() if wall is None else wall
+
+    def now(self):
+        if self.speed is None:
+            return self._now
+        return self._now + (time.time() - self._wall) * self.speed
+
+    def advance(self, dt):
+        """Move a manual clock forward, a scaled clock ignores it"""
+        if self.speed is None:
+            self._now += dt
+
+
+class Battery(object):
+    def __init__(self, voltage=12.6, resistance=0.05):
+        self.open_circuit = voltage
+        self.resistance = resistance
+        self.current = 0.0
+
+    @property
+    def voltage(self):
+        return max(self.open_circuit - self.resistance * self.current, 0.0)
+
+
+class Motor(object):
+    """Brushed DC motor driving a wheel through a gearbox, with a quadrature encoder on the wheel
+
+    The electrical side is integrated implicitly so the sub millisecond L/R time constant stays
+    stable at the 1 ms step. inertia and friction are at the wheel and include its share of the
+    robot. The encoder count is the wheel angle quantised to ticks_per_meter * wheel_radius
+    counts per radian.
+    """
+
+    def __init__(self, ticks_per_meter=4342.2, wheel_radius=0.05, gear_ratio=30.0, resistance=0.5,
+                 inductance=0.5e-3, torque_constant=0.02, inertia=0.05, viscous=0.01, coulomb=0.05,
+                 max_current=15.0, ambient=25.0):
+        self.counts_per_radian = ticks_per_meter * wheel_radius
+        self.gear_ratio = gear_ratio
+        self.resistance = resistance
+        self.inductance = inductance
+        self.torque_constant = torque_constant
+        self.inertia = inertia
+        self.viscous = viscous
+        self.coulomb = coulomb
+        self.max_current = max_current
+        self.ambient = ambient
+        self.temperature = ambient
+        self.current = 0.0
+        self.omega = 0.0
+        self.theta = 0.0
+        self.limited = False
+        self.load = 0.0  # external torque at the wheel
+
+    @property
+    def counts(self):
+        return int(math.floor(self.theta * self.counts_per_radian))
+
+    def step(self, voltage, dt):
+        back_emf = self.torque_constant * self.gear_ratio * self.omega
+        current = (self.current + dt / self.inductance * (voltage - back_emf)) / \
+            (1.0 + dt * self.resistance / self.inductance)
+        self.limited = abs(current) > self.max_current
+        self.current = max(-self.max_current, min(self.max_current, current))
+
+        torque = self.gear_ratio * self.torque_constant * self.current - self.viscous * self.omega - self.load
+        if self.omega == 0.0 and abs(torque) <= self.coulomb:
+            torque = 0.0
+        else:
+            torque -= math.copysign(self.coulomb, self.omega if self.omega != 0.0 else torque)
+        omega = self.omega + torque / self.inertia * dt
+        # friction stops the wheel, it does not reverse it
+        if self.omega != 0.0 and omega * self.omega < 0 and abs(self.gear_ratio * self.torque_constant *
+                                                                self.current) <= self.coulomb:
+            omega = 0.0
+        self.omega = omega
+        self.theta += self.omega * dt
+        self.temperature += dt * (self.resistance * self.current ** 2 * 0.02 - (self.temperature - self.ambient) / 60.0)
+
+
+class Channel(object):
+    """What the roboclaw does with one motor: duty, closed loop speed, buffered distance or position"""
+
+    def __init__(self, motor):
+        self.motor = motor
+        self.mode = "duty"
+        self.duty = 0.0
+        self.applied = 0.0
+        self.target = 0.0  # qpps
+        self.setpoint = 0.0
+        self.accel = None
+        self.segments = deque()
+        self.segment = None
+        self.segment_start = 0
+        self.position = None
+        self.arrived = False
+        self.pid = [1.0, 0.5, 0.25, 44000]  # p, i, d, qpps
+        self.integral = 0.0
+        self.last_error = 0.0
+        self.offset = 0  # SetEnc / ResetEncoders
+        self.history = deque([0] * 11, maxlen=11)
+        self.wrap_flags = 0
+        self.last_reported = 0
+
+    @property
+    def count(self):
+        return self.motor.counts + self.offset
+
+    def speed(self):
+        """Counts per second over the last 10 ms, what ReadSpeed reports"""
+        return int(round((self.history[-1] - self.history[0]) / (10 * STEP)))
+
+    def raw_speed(self):
+        """Counts per second over the last 1/300 s, unfiltered as ReadISpeed"""
+        return int(round((self.history[-1] - self.history[-4]) / (3 * STEP)))
+
+    def set_duty(self, duty):
+        self.mode = "duty"
+        self.duty = max(-1.0, min(1.0, duty))
+        self.segments.clear()
+        self.segment = None
+
+    def set_speed(self, speed, accel=None):
+        self.mode = "speed"
+        self.target = speed
+        self.accel = accel
+        self.segments.clear()
+        self.segment = None
+
+    def queue(self, accel, speed, distance, immediate):
+        if immediate or self.mode != "buffer":
+            self.segments.clear()
+            self.segment = None
+        self.mode = "buffer"
+        self.segments.append((accel, speed, distance))
+
+    def move_to(self, accel, speed, deccel, position, immediate):
+        self.mode = "position"
+        self.position = (accel, speed, deccel, position)
+        self.arrived = False
+
+    def buffer_state(self):
+        if self.mode == "buffer" and (self.segment is not None or self.segments):
+            return len(self.segments)
+        if self.mode == "position" and not self.arrived:
+            return 0
+        return BUFFER_IDLE
+
+    def _ramp(self, target, accel, dt):
+        if accel is None or accel <= 0:
+            self.setpoint = target
+        else:
+            step = accel * dt
+            self.setpoint += max(-step, min(step, target - self.setpoint))
+
+    def control(self, dt):
+        """Duty for this step, running the velocity PID unless in duty mode"""
+        if self.mode == "duty":
+            return self.duty
+        if self.mode == "speed":
+            self._ramp(self.target, self.accel, dt)
+        elif self.mode == "buffer":
+            if self.segment is None and self.segments:
+                self.segment = self.segments.popleft()
+                self.segment_start = self.count
+            if self.segment is None:
+                self._ramp(0.0, None, dt)
+            else:
+                accel, speed, distance = self.segment
+                self._ramp(speed, accel, dt)
+                if abs(self.count - self.segment_start) >= distance:
+                    self.segment = None
+        elif self.mode == "position":
+            accel, speed, deccel, position = self.position
+            error = position - self.count
+            # the braking curve, turning linear close in so the approach settles instead of hunting
+            limit = min(abs(speed), math.sqrt(2.0 * max(deccel, 1) * abs(error)), POSITION_GAIN * abs(error))
+            self._ramp(math.copysign(limit, error), accel if abs(limit) >= abs(self.setpoint) else deccel, dt)
+            # the move is done once settled, the position is held after that
+            self.arrived = self.arrived or abs(error) <= 2 and abs(self.speed()) <= POSITION_GAIN * 2
+        else:
+            self._ramp(0.0, None, dt)
+
+        p, i, d, qpps = self.pid
+        error = self.setpoint - self.speed()
+        out = self.setpoint / float(qpps or 1) * DUTY_MAX + p * error + i * self.integral + \
+            d * (error - self.last_error) * PID_PERIOD / dt
+        self.last_error = error
+        if abs(out) < DUTY_MAX:
+            self.integral += error * dt / PID_PERIOD
+        return max(-1.0, min(1.0, out / DUTY_MAX))
+
+    def sample(self):
+        count = self.count
+        # the roboclaw counter is unsigned 32 bits, flag when it wraps since the last read
+        wrapped = count // (1 << 32) - self.last_reported // (1 << 32)
+        if wrapped > 0:
+            self.wrap_flags |= 0x04
+        elif wrapped < 0:
+            self.wrap_flags |= 0x01
+        self.last_reported = count
+        self.history.append(count)
+
+    def read_encoder(self):
+        status = self.wrap_flags | (0x02 if self.motor.omega < 0 else 0)
+        self.wrap_flags = 0
+        return self.count & 0xFFFFFFFF, status
+
+
+class SimulatedRoboclaw(object):
+    """Registers, control loops and the two motors of one roboclaw on a shared battery"""
+
+    VERSION = b"USB Roboclaw 2x15a v4.1.34 simulated\n"
+
+    def __init__(self, address=128, motors=None, battery=None):
+        self.address = address
+        self.channels = [Channel(motor) for motor in (motors or (Motor(), Motor()))]
+        self.battery = battery or Battery()
+        self.main_voltages = [60, 340]
+        self.logic_voltages = [60, 340]
+        self.registers = {"config": 0x8003, "pwm_mode": 1, "encoder_modes": [0, 0], "pin_functions": [0, 0, 0],
+                          "deadband": [0, 0], "position_pid": [[0] * 7, [0] * 7], "max_current": [1500, 1500],
+                          "default_accel": [0, 0]}
+
+    def step(self, dt):
+        voltage = self.battery.voltage
+        supply = 0.0
+        for channel in self.channels:
+            duty = channel.applied = channel.control(dt)
+            channel.motor.step(duty * voltage, dt)
+            supply += abs(duty * channel.motor.current)
+            channel.sample()
+        self.battery.current = supply
+
+    @property
+    def error(self):
+        error = 0
+        for channel, flag in zip(self.channels, (0x0001, 0x0002)):
+            if channel.motor.limited:
+                error |= flag
+        voltage = self.battery.voltage * 10
+        if voltage < self.main_voltages[0]:
+            error |= 0x0800
+        elif voltage > self.main_voltages[1]:
+            error |= 0x0400
+        for channel, flag in zip(self.channels, (0x1000, 0x2000)):
+            if channel.motor.temperature > 85:
+                error |= flag
+        return error
+
+    def read(self, cmd):
+        """Reply payload of a read command, None for one we do not know"""
+        m1, m2 = self.channels
+        if cmd in (Cmd.GETM1ENC, Cmd.GETM2ENC):
+            return struct.pack(">IB", *(m1 if cmd == Cmd.GETM1ENC else m2).read_encoder())
+        if cmd in (Cmd.GETM1SPEED, Cmd.GETM2SPEED, Cmd.GETM1ISPEED, Cmd.GETM2ISPEED):
+            channel = m1 if cmd in (Cmd.GETM1SPEED, Cmd.GETM1ISPEED) else m2
+            speed = channel.speed() if cmd in (Cmd.GETM1SPEED, Cmd.GETM2SPEED) else channel.raw_speed()
+            return struct.pack(">IB", speed & 0xFFFFFFFF, 1 if speed < 0 else 0)
+        if cmd == Cmd.GETVERSION:
+            return self.VERSION + b"\0"
+        if cmd in (Cmd.GETMBATT, Cmd.GETLBATT):
+            return struct.pack(">H", int(round(self.battery.voltage * 10)))
+        if cmd == Cmd.GETBUFFERS:
+            return struct.pack(">BB", m1.buffer_state(), m2.buffer_state())
+        if cmd == Cmd.GETPWMS:
+            return struct.pack(">hh", *[int(round(c.applied * DUTY_MAX)) for c in self.channels])
+        if cmd == Cmd.GETCURRENTS:
+            return struct.pack(">hh", *[int(round(abs(c.motor.current) * 100)) for c in self.channels])
+        if cmd in (Cmd.READM1PID, Cmd.READM2PID):
+            p, i, d, qpps = (m1 if cmd == Cmd.READM1PID else m2).pid
+            return struct.pack(">IIII", int(p * 65536), int(i * 65536), int(d * 65536), qpps)
+        if cmd == Cmd.GETMINMAXMAINVOLTAGES:
+            return struct.pack(">HH", *self.main_voltages)
+        if cmd == Cmd.GETMINMAXLOGICVOLTAGES:
+            return struct.pack(">HH", *self.logic_voltages)
+        if cmd in (Cmd.READM1POSPID, Cmd.READM2POSPID):
+            return struct.pack(">IIIIIii", *self.registers["position_pid"][cmd - Cmd.READM1POSPID])
+        if cmd in (Cmd.GETTEMP, Cmd.GETTEMP2):
+            return struct.pack(">H", int(round(self.channels[cmd - Cmd.GETTEMP].motor.temperature * 10)))
+        if cmd == Cmd.GETERROR:
+            return struct.pack(">H", self.error)
+        if cmd == Cmd.GETENCODERMODE:
+            return struct.pack(">BB", *self.registers["encoder_modes"])
+        if cmd == Cmd.GETCONFIG:
+            return struct.pack(">H", self.registers["config"])
+        if cmd in (Cmd.GETM1MAXCURRENT, Cmd.GETM2MAXCURRENT):
+            return struct.pack(">ii", self.registers["max_current"][cmd - Cmd.GETM1MAXCURRENT], 0)
+        if cmd == Cmd.GETPWMMODE:
+            return struct.pack(">B", self.registers["pwm_mode"])
+        if cmd == Cmd.GETPINFUNCTIONS:
+            return struct.pack(">BBB", *self.registers["pin_functions"])
+        if cmd == Cmd.GETDEADBAND:
+            return struct.pack(">BB", *self.registers["deadband"])
+        return None
+
+    def write(self, cmd, payload):
+        """Apply a write command, False for one we do not know"""
+        m1, m2 = self.channels
+        fmt = WRITES[cmd]
+        values = struct.unpack(fmt, bytes(payload)) if fmt else ()
+        if cmd in (Cmd.M1FORWARD, Cmd.M1BACKWARD, Cmd.M2FORWARD, Cmd.M2BACKWARD):
+            sign = -1 if cmd in (Cmd.M1BACKWARD, Cmd.M2BACKWARD) else 1
+            (m1 if cmd in (Cmd.M1FORWARD, Cmd.M1BACKWARD) else m2).set_duty(sign * values[0] / 127.0)
+        elif cmd == Cmd.RESETENC:
+            for channel in self.channels:
+                channel.offset = -channel.motor.counts
+                channel.history.extend([0] * 11)
+                channel.last_reported = 0
+        elif cmd in (Cmd.SETM1ENCCOUNT, Cmd.SETM2ENCCOUNT):
+            channel = m1 if cmd == Cmd.SETM1ENCCOUNT else m2
+            channel.offset = values[0] - channel.motor.counts
+            channel.history.extend([values[0]] * 11)
+            channel.last_reported = values[0]
+        elif cmd in (Cmd.SETM1PID, Cmd.SETM2PID):
+            d, p, i, qpps = values
+            (m1 if cmd == Cmd.SETM1PID else m2).pid = [p / 65536.0, i / 65536.0, d / 65536.0, qpps]
+        elif cmd in (Cmd.M1DUTY, Cmd.M2DUTY):
+            (m1 if cmd == Cmd.M1DUTY else m2).set_duty(values[0] / float(DUTY_MAX))
+        elif cmd == Cmd.MIXEDDUTY:
+            m1.set_duty(values[0] / float(DUTY_MAX))
+            m2.set_duty(values[1] / float(DUTY_MAX))
+        elif cmd in (Cmd.M1SPEED, Cmd.M2SPEED):
+            (m1 if cmd == Cmd.M1SPEED else m2).set_speed(values[0])
+        elif cmd == Cmd.MIXEDSPEED:
+            m1.set_speed(values[0])
+            m2.set_speed(values[1])
+        elif cmd in (Cmd.M1SPEEDACCEL, Cmd.M2SPEEDACCEL):
+            (m1 if cmd == Cmd.M1SPEEDACCEL else m2).set_speed(values[1], values[0])
+        elif cmd == Cmd.MIXEDSPEEDACCEL:
+            m1.set_speed(values[1], values[0])
+            m2.set_speed(values[2], values[0])
+        elif cmd == Cmd.MIXEDSPEED2ACCEL:
+            m1.set_speed(values[1], values[0])
+            m2.set_speed(values[3], values[2])
+        elif cmd in (Cmd.M1SPEEDACCELDIST, Cmd.M2SPEEDACCELDIST):
+            accel, speed, distance, buffer = values
+            (m1 if cmd == Cmd.M1SPEEDACCELDIST else m2).queue(accel, speed, distance, buffer)
+        elif cmd == Cmd.MIXEDSPEEDACCELDIST:
+            accel, speed1, distance1, speed2, distance2, buffer = values
+            m1.queue(accel, speed1, distance1, buffer)
+            m2.queue(accel, speed2, distance2, buffer)
+        elif cmd == Cmd.MIXEDSPEED2ACCELDIST:
+            accel1, speed1, distance1, accel2, speed2, distance2, buffer = values
+            m1.queue(accel1, speed1, distance1, buffer)
+            m2.queue(accel2, speed2, distance2, buffer)
+        elif cmd in (Cmd.M1SPEEDACCELDECCELPOS, Cmd.M2SPEEDACCELDECCELPOS):
+            channel = m1 if cmd == Cmd.M1SPEEDACCELDECCELPOS else m2
+            channel.move_to(*values)
+        elif cmd == Cmd.MIXEDSPEEDACCELDECCELPOS:
+            m1.move_to(*(values[0:4] + values[8:9]))
+            m2.move_to(*values[4:9])
+        elif cmd == Cmd.SETMAINVOLTAGES:
+            self.main_voltages = list(values)
+        elif cmd == Cmd.SETLOGICVOLTAGES:
+            self.logic_voltages = list(values)
+        elif cmd in (Cmd.SETMINMB, Cmd.SETMAXMB, Cmd.SETMINLB, Cmd.SETMAXLB):
+            pass
+        elif cmd in (Cmd.SETM1POSPID, Cmd.SETM2POSPID):
+            d, p, i = values[0:3]
+            self.registers["position_pid"][cmd - Cmd.SETM1POSPID] = [p, i, d] + list(values[3:])
+        elif cmd in (Cmd.SETM1DEFAULTACCEL, Cmd.SETM2DEFAULTACCEL):
+            self.registers["default_accel"][cmd - Cmd.SETM1DEFAULTACCEL] = values[0]
+        elif cmd == Cmd.SETPINFUNCTIONS:
+            self.registers["pin_functions"] = list(values)
+        elif cmd in (Cmd.SETM1ENCODERMODE, Cmd.SETM2ENCODERMODE):
+            self.registers["encoder_modes"][cmd - Cmd.SETM1ENCODERMODE] = values[0]
+        elif cmd in (Cmd.SETM1MAXCURRENT, Cmd.SETM2MAXCURRENT):
+            self.registers["max_current"][cmd - Cmd.SETM1MAXCURRENT] = values[0]
+            self.channels[cmd - Cmd.SETM1MAXCURRENT].motor.max_current = values[0] / 100.0
+        elif cmd == Cmd.SETCONFIG:
+            self.registers["config"] = values[0]
+        elif cmd == Cmd.SETPWMMODE:
+            self.registers["pwm_mode"] = values[0]
+        # RESTOREDEFAULTS, WRITENVM and READNVM are acknowledged and otherwise ignored
+        return True
+
+
+# payload format of every write command we simulate, after address and command and before the crc
+WRITES = {Cmd.M1FORWARD: ">B", Cmd.M1BACKWARD: ">B", Cmd.M2FORWARD: ">B", Cmd.M2BACKWARD: ">B",
+          Cmd.SETMINMB: ">B", Cmd.SETMAXMB: ">B", Cmd.SETMINLB: ">B", Cmd.SETMAXLB: ">B",
+          Cmd.RESETENC: "", Cmd.SETM1ENCCOUNT: ">i", Cmd.SETM2ENCCOUNT: ">i",
+          Cmd.SETM1PID: ">IIII", Cmd.SETM2PID: ">IIII",
+          Cmd.M1DUTY: ">h", Cmd.M2DUTY: ">h", Cmd.MIXEDDUTY: ">hh",
+          Cmd.M1SPEED: ">i", Cmd.M2SPEED: ">i", Cmd.MIXEDSPEED: ">ii",
+          Cmd.M1SPEEDACCEL: ">Ii", Cmd.M2SPEEDACCEL: ">Ii", Cmd.MIXEDSPEEDACCEL: ">Iii", Cmd.MIXEDSPEED2ACCEL: ">IiIi",
+          Cmd.M1SPEEDACCELDIST: ">IiIB", Cmd.M2SPEEDACCELDIST: ">IiIB", Cmd.MIXEDSPEEDACCELDIST: ">IiIiIB",
+          Cmd.MIXEDSPEED2ACCELDIST: ">IiIIiIB",
+          Cmd.M1SPEEDACCELDECCELPOS: ">IiIiB", Cmd.M2SPEEDACCELDECCELPOS: ">IiIiB",
+          Cmd.MIXEDSPEEDACCELDECCELPOS: ">IiIiIiIiB",
+          Cmd.SETMAINVOLTAGES: ">HH", Cmd.SETLOGICVOLTAGES: ">HH",
+          Cmd.SETM1POSPID: ">IIIIIii", Cmd.SETM2POSPID: ">IIIIIii",
+          Cmd.SETM1DEFAULTACCEL: ">I", Cmd.SETM2DEFAULTACCEL: ">I", Cmd.SETPINFUNCTIONS: ">BBB",
+          Cmd.RESTOREDEFAULTS: "", Cmd.SETM1ENCODERMODE: ">B", Cmd.SETM2ENCODERMODE: ">B",
+          Cmd.WRITENVM: ">I", Cmd.READNVM: "", Cmd.SETCONFIG: ">H",
+          Cmd.SETM1MAXCURRENT: ">ii", Cmd.SETM2MAXCURRENT: ">ii", Cmd.SETPWMMODE: ">B"}
+
+
+class SimulatedSerial(object):
+    """pyserial stand in connected to simulated roboclaws, stepping their physics up to clock time
+
+    Every byte on the wire costs 10 / baud simulated seconds and a read that comes up short
+    waits out timeout, so a manual clock advances the way the real link would.
+    """
+
+    def __init__(self, roboclaws, clock=None, baud=115200, timeout=0.1):
+        self.roboclaws = dict((roboclaw.address, roboclaw) for roboclaw in roboclaws)
+        self.clock = clock or SimClock()
+        self.byte_time = 10.0 / baud
+        self.timeout = timeout
+        self.time = self.clock.now()
+        self._in = bytearray()
+        self._out = bytearray()
+        self._open = True
+
+    def sync(self):
+        """Step the physics up to the clock"""
+        now = self.clock.now()
+        while self.time + STEP <= now:
+            for roboclaw in self.roboclaws.values():
+                roboclaw.step(STEP)
+            self.time += STEP
+
+    def write(self, data):
+        data = bytearray(data)
+        self.clock.advance(len(data) * self.byte_time)
+        self.sync()
+        self._in += data
+        self._parse()
+        return len(data)
+
+    def _parse(self):
+        while len(self._in) >= 2:
+            address, cmd = self._in[0], self._in[1]
+            roboclaw = self.roboclaws.get(address)
+            if roboclaw is None:
+                # another device, or noise: drop a byte and try to frame again
+                del self._in[0]
+                continue
+            if cmd in WRITES:
+                length = 2 + struct.calcsize(WRITES[cmd]) + 2
+                if len(self._in) < length:
+                    return
+                packet, self._in = self._in[:length], self._in[length:]
+                if crc16(packet[:-2]) == (packet[-2] << 8 | packet[-1]) and roboclaw.write(cmd, packet[2:-2]):
+                    self._out.append(0xFF)
+                continue
+            packet, self._in = self._in[:2], self._in[2:]
+            payload = roboclaw.read(cmd)
+            if payload is not None:
+                reply = bytearray(payload)
+                self._out += reply + bytearray(struct.pack(">H", crc16(bytearray(packet) + reply)))
+
+    def read(self, size=1):
+        self.sync()
+        data, self._out = self._out[:size], self._out[size:]
+        self.clock.advance(len(data) * self.byte_time if len(data) == size else self.timeout)
+        return bytes(data)
+
+    def inWaiting(self):
+        return len(self._out)
+
+    def flushInput(self):
+        self._out = bytearray()
+
+    def flushOutput(self):
+        pass
+
+    def isOpen(self):
+        return self._open
+
+    def close(self):
+        self._open = False
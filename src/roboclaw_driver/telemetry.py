@@ -0,0 +1,129 @@
+import threading
+import time
+
+# time.monotonic is py3 only, fall back to wall time on py2
+monotonic = getattr(time, "monotonic", time.time)
+
+
+class TelemetryCache(object):
+    """Thread safe store of the last value read for each telemetry item and when it was read"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def set(self, key, value, stamp=None):
+        if stamp is None:
+            stamp = monotonic()
+        with self._lock:
+            self._values[key] = (value, stamp)
+
+    def get(self, key, default=None):
+        """Return (value, age in seconds), age is None if the item was never read"""
+        with self._lock:
+            entry = self._values.get(key)
+        if entry is None:
+            return default, None
+        return entry[0], monotonic() - entry[1]
+
+    def oldest_age(self, keys):
+        """Age of the stalest of keys, None if any of them was never read"""
+        now = monotonic()
+        with self._lock:
+            entries = [self._values.get(key) for key in keys]
+        if not entries or None in entries:
+            return None
+        return now - min(entry[1] for entry in entries)
+
+
+class TelemetryPoller(object):
+    """Fill a TelemetryCache from the roboclaw, one read every `decimation` calls to poll()
+
+    Reads are done round robin so the bus time spent on telemetry is spread evenly over the
+    control loop instead of bursting. reads is a list of (key, Roboclaw method name).
+    """
+
+    DEFAULT_READS = [("error", "ReadError"),
+                     ("main_battery", "ReadMainBatteryVoltage"),
+                     ("logic_battery", "ReadLogicBatteryVoltage"),
+                     ("temp1", "ReadTemp"),
+                     ("temp2", "ReadTemp2")]
+
+    def __init__(self, roboclaw, cache, reads=None, decimation=1):
+        self.roboclaw = roboclaw
+        self.cache = cache
+        self.reads = list(reads if reads is not None else self.DEFAULT_READS)
+        self.decimation = max(1, int(decimation))
+        self._count = 0
+        self._next = 0
+
+    @property
+    def keys(self):
+        return [key for key, _ in self.reads]
+
+    def poll(self):
+        """Do the next telemetry read if one is due, return the key read or None"""
+        self._count += 1
+        if self._count % self.decimation != 0 or not self.reads:
+            return None
+        key, method = self.reads[self._next]
+        self._next = (self._next + 1) % len(self.reads)
+        result = getattr(self.roboclaw, method)()
+        if result[0]:
+            self.cache.set(key, result[1] if len(result) == 2 else tuple(result[1:]))
+        return key
+
+
+class RawTelemetrySampler(object):
+    """Read motor level telemetry into a fixed layout list of ints every `decimation` calls to poll()
+
+    Currents, PWMs, command buffer depths and speeds are read from the roboclaw, temperatures come
+    from the TelemetryCache. Fields whose read failed keep their previous value and have their bit
+    cleared in the trailing valid mask.
+    """
+
+    FIELDS = ("m1_current", "m2_current",   # 10mA
+              "m1_pwm", "m2_pwm",           # duty, +-32767
+              "m1_buffer", "m2_buffer",     # queued buffered commands, 128 = buffer empty and idle
+              "m1_speed", "m2_speed",       # qpps
+              "temp1", "temp2",             # 0.1 C
+              "valid")                      # bit i set if FIELDS[i] is fresh
+
+    # (Roboclaw method, index of first field filled, number of fields)
+    READS = (("ReadCurrents", 0, 2),
+             ("ReadPWMs", 2, 2),
+             ("ReadBuffers", 4, 2),
+             ("ReadSpeedM1", 6, 1),
+             ("ReadSpeedM2", 7, 1))
+
+    CACHED = (("temp1", 8), ("temp2", 9))
+
+    def __init__(self, roboclaw, cache, decimation=1):
+        self.roboclaw = roboclaw
+        self.cache = cache
+        self.decimation = int(decimation)
+        self.sample = [0] * len(self.FIELDS)
+        self._count = 0
+
+    def poll(self):
+        """Return the refreshed sample list if one is due, None otherwise"""
+        if self.decimation <= 0:
+            return None
+        self._count += 1
+        if self._count % self.decimation != 0:
+            return None
+
+        sample = self.sample
+        valid = 0
+        for method, index, count in self.READS:
+            result = getattr(self.roboclaw, method)()
+            if result[0]:
+                sample[index:index + count] = result[1:1 + count]
+                valid |= ((1 << count) - 1) << index
+        for key, index in self.CACHED:
+            value, _ = self.cache.get(key)
+            if value is not None:
+                sample[index] = value
+                valid |= 1 << index
+        sample[-1] = valid
+        return sample
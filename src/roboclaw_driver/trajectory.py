@@ -0,0 +1,124 @@
+import math
+import threading
+from collections import deque
+
+# ReadBuffers reports this when a motor's buffer is empty and its last command has finished
+BUFFER_IDLE = 0x80
+
+
+def wheel_segments(times, speeds1, speeds2):
+    """Turn a time parameterised profile of both motors into buffered SpeedAccelDistance commands
+
+    times are seconds from the start, speeds the qpps of each motor at those times. Every interval
+    becomes one (accel1, speed1, distance1, accel2, speed2, distance2) segment that accelerates to
+    the speed at the end of the interval and covers the distance of a linear speed ramp. An
+    interval in which a motor reverses is first split where its speed crosses zero, the distance
+    is unsigned so one segment would only cover the difference of the two halves.
+    """
+    for i in range(1, len(times)):
+        if times[i] <= times[i - 1]:
+            raise ValueError("Trajectory times must be strictly increasing")
+    times, speeds1, speeds2 = split_reversals(times, speeds1, speeds2)
+
+    segments = []
+    for i in range(1, len(times)):
+        dt = float(times[i] - times[i - 1])
+        segment = []
+        for speeds in (speeds1, speeds2):
+            accel = abs(speeds[i] - speeds[i - 1]) / dt
+            distance = abs(speeds[i - 1] + speeds[i]) / 2.0 * dt
+            segment.extend((max(1, int(round(accel))), int(round(speeds[i])), int(round(distance))))
+        segments.append(tuple(segment))
+    return segments
+
+
+def split_reversals(times, speeds1, speeds2):
+    """times, speeds1, speeds2 with a point added at rest wherever a motor changes direction between two
+
+    The other motor's speed at the added point is interpolated linearly.
+    """
+    out_times, out1, out2 = [times[0]], [speeds1[0]], [speeds2[0]]
+    for i in range(1, len(times)):
+        t0, dt = float(times[i - 1]), float(times[i] - times[i - 1])
+        crossings = sorted(set(speeds[i - 1] / float(speeds[i - 1] - speeds[i])
+                               for speeds in (speeds1, speeds2) if speeds[i - 1] * speeds[i] < 0))
+        for fraction in crossings:
+            out_times.append(t0 + fraction * dt)
+            out1.append(speeds1[i - 1] + (speeds1[i] - speeds1[i - 1]) * fraction)
+            out2.append(speeds2[i - 1] + (speeds2[i] - speeds2[i - 1]) * fraction)
+        out_times.append(times[i])
+        out1.append(speeds1[i])
+        out2.append(speeds2[i])
+    return out_times, out1, out2
+
+
+def move_duration(distance, speed, accel, deccel):
+    """Seconds a position move of distance counts takes from rest to rest on a trapezoidal speed profile"""
+    distance = abs(distance)
+    ramps = speed * speed / (2.0 * accel) + speed * speed / (2.0 * deccel)
+    if distance >= ramps:
+        return distance / float(speed) + speed / (2.0 * accel) + speed / (2.0 * deccel)
+    # never reaches speed, a triangle peaking where the two ramps meet
+    peak = math.sqrt(2.0 * distance * accel * deccel / (accel + deccel))
+    return peak / accel + peak / deccel
+
+
+class TrajectoryStreamer(object):
+    """Keep a roboclaw command buffer topped up with trajectory segments
+
+    service() is called every control tick on the port worker. While a trajectory is loaded it
+    reads the buffer depth and queues segments until high_water of them are pending whenever the
+    depth drops below low_water, so motion stays smooth even if ticks are late. The first segment
+    replaces whatever the roboclaw was doing, the rest are buffered behind it.
+    """
+
+    def __init__(self, roboclaw, low_water=2, high_water=6):
+        self.roboclaw = roboclaw
+        self.low_water = low_water
+        self.high_water = high_water
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._started = False
+        self._active = False
+
+    @property
+    def active(self):
+        return self._active
+
+    def load(self, segments):
+        with self._lock:
+            self._pending = deque(segments)
+            self._started = False
+            self._active = bool(segments)
+
+    def cancel(self):
+        with self._lock:
+            self._pending.clear()
+            self._active = False
+
+    def service(self):
+        """Top up the command buffer, return the number of segments sent"""
+        if not self._active:
+            return 0
+        result = self.roboclaw.ReadBuffers()
+        if not result[0]:
+            return 0
+        depth = max(0 if buf == BUFFER_IDLE else buf for buf in result[1:3])
+
+        sent = 0
+        with self._lock:
+            if not self._pending:
+                # everything was queued, done once both motors finished their last segment
+                if result[1] == BUFFER_IDLE and result[2] == BUFFER_IDLE:
+                    self._active = False
+                return 0
+            if self._started and depth >= self.low_water:
+                return 0
+            while self._pending and depth + sent < self.high_water:
+                segment = self._pending[0]
+                if not self.roboclaw.SpeedAccelDistanceM1M2_2(*(segment + (0 if self._started else 1,))):
+                    break
+                self._pending.popleft()
+                self._started = True
+                sent += 1
+        return sent
@@ -0,0 +1,140 @@
+import math
+
+import numpy as np
+
+from .telemetry import monotonic
+
+DUTY_MAX = 32767
+
+
+class Capture(object):
+    """Preallocated arrays of (time, duty, speed) samples taken as fast as the bus allows"""
+
+    def __init__(self, samples):
+        self.t = np.empty(samples)
+        self.duty = np.empty(samples)
+        self.speed = np.empty(samples)
+        self.count = 0
+
+    def trim(self):
+        return self.t[:self.count], self.duty[:self.count], self.speed[:self.count]
+
+
+def _set_duty(roboclaw, motor, duty):
+    duty = int(max(-DUTY_MAX, min(DUTY_MAX, duty)))
+    return roboclaw.DutyM1M2(duty, 0) if motor == 1 else roboclaw.DutyM1M2(0, duty)
+
+
+def capture(roboclaw, motor, samples, duty_fn):
+    """Drive one motor with duty_fn(t, last_speed) and sample its speed back to back
+
+    Each iteration is one duty write (only when it changes) and one speed read, the sample rate is
+    whatever the link sustains. Failed reads are skipped. The motor is stopped at the end.
+    """
+    read = roboclaw.ReadSpeedM1 if motor == 1 else roboclaw.ReadSpeedM2
+    data = Capture(samples)
+    start = monotonic()
+    speed = 0.0
+    duty = None
+    try:
+        while data.count < samples:
+            now = monotonic() - start
+            next_duty = duty_fn(now, speed)
+            if next_duty != duty:
+                _set_duty(roboclaw, motor, next_duty)
+                duty = next_duty
+            result = read()
+            if not result[0]:
+                continue
+            speed = result[1]
+            i = data.count
+            data.t[i] = monotonic() - start
+            data.duty[i] = duty
+            data.speed[i] = speed
+            data.count += 1
+    finally:
+        _set_duty(roboclaw, motor, 0)
+    return data
+
+
+def step_test(roboclaw, motor, duty, samples, delay=0.2):
+    """Open loop step from rest to duty after delay seconds"""
+    return capture(roboclaw, motor, samples, lambda t, speed: duty if t >= delay else 0)
+
+
+def relay_test(roboclaw, motor, setpoint, bias, amplitude, samples):
+    """Relay feedback around a speed setpoint: bias + amplitude below it, bias - amplitude above"""
+    return capture(roboclaw, motor, samples,
+                   lambda t, speed: bias + amplitude if speed < setpoint else bias - amplitude)
+
+
+def fit_step(t, duty, speed):
+    """First order plus dead time fit of a step response: (gain qpps/duty, time constant, dead time)
+
+    Uses the two point method on the 28.3% and 63.2% crossings of the steady state speed (mean of
+    the last fifth of the samples). Raises ValueError when the speed did not respond to the step.
+    """
+    step = np.argmax(duty != duty[0])
+    t0, final_duty = t[step], duty[-1] - duty[0]
+    if not step or not final_duty:
+        raise ValueError("Step test has no duty step")
+    before = speed[:step]
+    steady = speed[-max(1, len(speed) // 5):].mean() - before.mean()
+    if abs(steady) <= max(1.0, 3.0 * before.std()):
+        raise ValueError("Step test did not change the speed, try a larger duty")
+    rise = (speed[step:] - before.mean()) / steady
+    t28, t63 = [_crossing(t[step:], rise, level) for level in (0.283, 0.632)]
+    tau = max(1.5 * (t63 - t28), 1e-6)
+    dead = max(t63 - t0 - tau, 0.0)
+    return steady / final_duty, tau, dead
+
+
+def _crossing(t, rise, level):
+    crossed = rise >= level
+    if not crossed.any():
+        raise ValueError("Step response never reached %.1f%% of its steady state speed, sample for longer"
+                         % (100 * level))
+    return t[np.argmax(crossed)]
+
+
+def fit_relay(t, duty, speed, setpoint, amplitude, cycles=4):
+    """Ultimate gain (duty/qpps) and period (s) from the last cycles of a relay oscillation"""
+    error = speed - setpoint
+    rising = np.flatnonzero((error[:-1] < 0) & (error[1:] >= 0))
+    if len(rising) < 2:
+        raise ValueError("Relay test did not oscillate, try a larger amplitude or more samples")
+    rising = rising[-(cycles + 1):]
+    period = np.diff(t[rising]).mean()
+    window = speed[rising[0]:rising[-1]]
+    oscillation = (window.max() - window.min()) / 2.0
+    if oscillation <= 0:
+        raise ValueError("Relay test produced no speed oscillation")
+    return 4.0 * amplitude / (math.pi * oscillation), period
+
+
+def ziegler_nichols(ku, pu, rule="pi"):
+    """Continuous (kp, ti, td) from the ultimate gain and period"""
+    if rule == "pid":
+        return 0.6 * ku, pu / 2.0, pu / 8.0
+    return 0.45 * ku, pu / 1.2, 0.0
+
+
+def simc(gain, tau, dead, closed_loop=None):
+    """Continuous PI (kp, ti, 0) from a first order plus dead time model, SIMC rules"""
+    if closed_loop is None:
+        closed_loop = max(dead, tau / 4.0)
+    kp = tau / (gain * (closed_loop + dead))
+    ti = min(tau, 4.0 * (closed_loop + dead))
+    return kp, ti, 0.0
+
+
+def discrete_gains(kp, ti, td, period):
+    """Roboclaw velocity P, I, D (duty per qpps of error per loop period) from continuous gains"""
+    ki = kp * period / ti if ti > 0 else 0.0
+    kd = kp * td / period
+    return kp, ki, kd
+
+
+def max_qpps(gain):
+    """Speed the motor reaches at full duty, from the step gain"""
+    return int(round(abs(gain) * DUTY_MAX))
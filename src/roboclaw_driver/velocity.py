@@ -0,0 +1,32 @@
+import numpy as np
+
+
+class SpeedFilter(object):
+    """FIR low pass over a ring buffer of the last taps speed samples, all channels at once
+
+    The weights are a Hann window, one tap passes the samples through. A linear phase filter
+    delays the estimate by (taps - 1) / 2 samples. Until the ring is full, only the samples
+    already in it are weighted.
+    """
+
+    def __init__(self, taps, channels):
+        self.taps = max(int(taps), 1)
+        self.weights = np.hanning(self.taps + 2)[1:-1] if self.taps > 1 else np.ones(1)
+        self.samples = np.zeros((self.taps, channels))
+        self.pos = -1
+        self.count = 0
+        self._ages = np.arange(self.taps)
+
+    def update(self, speeds):
+        """Add one sample per channel, returns the filtered speeds"""
+        self.pos = (self.pos + 1) % self.taps
+        self.samples[self.pos] = speeds
+        self.count = min(self.count + 1, self.taps)
+        # weight of each row by the age of the sample it holds, rows not written yet weigh nothing
+        ages = (self.pos - self._ages) % self.taps
+        weights = np.where(ages < self.count, self.weights[ages], 0.0)
+        return weights.dot(self.samples) / weights.sum()
+
+    def reset(self):
+        self.pos = -1
+        self.count = 0
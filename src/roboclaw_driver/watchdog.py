@@ -0,0 +1,72 @@
+import threading
+
+from .telemetry import monotonic
+
+
+class Watchdog(threading.Thread):
+    """Command timeout as a two state machine on the monotonic clock, in its own thread
+
+    feed() keeps it armed. When timeout seconds pass without one it expires and calls on_expire
+    once, then on_keepalive every keepalive seconds (0 disables it) until it is fed again.
+    Running apart from the control loop, a serial call blocking that loop does not delay the
+    timeout.
+    """
+
+    def __init__(self, timeout, on_expire, keepalive=0.0, on_keepalive=None):
+        threading.Thread.__init__(self, name="roboclaw watchdog")
+        self.daemon = True
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.on_expire = on_expire
+        self.on_keepalive = on_keepalive
+        self._deadline = monotonic() + timeout
+        self._expired = False
+        self._wake = threading.Condition()
+        self._running = True
+
+    @property
+    def expired(self):
+        return self._expired
+
+    def feed(self, hold=0.0):
+        """A command arrived, stay armed for timeout seconds after hold more seconds"""
+        with self._wake:
+            self._deadline = monotonic() + hold + self.timeout
+            self._expired = False
+            self._wake.notify()
+
+    def set_timeout(self, timeout):
+        with self._wake:
+            self._deadline += timeout - self.timeout
+            self.timeout = timeout
+            self._wake.notify()
+
+    def stop(self):
+        with self._wake:
+            self._running = False
+            self._wake.notify()
+
+    def run(self):
+        with self._wake:
+            while self._running:
+                now = monotonic()
+                if not self._expired and now >= self._deadline:
+                    self._expired = True
+                    self._deadline = now + self.keepalive
+                    self._call(self.on_expire)
+                elif self._expired and self.keepalive > 0 and now >= self._deadline:
+                    self._deadline = now + self.keepalive
+                    self._call(self.on_keepalive)
+                elif self._expired and self.keepalive <= 0:
+                    self._wake.wait()
+                else:
+                    self._wake.wait(self._deadline - now)
+
+    def _call(self, fn):
+        # callbacks talk to the ports, feed() must not wait on them
+        self._wake.release()
+        try:
+            if fn is not None:
+                fn()
+        finally:
+            self._wake.acquire()
@@ -0,0 +1,249 @@
+import threading
+import time
+from collections import deque
+
+from .metrics import LatencyHistogram
+from .realtime import apply_thread, collect_idle
+
+
+# time.monotonic is py3 only, fall back to wall time on py2
+monotonic = getattr(time, "monotonic", time.time)
+
+# priority classes, lower runs first
+SAFETY, SETPOINT, ODOMETRY, TELEMETRY, CONFIG = range(5)
+CLASSES = ("safety", "setpoint", "odometry", "telemetry", "config")
+
+# share of the link each class may use while others are waiting, None is unlimited
+DEFAULT_SHARES = (None, 0.4, 0.3, 0.2, 0.1)
+
+
+class Job(object):
+    """A call queued on a PortWorker, wait() blocks until it ran and returns its result or raises its error"""
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.result = None
+        self.error = None
+        self.submitted = monotonic()
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            self.result = self.fn(*self.args)
+        except Exception as e:
+            self.error = e
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise OSError("Timed out waiting for %s" % getattr(self.fn, "__name__", self.fn))
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class CountingSerial(object):
+    """Wrap a serial port and count the bytes written and read through it"""
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self.ser.write(data)
+
+    def read(self, size=1):
+        data = self.ser.read(size)
+        self.bytes += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+
+class ByteBudget(object):
+    """Token bucket per priority class over the byte rate of the link
+
+    A class earns its share of baud / 10 bytes per second, up to window seconds worth, and is
+    charged the bytes its jobs actually moved. A class with no tokens left only runs when no
+    class within its budget is waiting, so the link is never left idle.
+    """
+
+    def __init__(self, baud, shares=DEFAULT_SHARES, window=0.1):
+        self.capacity = baud / 10.0  # 8N1, 10 bits on the wire per byte
+        self.shares = shares
+        self.window = window
+        self.tokens = [self.capacity * share * window if share else 0.0 for share in shares]
+        self.used = [0] * len(shares)
+        self._stamp = monotonic()
+
+    def refill(self, now):
+        elapsed = now - self._stamp
+        self._stamp = now
+        for i, share in enumerate(self.shares):
+            if share:
+                burst = self.capacity * share * self.window
+                self.tokens[i] = min(burst, self.tokens[i] + self.capacity * share * elapsed)
+
+    def allowed(self, priority):
+        return not self.shares[priority] or self.tokens[priority] > 0
+
+    def charge(self, priority, nbytes):
+        self.used[priority] += nbytes
+        if self.shares[priority]:
+            self.tokens[priority] -= nbytes
+
+
+class PortWorker(threading.Thread):
+    """Thread that owns one serial port and runs every transaction for the controllers on it
+
+    Calls are queued with submit() under a priority class and the next one is picked by class
+    within the ByteBudget of the port, so nothing else ever touches the port, a stop never waits
+    behind a burst of diagnostics, and controllers on different ports are serviced in parallel.
+    Wrap the port with meter() so jobs are charged the bytes they moved.
+
+    priority and cpus are the SCHED_FIFO priority and CPU affinity of the thread, realtime notes
+    what took effect. wakeups is a LatencyHistogram of how long the thread took to start a job
+    after it was queued to an idle worker, the scheduling latency the port actually sees.
+    """
+
+    def __init__(self, dev, baud=115200, shares=DEFAULT_SHARES, priority=0, cpus=None):
+        threading.Thread.__init__(self, name="roboclaw %s" % dev)
+        self.daemon = True
+        self.dev = dev
+        self.budget = ByteBudget(baud, shares)
+        self.counter = None
+        self._queues = [deque() for _ in CLASSES]
+        self._cond = threading.Condition()
+        self._running = True
+        self._stats_used = list(self.budget.used)
+        self._stats_stamp = monotonic()
+        self.priority = priority
+        self.cpus = cpus
+        self.realtime = []
+        self.wakeups = LatencyHistogram()
+
+    def meter(self, ser):
+        """The serial port wrapped so the bytes of every job are counted, use it for all controllers"""
+        if self.counter is None:
+            self.counter = CountingSerial(ser)
+        return self.counter
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args) under priority (default CONFIG)"""
+        job = Job(fn, args)
+        with self._cond:
+            self._queues[kwargs.get("priority", CONFIG)].append(job)
+            self._cond.notify()
+        return job
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn on the worker and wait for its result"""
+        return self.submit(fn, *args, priority=kwargs.get("priority", CONFIG)).wait(kwargs.get("timeout"))
+
+    def stop(self):
+        """Exit once the jobs already queued have run"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def stats(self):
+        """Per class (name, queue depth, share of the link used since the last call)"""
+        with self._cond:
+            now = monotonic()
+            elapsed = max(now - self._stats_stamp, 1e-9)
+            used = list(self.budget.used)
+            stats = [(name, len(self._queues[i]),
+                      (used[i] - self._stats_used[i]) / (elapsed * self.budget.capacity))
+                     for i, name in enumerate(CLASSES)]
+            self._stats_used, self._stats_stamp = used, now
+        return stats
+
+    def take_wakeups(self):
+        """The wakeup latencies since the last call"""
+        with self._cond:
+            wakeups, self.wakeups = self.wakeups, LatencyHistogram()
+        return wakeups
+
+    def _next(self):
+        self.budget.refill(monotonic())
+        waiting = None
+        for priority, jobs in enumerate(self._queues):
+            if not jobs:
+                continue
+            if self.budget.allowed(priority):
+                return priority, jobs.popleft()
+            if waiting is None:
+                waiting = priority
+        if waiting is not None:
+            return waiting, self._queues[waiting].popleft()
+        return None, None
+
+    def run(self):
+        self.realtime = apply_thread(self.priority, self.cpus)
+        while True:
+            with self._cond:
+                priority, job = self._next()
+                slept = False
+                while job is None:
+                    if not self._running:
+                        return
+                    self._cond.wait()
+                    slept = True
+                    priority, job = self._next()
+                if slept:
+                    self.wakeups.record(monotonic() - job.submitted)
+            before = self.counter.bytes if self.counter is not None else 0
+            job.run()
+            if self.counter is not None:
+                with self._cond:
+                    self.budget.charge(priority, self.counter.bytes - before)
+            if not any(self._queues):
+                collect_idle()
+
+
+class Rendezvous(object):
+    """Start one call on each of several workers at the same moment
+
+    Every call is queued behind a gate. Once all workers have reached it (or timeout has passed)
+    the gate opens and each records the monotonic time it started its call, so the spread
+    of those stamps is the dispatch skew between ports.
+    """
+
+    def __init__(self, calls, priority=SETPOINT):
+        self.calls = calls  # list of (worker, fn, args)
+        self.priority = priority
+        self.stamps = [None] * len(calls)
+        self._arrived = 0
+        self._lock = threading.Lock()
+        self._go = threading.Event()
+
+    def _gated(self, index, fn, args):
+        with self._lock:
+            self._arrived += 1
+            if self._arrived == len(self.calls):
+                self._go.set()
+        # untimed wait, py2 implements timed waits by polling which would add milliseconds of skew
+        self._go.wait()
+        self.stamps[index] = monotonic()
+        return fn(*args)
+
+    def dispatch(self, timeout):
+        """Queue the calls, the last worker to reach the gate opens it, or we do after timeout"""
+        jobs = [worker.submit(self._gated, i, fn, args, priority=self.priority)
+                for i, (worker, fn, args) in enumerate(self.calls)]
+        self._go.wait(timeout)
+        self._go.set()
+        return jobs
+
+    def skew(self):
+        """Spread in seconds between the first and last call starting, None until all have started"""
+        stamps = self.stamps
+        if not stamps or None in stamps:
+            return None
+        return max(stamps) - min(stamps)
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from roboclaw_driver.blackbox import BlackBox, read_ring
+from roboclaw_driver.roboclaw_driver import Cmd, TransactionStats
+
+
+class EchoSerial(object):
+    def __init__(self):
+        self.pending = b""
+
+    def write(self, data):
+        self.pending = data
+        return len(data)
+
+    def read(self, size=1):
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+class FakeRoboclaw(object):
+    def __init__(self, ser, address=128):
+        self.ser = ser
+        self.address = address
+
+
+class BlackBoxTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "blackbox")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def transact(self, box, roboclaw, cmd, frame, ok=True):
+        box.start(roboclaw, cmd, 0.0)
+        roboclaw.ser.write(frame)
+        roboclaw.ser.read(len(frame))
+        stats = TransactionStats(1 if ok else 3, 0 if ok else 2, 0, 0, len(frame), len(frame))
+        (box.complete if ok else box.failed)(roboclaw, cmd, 1.0, 1.0025, stats)
+
+    def test_round_trip(self):
+        box = BlackBox(self.path, slots=4)
+        roboclaw = FakeRoboclaw(box.tap(EchoSerial()), 129)
+        self.assertIs(box.tap(roboclaw.ser), roboclaw.ser)
+        self.transact(box, roboclaw, Cmd.GETM1ENC, b"\x81\x10")
+        self.transact(box, roboclaw, Cmd.M1FORWARD, b"\x81\x00\x40", ok=False)
+        box.close()
+
+        header, records = read_ring(self.path)
+        self.assertEqual((header["slots"], header["pid"]), (4, os.getpid()))
+        self.assertEqual([record["command"] for record in records], ["GETM1ENC", "M1FORWARD"])
+        first, second = records
+        self.assertEqual((first["address"], first["ok"], first["tx"], first["rx"]),
+                         (129, True, bytearray(b"\x81\x10"), bytearray(b"\x81\x10")))
+        self.assertAlmostEqual(first["latency"], 0.0025, places=6)
+        self.assertEqual((second["ok"], second["attempts"], second["crc_errors"], second["bytes_out"]),
+                         (False, 3, 2, 3))
+
+    def test_ring_keeps_the_newest(self):
+        box = BlackBox(self.path, slots=4)
+        roboclaw = FakeRoboclaw(box.tap(EchoSerial()))
+        for value in range(6):
+            self.transact(box, roboclaw, Cmd.GETM1ENC, bytearray([128, value]))
+        box.close()
+        records = read_ring(self.path)[1]
+        self.assertEqual([record["seq"] for record in records], [3, 4, 5, 6])
+        self.assertEqual([record["tx"][1] for record in records], [2, 3, 4, 5])
+
+    def test_previous_ring_is_kept(self):
+        box = BlackBox(self.path, slots=4)
+        roboclaw = FakeRoboclaw(box.tap(EchoSerial()))
+        self.transact(box, roboclaw, Cmd.GETM1ENC, b"\x80\x10")
+        box.close()
+        BlackBox(self.path, slots=8).close()
+        self.assertEqual(read_ring(self.path)[0]["slots"], 8)
+        self.assertEqual(read_ring(self.path)[1], [])
+        header, records = read_ring(self.path + ".prev")
+        self.assertEqual((header["slots"], len(records)), (4, 1))
+
+    def test_not_a_ring(self):
+        with open(self.path, "wb") as f:
+            f.write(b"\0" * 128)
+        self.assertRaises(ValueError, read_ring, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+
+from roboclaw_driver.roboclaw_driver import Roboclaw
+from roboclaw_driver.simulator import SimClock, SimulatedRoboclaw, SimulatedSerial
+
+
+class ClosedSerial(object):
+    def close(self):
+        pass
+
+
+class CountingRoboclaw(Roboclaw):
+    """Roboclaw whose transactions are answered from memory and counted"""
+
+    def __init__(self):
+        Roboclaw.__init__(self, "fake", ser=ClosedSerial())
+        self.transactions = 0
+        self.ok = 1
+        self.pid = [65536, 32768, 0, 44000]  # p, i, d, qpps in the order they are read
+
+    def _read_n(self, cmd, args):
+        self.transactions += 1
+        return [self.ok] + list(self.pid)
+
+    def _read4(self, cmd):
+        self.transactions += 1
+        return self.ok, 60 << 16 | 340
+
+    def _write0(self, cmd):
+        self.transactions += 1
+        return True
+
+    def _write1(self, cmd, val):
+        return True
+
+    def _write4444(self, cmd, val1, val2, val3, val4):
+        self.transactions += 1
+        # written d, p, i, qpps
+        self.pid = [val2, val3, val1, val4]
+        return True
+
+
+class DriverTest(unittest.TestCase):
+    def setUp(self):
+        self.roboclaw = CountingRoboclaw()
+
+    def test_settings_read_is_cached(self):
+        first = self.roboclaw.ReadM1VelocityPID()
+        self.assertEqual(first[0], 1)
+        self.assertEqual(self.roboclaw.ReadM1VelocityPID(), first)
+        self.assertEqual(self.roboclaw.transactions, 1)
+
+    def test_failed_read_is_not_cached(self):
+        self.roboclaw.ok = 0
+        self.assertEqual(self.roboclaw.ReadMinMaxMainVoltages()[0], 0)
+        self.roboclaw.ok = 1
+        self.assertEqual(self.roboclaw.ReadMinMaxMainVoltages(), (1, 60, 340))
+        self.assertEqual(self.roboclaw.transactions, 2)
+
+    def test_setter_invalidates_its_read(self):
+        self.roboclaw.ReadM1VelocityPID()
+        self.roboclaw.ReadMinMaxMainVoltages()
+        self.assertTrue(self.roboclaw.SetM1VelocityPID(2.0, 0.5, 0.0, 3000))
+        count = self.roboclaw.transactions
+        self.assertEqual(self.roboclaw.ReadM1VelocityPID()[1:], (2.0, 0.5, 0.0, 3000))
+        self.assertEqual(self.roboclaw.transactions, count + 1)
+        # other settings are still served from the cache
+        self.roboclaw.ReadMinMaxMainVoltages()
+        self.assertEqual(self.roboclaw.transactions, count + 1)
+
+    def test_invalidate_settings(self):
+        self.roboclaw.ReadMinMaxMainVoltages()
+        self.roboclaw.InvalidateSettings()
+        self.roboclaw.ReadMinMaxMainVoltages()
+        self.assertEqual(self.roboclaw.transactions, 2)
+
+    def test_restore_defaults_drops_every_setting(self):
+        self.roboclaw.ReadM1VelocityPID()
+        self.roboclaw.ReadMinMaxMainVoltages()
+        self.roboclaw.RestoreDefaults()
+        self.roboclaw.ReadM1VelocityPID()
+        self.roboclaw.ReadMinMaxMainVoltages()
+        self.assertEqual(self.roboclaw.transactions, 5)
+
+
+class SimulatedDriverTest(unittest.TestCase):
+    def setUp(self):
+        self.roboclaw = Roboclaw("sim", ser=SimulatedSerial([SimulatedRoboclaw(128)], SimClock()))
+
+    def test_encoders_and_speeds_in_one_read(self):
+        self.assertTrue(self.roboclaw.SetEncM1(1234))
+        ok, enc1, status1, enc2, status2, speed1, speed2 = self.roboclaw.ReadEncodersSpeeds()
+        self.assertEqual((ok, enc1, enc2, speed1, speed2), (1, 1234, 0, 0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from roboclaw_driver.encoders import BACKWARD, OVERFLOW, UNDERFLOW, WRAP, EncoderAccumulator
+
+
+class EncoderAccumulatorTest(unittest.TestCase):
+    def test_first_count_is_the_signed_reference(self):
+        self.assertEqual(EncoderAccumulator().update(WRAP - 5, 0, 0.0), -5)
+        self.assertEqual(EncoderAccumulator().update(5, 0, 0.0), 5)
+
+    def test_overflow_flag(self):
+        accumulator = EncoderAccumulator()
+        accumulator.update(WRAP - 10, 0, 0.0)
+        self.assertEqual(accumulator.update(20, OVERFLOW, 0.1), -10 + 30)
+
+    def test_underflow_flag(self):
+        accumulator = EncoderAccumulator()
+        accumulator.update(10, 0, 0.0)
+        self.assertEqual(accumulator.update(WRAP - 20, UNDERFLOW | BACKWARD, 0.1), -20)
+
+    def test_lost_flag_goes_the_shortest_way(self):
+        accumulator = EncoderAccumulator()
+        accumulator.update(WRAP - 10, 0, 0.0)
+        self.assertEqual(accumulator.update(20, 0, 0.1), 20)
+
+    def test_flag_wins_over_the_shortest_way(self):
+        # a whole lap less a few counts in one read, only the flag tells it from a small step back
+        accumulator = EncoderAccumulator(max_delta=WRAP)
+        accumulator.update(100, 0, 0.0)
+        self.assertEqual(accumulator.update(90, OVERFLOW, 0.1), 100 + WRAP - 10)
+
+    def test_half_wrap_takes_the_direction_bit(self):
+        accumulator = EncoderAccumulator(max_delta=WRAP)
+        accumulator.update(0, 0, 0.0)
+        self.assertEqual(accumulator.update(WRAP // 2, BACKWARD, 0.1), -WRAP // 2)
+        accumulator = EncoderAccumulator(max_delta=WRAP)
+        accumulator.update(0, 0, 0.0)
+        self.assertEqual(accumulator.update(WRAP // 2, 0, 0.1), WRAP // 2)
+
+    def test_jump_is_a_reset(self):
+        accumulator = EncoderAccumulator(max_delta=1000)
+        accumulator.update(50000, 0, 0.0)
+        self.assertEqual(accumulator.update(0, 0, 0.1), 50000)
+        self.assertEqual(accumulator.resets, 1)
+        # carries on from the new count
+        self.assertEqual(accumulator.update(300, 0, 0.2), 50300)
+
+    def test_limit_grows_with_the_time_between_reads(self):
+        accumulator = EncoderAccumulator(max_delta=100, max_rate=1000.0)
+        accumulator.update(0, 0, 0.0)
+        self.assertEqual(accumulator.update(5000, 0, 5.0), 5000)
+        self.assertEqual(accumulator.resets, 0)
+        self.assertEqual(accumulator.update(7000, 0, 5.1), 5000)
+        self.assertEqual(accumulator.resets, 1)
+
+    def test_reset_starts_over(self):
+        accumulator = EncoderAccumulator()
+        accumulator.update(100, 0, 0.0)
+        accumulator.reset()
+        self.assertEqual(accumulator.update(7, 0, 1.0), 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from roboclaw_driver.errors import ErrorDecoder
+
+OK, WARN, ERROR = 0, 1, 2
+ERRORS = {0x0000: (OK, "Normal"),
+          0x0001: (WARN, "M1 over current"),
+          0x0004: (ERROR, "Emergency Stop"),
+          0x0100: (WARN, "M1 driver fault"),
+          0x0008: (ERROR, "Temperature1 error"),
+          0x1000: (WARN, "Temperature1 warning"),
+          0x8000: (WARN, "Logic batt voltage low warning")}
+
+
+class ErrorDecoderTest(unittest.TestCase):
+    def setUp(self):
+        self.decoder = ErrorDecoder(ERRORS)
+
+    def test_normal(self):
+        self.assertEqual(self.decoder.decode(0x0000), (OK, "Normal", ()))
+
+    def test_every_flag_and_the_worst_level(self):
+        level, summary, messages = self.decoder.decode(0x8105)
+        self.assertEqual(level, ERROR)
+        self.assertEqual(messages, ("M1 over current", "Emergency Stop", "M1 driver fault",
+                                    "Logic batt voltage low warning"))
+        self.assertEqual(summary, ", ".join(messages))
+        self.assertEqual(self.decoder.decode(0x0100)[0], WARN)
+
+    def test_raised_and_cleared(self):
+        raised, cleared = self.decoder.changes(0x0001, 0x0104)
+        self.assertEqual(raised, ["Emergency Stop", "M1 driver fault"])
+        self.assertEqual(cleared, ["M1 over current"])
+        self.assertEqual(self.decoder.changes(None, 0x0001), (["M1 over current"], []))
+
+    def test_changes_are_per_bit(self):
+        # the error clears while the warning on the same sensor stays set
+        self.assertEqual(self.decoder.changes(0x1008, 0x1000), ([], ["Temperature1 error"]))
+        self.assertEqual(self.decoder.changes(0x1000, 0x1000), ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
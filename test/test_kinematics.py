@@ -0,0 +1,36 @@
+import unittest
+
+import numpy as np
+
+from roboclaw_driver import kinematics
+
+
+class KinematicsTest(unittest.TestCase):
+    def test_differential(self):
+        k = kinematics.create("differential", ["right", "left"], 0.4)
+        np.testing.assert_allclose(k.matrix, [[1, 0, 0.2], [1, 0, -0.2]])
+        np.testing.assert_allclose(k.wheel_speeds(1.0, 0.0, 1.0), [1.2, 0.8])
+
+    def test_mecanum_matrix(self):
+        k = kinematics.create("mecanum", ["front_left", "front_right", "rear_left", "rear_right"], 0.4, 0.2)
+        np.testing.assert_allclose(k.matrix, [[1, -1, -0.3], [1, 1, 0.3], [1, 1, -0.3], [1, -1, 0.3]])
+        # strafing left turns the diagonals against each other, the body does not rotate
+        np.testing.assert_allclose(k.wheel_speeds(0.0, 1.0, 0.0), [-1, 1, 1, -1])
+
+    def test_none_channel_and_multipliers(self):
+        k = kinematics.create("skid_steer", ["front_left", "none", "rear_right"], 0.5,
+                              separation_multiplier=2.0, radius_multiplier=2.0)
+        np.testing.assert_allclose(k.matrix, [[0.5, 0, -0.25], [0, 0, 0], [0.5, 0, 0.25]])
+
+    def test_side(self):
+        self.assertEqual(kinematics.Kinematics.side("rear_left"), "left")
+        self.assertEqual(kinematics.Kinematics.side("right"), "right")
+        self.assertIsNone(kinematics.Kinematics.side("none"))
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, kinematics.create, "tank", ["left", "right"], 0.4)
+        self.assertRaises(ValueError, kinematics.create, "differential", ["left", "front_right"], 0.4)
+
+
+if __name__ == "__main__":
+    unittest.main()
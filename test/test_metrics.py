@@ -0,0 +1,74 @@
+import socket
+import unittest
+
+from roboclaw_driver.metrics import CommandMetrics, DriverMetrics, LatencyHistogram, MetricsServer, prometheus
+from roboclaw_driver.roboclaw_driver import Cmd, TransactionStats
+
+
+class LatencyHistogramTest(unittest.TestCase):
+    def test_quantiles(self):
+        histogram = LatencyHistogram()
+        for micros in range(1, 1001):
+            histogram.record(micros / 1e6)
+        self.assertEqual(histogram.count, 1000)
+        self.assertAlmostEqual(histogram.max, 1e-3)
+        # buckets are about 12% wide
+        self.assertTrue(500e-6 <= histogram.quantile(0.5) <= 500e-6 * 1.13)
+        self.assertTrue(990e-6 <= histogram.quantile(0.99) <= 990e-6 * 1.13)
+
+    def test_empty(self):
+        self.assertEqual(LatencyHistogram().quantile(0.5), 0.0)
+
+    def test_cumulative(self):
+        histogram = LatencyHistogram()
+        for seconds in (100e-6, 200e-6, 3e-3):
+            histogram.record(seconds)
+        self.assertEqual(histogram.cumulative([128e-6, 256e-6, 2048e-6, 4096e-6]), [1, 2, 2, 3])
+
+
+class DriverMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = DriverMetrics("front")
+        self.metrics.record(Cmd.GETM1ENC, True, 0.0005, TransactionStats(1, 0, 0, 0, 2, 7))
+        self.metrics.record(Cmd.GETM1ENC, False, 0.02, TransactionStats(3, 1, 2, 1, 6, 14))
+        self.metrics.record(Cmd.M1FORWARD, True, 0.001, TransactionStats(1, 0, 0, 0, 5, 1))
+
+    def test_totals(self):
+        counters, latency = self.metrics.totals()
+        self.assertEqual(counters, {"transactions": 3, "failures": 1, "retries": 2, "crc_errors": 1,
+                                    "timeouts": 2, "resyncs": 1, "bytes_out": 13, "bytes_in": 22})
+        self.assertEqual((latency.count, latency.max), (3, 0.02))
+
+    def test_prometheus(self):
+        text = prometheus([self.metrics])
+        self.assertIn('roboclaw_failures_total{controller="front",command="GETM1ENC"} 1\n', text)
+        self.assertIn('roboclaw_latency_seconds_count{controller="front",command="M1FORWARD"} 1\n', text)
+        self.assertIn('roboclaw_latency_seconds_bucket{controller="front",command="GETM1ENC",le="+Inf"} 2\n', text)
+
+    def test_state_round_trip(self):
+        remote = DriverMetrics("remote")
+        for cmd, command in self.metrics.commands.items():
+            remote.load(cmd, command.state())
+        counters, latency = remote.totals()
+        self.assertEqual(counters, self.metrics.totals()[0])
+        self.assertEqual(latency.counts, self.metrics.totals()[1].counts)
+        self.assertEqual((latency.count, latency.max), (3, 0.02))
+        self.assertAlmostEqual(latency.sum, 0.0215)
+
+    def test_state_is_compact(self):
+        self.assertEqual(CommandMetrics().state()[1], [])
+
+
+class MetricsServerTest(unittest.TestCase):
+    def test_busy_port_raises_socket_error(self):
+        busy = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            busy.bind(("127.0.0.1", 0))
+            busy.listen(1)
+            self.assertRaises(socket.error, MetricsServer, [], busy.getsockname()[1])
+        finally:
+            busy.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+import numpy as np
+
+from roboclaw_driver import kinematics
+from roboclaw_driver.ramp import AccelLimiter
+
+
+class AccelLimiterTest(unittest.TestCase):
+    def test_step_is_synchronised(self):
+        limiter = AccelLimiter([1.0, 2.0])
+        # the first wheel needs 2 s at its limit, the second is slowed to arrive with it
+        np.testing.assert_allclose(limiter.step([0.0, 0.0], [2.0, 1.0], 0.5), [0.5, 0.25])
+        np.testing.assert_allclose(limiter.step([1.5, 0.75], [2.0, 1.0], 0.5), [2.0, 1.0])
+
+    def test_ramp_accels(self):
+        limiter = AccelLimiter([1.0, 2.0])
+        np.testing.assert_allclose(limiter.ramp_accels([0.0, 0.0], [2.0, 1.0]), [1.0, 0.5])
+        # a wheel already at its target keeps its limit
+        np.testing.assert_allclose(limiter.ramp_accels([0.0, 1.0], [2.0, 1.0]), [1.0, 2.0])
+
+    def test_unlimited(self):
+        limiter = AccelLimiter([np.inf, np.inf])
+        self.assertFalse(limiter.limited)
+        np.testing.assert_allclose(limiter.step([0.0, 0.0], [3.0, -3.0], 0.1), [3.0, -3.0])
+
+    def test_from_kinematics(self):
+        k = kinematics.create("differential", ["right", "left"], 0.4)
+        limiter = AccelLimiter.from_kinematics(k, 1.0, 2.0)
+        np.testing.assert_allclose(limiter.accel_limits, [1.4, 1.4])
+        # no lateral axis on a differential drive, an infinite lateral limit must not leak in
+        limiter = AccelLimiter.from_kinematics(k, 1.0, 2.0, np.inf)
+        np.testing.assert_allclose(limiter.accel_limits, [1.4, 1.4])
+
+
+if __name__ == "__main__":
+    unittest.main()
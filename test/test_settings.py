@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from roboclaw_driver import settings
+
+
+class FakeRoboclaw(object):
+    """Holds the raw value of each setting and answers ReadPipelined like the controller would"""
+
+    def __init__(self):
+        self.raw = {"m1_velocity_pid": settings.SETTINGS["m1_velocity_pid"].encode([1.0, 0.5, 0.25, 44000]),
+                    "main_voltages": (60, 340)}
+        self.writes = []
+
+    def ReadPipelined(self, requests):
+        by_cmd = dict((settings.SETTINGS[name].cmd, name) for name in self.raw)
+        replies = []
+        for cmd, length in requests:
+            setting = settings.SETTINGS[by_cmd[cmd]]
+            reply = []
+            for val, (size, scale, signed) in zip(self.raw[by_cmd[cmd]], setting.fields):
+                reply.extend((val >> 8 * shift) & 0xFF for shift in reversed(range(size)))
+            replies.append(reply + [0] * (length - len(reply)))
+        return replies
+
+    def SetM1VelocityPID(self, p, i, d, qpps):
+        self.writes.append("m1_velocity_pid")
+        self.raw["m1_velocity_pid"] = settings.SETTINGS["m1_velocity_pid"].encode([p, i, d, qpps])
+        return True
+
+
+class SettingsTest(unittest.TestCase):
+    def setUp(self):
+        self.roboclaw = FakeRoboclaw()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_encode_decode(self):
+        setting = settings.SETTINGS["m1_velocity_pid"]
+        raw = setting.encode([1.5, 0.25, 0.0, 44000])
+        self.assertEqual(raw, (98304, 16384, 0, 44000))
+        self.assertEqual(setting.decode(raw), (1.5, 0.25, 0.0, 44000))
+        self.assertRaises(ValueError, setting.encode, [1.0])
+
+    def test_decode_signed(self):
+        setting = settings.SETTINGS["m1_position_pid"]
+        raw = setting.encode([1.0, 0.0, 0.0, 0, 0, -100, 100])
+        self.assertEqual(raw[5], 0xFFFFFF9C)
+        self.assertEqual(setting.decode(raw)[5:], (-100, 100))
+
+    def test_diff(self):
+        self.assertEqual(settings.diff({"a": (1,), "b": (2,)}, {"a": (1,), "b": (3,)}), [("b", (2,), (3,))])
+
+    def test_reconcile_writes_only_what_differs(self):
+        profile = {"m1_velocity_pid": [2.0, 0.5, 0.0, 3000], "main_voltages": [60, 340]}
+        changes = settings.reconcile(self.roboclaw, profile)
+        self.assertEqual([name for name, old, new in changes], ["m1_velocity_pid"])
+        self.assertEqual(changes[0][1:], ((1.0, 0.5, 0.25, 44000), (2.0, 0.5, 0.0, 3000)))
+        self.assertEqual(self.roboclaw.writes, ["m1_velocity_pid"])
+        self.assertEqual(settings.reconcile(self.roboclaw, profile), [])
+        self.assertEqual(self.roboclaw.writes, ["m1_velocity_pid"])
+
+    def test_read_only_setting_raises(self):
+        self.roboclaw.raw["deadband"] = (5, 5)
+        self.assertRaises(OSError, settings.reconcile, self.roboclaw, {"deadband": [10, 10]})
+
+    def test_snapshot_cache_skips_the_read(self):
+        cache = settings.SnapshotCache(os.path.join(self.directory, "cache", "snapshots.yaml"))
+        profile = {"m1_velocity_pid": [2.0, 0.5, 0.0, 3000]}
+        settings.reconcile(self.roboclaw, profile, cache, "sim 128")
+        reloaded = settings.SnapshotCache(cache.path)
+        # a matching entry means nothing is read, so no roboclaw is needed
+        self.assertIsNone(settings.reconcile(None, profile, reloaded, "sim 128"))
+
+
+if __name__ == "__main__":
+    unittest.main()
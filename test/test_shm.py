@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from roboclaw_driver.shm import Ring
+
+
+class RingTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "ring")
+        self.producer = Ring(self.path, slots=4, slot_size=64, create=True)
+        self.consumer = Ring(self.path)
+
+    def tearDown(self):
+        self.consumer.close()
+        self.producer.close(unlink=True)
+        shutil.rmtree(self.directory)
+
+    def test_geometry_is_read_by_path(self):
+        self.assertEqual((self.consumer.slots, self.consumer.slot_size), (4, 64))
+
+    def test_empty(self):
+        self.assertIsNone(self.consumer.get())
+
+    def test_full(self):
+        for i in range(4):
+            self.assertTrue(self.producer.put(i))
+        self.assertFalse(self.producer.put(4))
+        self.assertEqual(self.consumer.get(), 0)
+        self.assertTrue(self.producer.put(4))
+
+    def test_wraparound_keeps_order(self):
+        received = []
+        for i in range(23):
+            self.assertTrue(self.producer.put(("sample", i)))
+            if i % 3 == 2:
+                while True:
+                    message = self.consumer.get()
+                    if message is None:
+                        break
+                    received.append(message[1])
+        self.assertEqual(received, list(range(21)))
+        self.assertEqual([self.consumer.get(), self.consumer.get(), self.consumer.get()],
+                         [("sample", 21), ("sample", 22), None])
+
+    def test_too_big(self):
+        self.assertRaises(ValueError, self.producer.put, "x" * 64)
+
+
+if __name__ == "__main__":
+    unittest.main()
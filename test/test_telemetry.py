@@ -0,0 +1,67 @@
+import unittest
+
+from roboclaw_driver.telemetry import TelemetryCache, TelemetryPoller, monotonic
+
+
+class FakeRoboclaw(object):
+    def __init__(self):
+        self.calls = []
+        self.ok = True
+
+    def ReadError(self):
+        self.calls.append("ReadError")
+        return self.ok, 0x0001
+
+    def ReadTemp(self):
+        self.calls.append("ReadTemp")
+        return self.ok, 253
+
+    def ReadCurrents(self):
+        self.calls.append("ReadCurrents")
+        return self.ok, 120, 80
+
+
+class TelemetryCacheTest(unittest.TestCase):
+    def test_never_read(self):
+        cache = TelemetryCache()
+        self.assertEqual(cache.get("temp1", "default"), ("default", None))
+        self.assertIsNone(cache.oldest_age(["temp1"]))
+
+    def test_age_is_the_stalest_item(self):
+        cache = TelemetryCache()
+        now = monotonic()
+        cache.set("temp1", 253, now - 2.0)
+        cache.set("error", 0, now - 0.5)
+        value, age = cache.get("temp1")
+        self.assertEqual(value, 253)
+        self.assertTrue(2.0 <= age < 3.0)
+        self.assertTrue(2.0 <= cache.oldest_age(["temp1", "error"]) < 3.0)
+        self.assertIsNone(cache.oldest_age(["temp1", "temp2"]))
+
+
+class TelemetryPollerTest(unittest.TestCase):
+    def setUp(self):
+        self.roboclaw = FakeRoboclaw()
+        self.cache = TelemetryCache()
+        reads = [("error", "ReadError"), ("temp1", "ReadTemp"), ("currents", "ReadCurrents")]
+        self.poller = TelemetryPoller(self.roboclaw, self.cache, reads, decimation=2)
+
+    def test_round_robin_with_decimation(self):
+        polled = [self.poller.poll() for _ in range(8)]
+        self.assertEqual(polled, [None, "error", None, "temp1", None, "currents", None, "error"])
+        self.assertEqual(self.roboclaw.calls, ["ReadError", "ReadTemp", "ReadCurrents", "ReadError"])
+        self.assertEqual(self.cache.get("temp1")[0], 253)
+        self.assertEqual(self.cache.get("currents")[0], (120, 80))
+
+    def test_failed_read_keeps_the_stale_value(self):
+        self.cache.set("error", 0x0002, monotonic() - 5.0)
+        self.roboclaw.ok = False
+        self.poller.poll()
+        self.assertEqual(self.poller.poll(), "error")
+        value, age = self.cache.get("error")
+        self.assertEqual(value, 0x0002)
+        self.assertTrue(age >= 5.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from roboclaw_driver.trajectory import move_duration, split_reversals, wheel_segments
+
+
+class WheelSegmentsTest(unittest.TestCase):
+    def test_ramp(self):
+        self.assertEqual(wheel_segments([0.0, 1.0, 3.0], [0, 1000, 1000], [0, -500, 0]),
+                         [(1000, 1000, 500, 500, -500, 250), (1, 1000, 2000, 250, 0, 500)])
+
+    def test_sign_change_is_split_at_rest(self):
+        segments = wheel_segments([0.0, 1.0], [1000, -1000], [400, 400])
+        self.assertEqual(segments, [(2000, 0, 250, 1, 400, 200), (2000, -1000, 250, 1, 400, 200)])
+        # the distance covered both ways, not the difference
+        self.assertEqual(sum(segment[2] for segment in segments), 500)
+
+    def test_both_motors_reverse_at_different_times(self):
+        times, speeds1, speeds2 = split_reversals([0.0, 1.0], [1000, -3000], [-1000, 1000])
+        self.assertEqual(times, [0.0, 0.25, 0.5, 1.0])
+        self.assertEqual(speeds1, [1000, 0.0, -1000.0, -3000])
+        self.assertEqual(speeds2, [-1000, -500.0, 0.0, 1000])
+
+    def test_touching_zero_is_not_split(self):
+        times, _, _ = split_reversals([0.0, 1.0, 2.0], [1000, 0, -1000], [0, 0, 0])
+        self.assertEqual(times, [0.0, 1.0, 2.0])
+
+    def test_times_must_increase(self):
+        self.assertRaises(ValueError, wheel_segments, [0.0, 1.0, 1.0], [0, 1, 2], [0, 1, 2])
+
+
+class MoveDurationTest(unittest.TestCase):
+    def test_trapezoid(self):
+        # 0.5 s up to speed, 1 s down, 3 s cruising
+        self.assertAlmostEqual(move_duration(250 + 3000 + 500, 1000, 2000, 1000), 4.5)
+        self.assertAlmostEqual(move_duration(-3750, 1000, 2000, 1000), 4.5)
+
+    def test_triangle(self):
+        # too short to reach speed: accelerate 1 s and brake 1 s
+        self.assertAlmostEqual(move_duration(1000, 5000, 1000, 1000), 2.0)
+        self.assertEqual(move_duration(0, 1000, 1000, 1000), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
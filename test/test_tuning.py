@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from roboclaw_driver import tuning
+
+
+def fopdt_step(gain, tau, dead, duty=1000, delay=0.2, duration=1.5, samples=3000):
+    """Step response of a first order plus dead time motor"""
+    t = np.linspace(0.0, duration, samples)
+    duty = np.where(t >= delay, duty, 0)
+    moving = np.clip(t - delay - dead, 0.0, None)
+    speed = gain * duty * (1.0 - np.exp(-moving / tau))
+    return t, duty, speed
+
+
+class FitStepTest(unittest.TestCase):
+    def test_recovers_the_model(self):
+        gain, tau, dead = tuning.fit_step(*fopdt_step(2.0, 0.1, 0.02))
+        self.assertAlmostEqual(gain, 2.0, places=3)
+        self.assertAlmostEqual(tau, 0.1, delta=0.002)
+        self.assertAlmostEqual(dead, 0.02, delta=0.002)
+
+    def test_reverse_step(self):
+        gain, tau, _ = tuning.fit_step(*fopdt_step(2.0, 0.1, 0.02, duty=-1000))
+        self.assertAlmostEqual(gain, 2.0, places=3)
+        self.assertAlmostEqual(tau, 0.1, delta=0.002)
+        self.assertEqual(tuning.max_qpps(2.0), 65534)
+
+    def test_stalled_motor(self):
+        t, duty, _ = fopdt_step(2.0, 0.1, 0.02)
+        noise = np.random.RandomState(0).normal(0.0, 3.0, len(t))
+        self.assertRaises(ValueError, tuning.fit_step, t, duty, noise)
+
+    def test_no_duty_step(self):
+        t, _, speed = fopdt_step(2.0, 0.1, 0.02)
+        self.assertRaises(ValueError, tuning.fit_step, t, np.zeros(len(t)), speed)
+
+
+class RulesTest(unittest.TestCase):
+    def test_simc(self):
+        # closed loop time constant defaults to the larger of the dead time and tau / 4
+        kp, ti, td = tuning.simc(2.0, 0.1, 0.02)
+        self.assertAlmostEqual(kp, 0.1 / (2.0 * 0.045))
+        self.assertAlmostEqual(ti, 0.1)
+        kp, ti, td = tuning.simc(2.0, 1.0, 0.1, closed_loop=0.1)
+        self.assertAlmostEqual(kp, 2.5)
+        self.assertAlmostEqual(ti, 0.8)
+
+    def test_ziegler_nichols(self):
+        self.assertEqual(tuning.ziegler_nichols(10.0, 1.2), (4.5, 1.0, 0.0))
+        self.assertEqual(tuning.ziegler_nichols(10.0, 1.2, "pid"), (6.0, 0.6, 0.15))
+
+    def test_discrete_gains(self):
+        kp, ki, kd = tuning.discrete_gains(2.0, 0.5, 0.1, 0.01)
+        self.assertAlmostEqual(ki, 0.04)
+        self.assertAlmostEqual(kd, 20.0)
+        self.assertEqual(tuning.discrete_gains(2.0, 0.0, 0.0, 0.01), (2.0, 0.0, 0.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
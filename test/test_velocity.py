@@ -0,0 +1,41 @@
+import unittest
+
+import numpy as np
+
+from roboclaw_driver.velocity import SpeedFilter
+
+
+class SpeedFilterTest(unittest.TestCase):
+    def test_one_tap_passes_through(self):
+        speed_filter = SpeedFilter(1, 2)
+        np.testing.assert_allclose(speed_filter.update([3.0, -4.0]), [3.0, -4.0])
+        np.testing.assert_allclose(speed_filter.update([5.0, 6.0]), [5.0, 6.0])
+
+    def test_constant_stays_constant(self):
+        speed_filter = SpeedFilter(5, 2)
+        for _ in range(12):
+            np.testing.assert_allclose(speed_filter.update([100.0, -50.0]), [100.0, -50.0])
+
+    def test_partial_ring_weighs_only_samples(self):
+        speed_filter = SpeedFilter(4, 1)
+        np.testing.assert_allclose(speed_filter.update([10.0]), [10.0])
+
+    def test_step_is_smoothed_and_settles(self):
+        speed_filter = SpeedFilter(3, 1)
+        for _ in range(3):
+            speed_filter.update([0.0])
+        smoothed = speed_filter.update([10.0])[0]
+        self.assertTrue(0.0 < smoothed < 10.0)
+        for _ in range(3):
+            settled = speed_filter.update([10.0])[0]
+        self.assertAlmostEqual(settled, 10.0)
+
+    def test_reset(self):
+        speed_filter = SpeedFilter(3, 1)
+        speed_filter.update([10.0])
+        speed_filter.reset()
+        np.testing.assert_allclose(speed_filter.update([2.0]), [2.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import threading
+import time
+import unittest
+
+from roboclaw_driver.watchdog import Watchdog
+
+
+class WatchdogTest(unittest.TestCase):
+    def setUp(self):
+        self.expiries = []
+        self.keepalives = []
+        self.expired = threading.Event()
+        self.watchdog = None
+
+    def tearDown(self):
+        self.watchdog.stop()
+        self.watchdog.join(1.0)
+
+    def start(self, timeout, keepalive=0.0):
+        def on_expire():
+            self.expiries.append(time.time())
+            self.expired.set()
+        self.watchdog = Watchdog(timeout, on_expire, keepalive, lambda: self.keepalives.append(time.time()))
+        self.watchdog.start()
+
+    def test_expires_once_without_keepalive(self):
+        self.start(0.05)
+        self.assertTrue(self.expired.wait(1.0))
+        time.sleep(0.2)
+        self.assertTrue(self.watchdog.expired)
+        self.assertEqual(len(self.expiries), 1)
+        self.assertEqual(self.keepalives, [])
+
+    def test_feeding_keeps_it_armed(self):
+        self.start(0.1)
+        for _ in range(15):
+            self.watchdog.feed()
+            time.sleep(0.02)
+        self.assertEqual(self.expiries, [])
+        self.assertFalse(self.watchdog.expired)
+        self.assertTrue(self.expired.wait(1.0))
+
+    def test_hold_delays_the_expiry(self):
+        self.start(0.05)
+        start = time.time()
+        self.watchdog.feed(hold=0.2)
+        self.assertTrue(self.expired.wait(1.0))
+        self.assertTrue(self.expiries[0] - start >= 0.25)
+
+    def test_keepalive_until_fed_again(self):
+        self.start(0.05, keepalive=0.05)
+        self.assertTrue(self.expired.wait(1.0))
+        time.sleep(0.3)
+        self.assertTrue(len(self.keepalives) >= 2)
+        self.expired.clear()
+        self.watchdog.feed()
+        self.assertFalse(self.watchdog.expired)
+        count = len(self.keepalives)
+        self.assertTrue(self.expired.wait(1.0))
+        # fed, it went back to armed and expired a second time
+        self.assertEqual(len(self.expiries), 2)
+        self.assertTrue(len(self.keepalives) <= count + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
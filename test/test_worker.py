@@ -0,0 +1,108 @@
+import threading
+import time
+import unittest
+
+from roboclaw_driver.worker import (CONFIG, ODOMETRY, SAFETY, SETPOINT, TELEMETRY, ByteBudget, PortWorker,
+                                    Rendezvous, monotonic)
+
+
+class NullSerial(object):
+    def write(self, data):
+        return len(data)
+
+    def read(self, size=1):
+        return b""
+
+
+class ByteBudgetTest(unittest.TestCase):
+    def test_charge_and_refill(self):
+        budget = ByteBudget(10000, window=0.1)  # 1000 bytes/s, setpoint bursts 40
+        self.assertEqual(budget.tokens[SETPOINT], 40.0)
+        budget.charge(SETPOINT, 50)
+        self.assertFalse(budget.allowed(SETPOINT))
+        self.assertTrue(budget.allowed(TELEMETRY))
+        budget.refill(budget._stamp + 0.05)
+        self.assertTrue(budget.allowed(SETPOINT))
+        self.assertAlmostEqual(budget.tokens[SETPOINT], 10.0, places=3)
+        # never more than window seconds worth
+        budget.refill(budget._stamp + 10.0)
+        self.assertAlmostEqual(budget.tokens[SETPOINT], 40.0)
+        self.assertEqual(budget.used[SETPOINT], 50)
+
+    def test_safety_is_unlimited(self):
+        budget = ByteBudget(10000)
+        budget.charge(SAFETY, 10 ** 6)
+        self.assertTrue(budget.allowed(SAFETY))
+
+
+class PortWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.order = []
+
+    def run_worker(self, worker, jobs):
+        # queue everything before the thread starts so the order only depends on the scheduling
+        counter = worker.meter(NullSerial())
+        for name, priority in jobs:
+            worker.submit(lambda name: (self.order.append(name), counter.write(b"x" * 10)), name,
+                          priority=priority)
+        self.assertEqual([depth for _, depth, _ in worker.stats()],
+                         [sum(1 for _, p in jobs if p == i) for i in range(5)])
+        worker.start()
+        worker.stop()
+        worker.join(1.0)
+
+    def test_classes_run_in_priority_order(self):
+        self.run_worker(PortWorker("port"), [("config", CONFIG), ("telemetry", TELEMETRY), ("odometry", ODOMETRY),
+                                             ("setpoint", SETPOINT), ("safety", SAFETY)])
+        self.assertEqual(self.order, ["safety", "setpoint", "odometry", "telemetry", "config"])
+
+    def test_class_over_budget_does_not_starve_the_others(self):
+        # 100 bytes/s, each job moves 10 bytes: a setpoint burst is 4 and config 1
+        jobs = [("setpoint%d" % i, SETPOINT) for i in range(5)] + [("config%d" % i, CONFIG) for i in range(2)]
+        self.run_worker(PortWorker("port", baud=1000), jobs)
+        # once every class is over budget the link is not left idle, plain priority decides
+        self.assertEqual(self.order, ["setpoint0", "config0", "setpoint1", "setpoint2", "setpoint3", "setpoint4",
+                                      "config1"])
+
+
+class RendezvousTest(unittest.TestCase):
+    def setUp(self):
+        self.workers = [PortWorker("port%d" % i) for i in range(3)]
+        for worker in self.workers:
+            worker.start()
+
+    def tearDown(self):
+        for worker in self.workers:
+            worker.stop()
+            worker.join(1.0)
+
+    def busy(self, worker, fn):
+        """Have worker run fn and wait until it started, so nothing queued later can go first"""
+        started = threading.Event()
+        worker.submit(lambda: (started.set(), fn()))
+        self.assertTrue(started.wait(1.0))
+
+    def test_calls_start_together(self):
+        # one port is still busy with an earlier transaction
+        self.busy(self.workers[1], lambda: time.sleep(0.05))
+        rendezvous = Rendezvous([(worker, monotonic, ()) for worker in self.workers])
+        started = [job.wait(1.0) for job in rendezvous.dispatch(1.0)]
+        self.assertTrue(max(started) - min(started) < 0.01)
+        self.assertTrue(rendezvous.skew() < 0.01)
+
+    def test_timeout_opens_the_gate(self):
+        blocked = threading.Event()
+        self.busy(self.workers[2], blocked.wait)
+        rendezvous = Rendezvous([(worker, monotonic, ()) for worker in self.workers])
+        jobs = rendezvous.dispatch(0.05)
+        jobs[0].wait(1.0)
+        jobs[1].wait(1.0)
+        self.assertFalse(jobs[2].done())
+        self.assertIsNone(rendezvous.skew())
+        blocked.set()
+        jobs[2].wait(1.0)
+        self.assertTrue(rendezvous.skew() > 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()